@@ -8,6 +8,10 @@ from source.settings import config_logging
 from source.decompile import decompile_apk
 from source.arguments import parse_args
 from source.manifest_analysis import manifest_analysis
+from source.manifest_diff import manifest_diff
+from source.compact import benchmark_memory
+from source.watch import watch_folder
+from source.search_index import search_names
 from source import __version__
 
 def main():
@@ -19,8 +23,17 @@ def main():
 
     # input arguments
     args = parse_args()
-    if args.path is not None:
-        decompile_apk(args.path)
-        manifest_analysis()
+    if args.command == 'diff':
+        manifest_diff(args.apk_paths)
+    elif args.command == 'watch':
+        watch_folder(args.directory, args.locale)
+    elif args.command == 'search':
+        for row in search_names(args.pattern, args.section):
+            print('\t'.join(row))
+    elif args.command == 'benchmark':
+        benchmark_memory()
+    elif args.path is not None:
+        decompile_apk(args.path, args.decode_workers)
+        manifest_analysis(args.locale, args.workers, args.sections)
     elif args.version:
         logging.info('AMA version %s', __version__)
@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" APK metadata module. """
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import zlib
+from collections import namedtuple
+
+APK_METADATA_SECTION = 'APK Metadata'
+APK_METADATA_FILE = 'apk_metadata.json'
+
+ApkMetadata = namedtuple('ApkMetadata', [
+    'fileSize',
+    'compressedSize',
+    'uncompressedSize',
+    'entries',
+    'dexCount',
+    'abis',
+    'signatureSchemes',
+    'v1Certificates',
+    'v2Certificates',
+    'v3Certificates'])
+
+# ZIP records
+EOCD_SIGNATURE = b'PK\x05\x06'
+CENTRAL_SIGNATURE = b'PK\x01\x02'
+LOCAL_SIGNATURE = b'PK\x03\x04'
+EOCD = struct.Struct('<4s4HIIH')
+CENTRAL_ENTRY = struct.Struct('<4s6H3I5HII')
+LOCAL_HEADER = struct.Struct('<4s5H3I2H')
+MAX_COMMENT_SIZE = 0xFFFF
+ZIP64_MARKER = 0xFFFFFFFF
+
+# Compression methods
+STORED = 0
+DEFLATED = 8
+
+# APK Signing Block
+SIGNING_BLOCK_MAGIC = b'APK Sig Block 42'
+SIGNING_BLOCK_FOOTER = struct.Struct('<Q16s')
+SIGNATURE_SCHEME_V2_ID = 0x7109871a
+SIGNATURE_SCHEME_V3_ID = 0xf05368c0
+
+# JAR signature block files of the v1 scheme
+V1_SIGNATURE_FILE = re.compile(r'^META-INF/[^/]+\.(RSA|DSA|EC)$', re.IGNORECASE)
+DEX_FILE = re.compile(r'^classes\d*\.dex$')
+
+# DER tags
+DER_SEQUENCE = 0x30
+DER_CONTEXT_0 = 0xa0
+
+
+def read_apk_metadata(apk_path):
+    """
+    APK level facts read from the ZIP structure of an apk file
+
+    Only the end of central directory, the central directory, the APK
+    Signing Block and the v1 signature block files are read; the other
+    entries are never decompressed.
+
+    @param apk_path: apk file path
+    @type  apk_path: str
+
+    @return: apk metadata
+    @rtype: ApkMetadata
+    """
+    with open(apk_path, 'rb') as apk_file, \
+            mmap.mmap(apk_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        cd_offset, cd_size = find_central_directory(data)
+        entries = read_central_directory(data, cd_offset, cd_size)
+
+        compressed_size = uncompressed_size = dex_count = 0
+        abis = set()
+        v1_certificates = set()
+        for name, method, compressed, uncompressed, local_offset in entries:
+            compressed_size += compressed
+            uncompressed_size += uncompressed
+            if DEX_FILE.match(name):
+                dex_count += 1
+            elif name.startswith('lib/') and name.count('/') >= 2:
+                abis.add(name.split('/', 2)[1])
+            elif V1_SIGNATURE_FILE.match(name):
+                pkcs7 = read_entry(data, method, compressed, local_offset)
+                v1_certificates.update(certificate_fingerprints(pkcs7_certificates(pkcs7)))
+
+        blocks = read_signing_block(data, cd_offset)
+        v2_certificates = signer_certificates(blocks.get(SIGNATURE_SCHEME_V2_ID))
+        v3_certificates = signer_certificates(blocks.get(SIGNATURE_SCHEME_V3_ID))
+
+        schemes = tuple(scheme for scheme, certificates in (('v1', v1_certificates),
+                                                             ('v2', v2_certificates),
+                                                             ('v3', v3_certificates))
+                        if certificates)
+        return ApkMetadata(len(data),
+                           compressed_size,
+                           uncompressed_size,
+                           len(entries),
+                           dex_count,
+                           tuple(sorted(abis)),
+                           schemes,
+                           tuple(sorted(v1_certificates)),
+                           tuple(sorted(v2_certificates)),
+                           tuple(sorted(v3_certificates)))
+
+
+def find_central_directory(data):
+    """
+    Locate the central directory from the end of central directory record
+
+    @param data: apk file
+    @type  data: mmap
+
+    @return: (central directory offset, central directory size)
+    @rtype: tuple
+    """
+    search_start = max(0, len(data) - EOCD.size - MAX_COMMENT_SIZE)
+    eocd_offset = data.rfind(EOCD_SIGNATURE, search_start)
+    if eocd_offset < 0:
+        raise ValueError('Not a zip file: end of central directory not found')
+
+    _, _, _, _, _, cd_size, cd_offset, _ = EOCD.unpack_from(data, eocd_offset)
+    if cd_offset == ZIP64_MARKER or cd_size == ZIP64_MARKER:
+        raise ValueError('ZIP64 apk files are not supported')
+    if cd_offset + cd_size > eocd_offset:
+        raise ValueError('Central directory overlaps the end of central directory')
+    return cd_offset, cd_size
+
+
+def read_central_directory(data, cd_offset, cd_size):
+    """
+    Entries of the central directory
+
+    @param data: apk file
+    @type  data: mmap
+
+    @param cd_offset: central directory offset
+    @type  cd_offset: int
+
+    @param cd_size: central directory size
+    @type  cd_size: int
+
+    @return: (name, method, compressed size, uncompressed size, local header offset) per entry
+    @rtype: list
+    """
+    entries = []
+    offset = cd_offset
+    end = cd_offset + cd_size
+    while offset < end:
+        (signature, _, _, _, method, _, _, _, compressed, uncompressed,
+         name_length, extra_length, comment_length, _, _, _,
+         local_offset) = CENTRAL_ENTRY.unpack_from(data, offset)
+        if signature != CENTRAL_SIGNATURE:
+            raise ValueError('Bad central directory entry at %d' % offset)
+
+        name_start = offset + CENTRAL_ENTRY.size
+        name = data[name_start:name_start + name_length].decode('utf-8', 'replace')
+        entries.append((name, method, compressed, uncompressed, local_offset))
+        offset = name_start + name_length + extra_length + comment_length
+    return entries
+
+
+def read_entry(data, method, compressed, local_offset):
+    """
+    Uncompressed content of an entry
+
+    @param data: apk file
+    @type  data: mmap
+
+    @param method: compression method
+    @type  method: int
+
+    @param compressed: compressed size
+    @type  compressed: int
+
+    @param local_offset: local header offset
+    @type  local_offset: int
+
+    @return: content
+    @rtype: bytes
+    """
+    signature, _, _, _, _, _, _, _, _, name_length, extra_length = \
+        LOCAL_HEADER.unpack_from(data, local_offset)
+    if signature != LOCAL_SIGNATURE:
+        raise ValueError('Bad local header at %d' % local_offset)
+
+    start = local_offset + LOCAL_HEADER.size + name_length + extra_length
+    content = data[start:start + compressed]
+    if method == DEFLATED:
+        return zlib.decompress(content, -zlib.MAX_WBITS)
+    if method == STORED:
+        return content
+    raise ValueError('Unsupported compression method %d' % method)
+
+
+def read_signing_block(data, cd_offset):
+    """
+    ID-value pairs of the APK Signing Block, which sits right before the
+    central directory
+
+    @param data: apk file
+    @type  data: mmap
+
+    @param cd_offset: central directory offset
+    @type  cd_offset: int
+
+    @return: block id -> value, empty without a signing block
+    @rtype: dict
+    """
+    footer_offset = cd_offset - SIGNING_BLOCK_FOOTER.size
+    if footer_offset < 8:
+        return {}
+    block_size, magic = SIGNING_BLOCK_FOOTER.unpack_from(data, footer_offset)
+    if magic != SIGNING_BLOCK_MAGIC:
+        return {}
+
+    block_offset = cd_offset - block_size - 8
+    if block_offset < 0 or struct.unpack_from('<Q', data, block_offset)[0] != block_size:
+        raise ValueError('Corrupted APK Signing Block')
+
+    blocks = {}
+    offset = block_offset + 8
+    while offset < footer_offset:
+        pair_size, block_id = struct.unpack_from('<QI', data, offset)
+        blocks[block_id] = data[offset + 12:offset + 8 + pair_size]
+        offset += 8 + pair_size
+    return blocks
+
+
+def length_prefixed(data):
+    """
+    Items of a sequence of uint32 length-prefixed values
+
+    @param data: sequence
+    @type  data: bytes
+
+    @return: values
+    @rtype: list
+    """
+    items = []
+    offset = 0
+    while offset + 4 <= len(data):
+        (length,) = struct.unpack_from('<I', data, offset)
+        items.append(data[offset + 4:offset + 4 + length])
+        offset += 4 + length
+    return items
+
+
+def signer_certificates(scheme_block):
+    """
+    Certificate fingerprints of a v2/v3 signature scheme block
+
+    Both schemes start every signer with signed data made of the digests
+    followed by the certificates, all length-prefixed.
+
+    @param scheme_block: signature scheme block, None when absent
+    @type  scheme_block: bytes
+
+    @return: SHA-256 fingerprints
+    @rtype: set
+    """
+    if not scheme_block:
+        return set()
+
+    certificates = []
+    for signers in length_prefixed(scheme_block)[:1]:
+        for signer in length_prefixed(signers):
+            signed_data = length_prefixed(signer)[0]
+            encoded_certificates = length_prefixed(signed_data)[1]
+            certificates.extend(length_prefixed(encoded_certificates))
+    return certificate_fingerprints(certificates)
+
+
+def der_element(data, offset):
+    """
+    DER element at an offset
+
+    @param data: DER data
+    @type  data: bytes
+
+    @param offset: element offset
+    @type  offset: int
+
+    @return: (tag, content start, content end)
+    @rtype: tuple
+    """
+    tag = data[offset]
+    length = data[offset + 1]
+    offset += 2
+    if length == 0x80:
+        raise ValueError('Indefinite length encoding is not supported')
+    if length & 0x80:
+        length_size = length & 0x7f
+        length = int.from_bytes(data[offset:offset + length_size], 'big')
+        offset += length_size
+    return tag, offset, offset + length
+
+
+def der_children(data, start, end):
+    """
+    Child elements of a constructed DER element
+
+    @param data: DER data
+    @type  data: bytes
+
+    @return: (tag, element start, content start, content end) per child
+    @rtype: list
+    """
+    children = []
+    offset = start
+    while offset < end:
+        tag, content_start, content_end = der_element(data, offset)
+        children.append((tag, offset, content_start, content_end))
+        offset = content_end
+    return children
+
+
+def pkcs7_certificates(pkcs7):
+    """
+    DER certificates of a PKCS#7 SignedData (v1 signature block file)
+
+    @param pkcs7: ContentInfo
+    @type  pkcs7: bytes
+
+    @return: certificates
+    @rtype: list
+    """
+    tag, start, end = der_element(pkcs7, 0)
+    if tag != DER_SEQUENCE:
+        raise ValueError('Not a PKCS#7 ContentInfo')
+
+    # ContentInfo ::= SEQUENCE { contentType, [0] EXPLICIT SignedData }
+    content = der_children(pkcs7, start, end)[1]
+    _, signed_start, signed_end = der_element(pkcs7, content[2])
+
+    # SignedData ::= SEQUENCE { version, digestAlgorithms, contentInfo,
+    #                           [0] IMPLICIT certificates OPTIONAL, ... }
+    for tag, _, start, end in der_children(pkcs7, signed_start, signed_end)[3:]:
+        if tag == DER_CONTEXT_0:
+            return [pkcs7[element_start:element_end]
+                    for _, element_start, _, element_end in der_children(pkcs7, start, end)]
+    return []
+
+
+def certificate_fingerprints(certificates):
+    """
+    SHA-256 fingerprints of DER certificates
+
+    @param certificates: DER certificates
+    @type  certificates: list
+
+    @return: hex digests
+    @rtype: set
+    """
+    return {hashlib.sha256(certificate).hexdigest() for certificate in certificates}
+
+
+def save_apk_metadata(apk_path, decompiled_path):
+    """
+    Read the metadata of an apk file and store it in its decompiled folder
+
+    @param apk_path: apk file path
+    @type  apk_path: str
+
+    @param decompiled_path: decompiled apk folder
+    @type  decompiled_path: str
+    """
+    try:
+        metadata = read_apk_metadata(apk_path)
+    except (OSError, ValueError, IndexError, struct.error, zlib.error) as err:
+        logging.error('Reading the metadata of the apk file %s: %s', apk_path, err)
+        return
+
+    metadata_path = os.path.join(decompiled_path, APK_METADATA_FILE)
+    try:
+        with open(metadata_path, 'w') as metadata_file:
+            json.dump(metadata._asdict(), metadata_file)
+    except OSError as err:
+        logging.error('Writing the apk metadata %s: %s', metadata_path, err)
+
+
+def load_apk_metadata(app_folder):
+    """
+    Stored metadata of a decompiled apk
+
+    @param app_folder: decompiled apk folder
+    @type  app_folder: str
+
+    @return: APK Metadata section rows, empty when it was not stored or can not be read
+    @rtype: list
+    """
+    metadata_path = os.path.join(app_folder, APK_METADATA_FILE)
+    try:
+        with open(metadata_path) as metadata_file:
+            fields = json.load(metadata_file)
+    except FileNotFoundError:
+        return []
+    except (OSError, ValueError) as err:
+        logging.error('Reading the apk metadata %s: %s', metadata_path, err)
+        return []
+    if not isinstance(fields, dict):
+        logging.error('Reading the apk metadata %s: not an object', metadata_path)
+        return []
+    return [ApkMetadata._make(tuple(value) if isinstance(value, list) else value
+                              for value in (fields.get(field) for field in ApkMetadata._fields))]
@@ -3,6 +3,12 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+from source.settings import (
+    RESOURCES_LOCALE,
+    WORKERS,
+    DECODE_WORKERS
+)
+from source.parser_manifest import select_sections
 
 """ Arguments Module. """
 
@@ -19,9 +25,69 @@ def parse_args():
                         dest='path',
                         help='apk path <file or directory>',
                         type=str)
+    parser.add_argument('--locale',
+                        dest='locale',
+                        default=RESOURCES_LOCALE,
+                        help='locale used to resolve resource references <en, pt-BR, ...>',
+                        type=str)
+    parser.add_argument('--workers',
+                        dest='workers',
+                        default=WORKERS,
+                        help='number of manifest parsing processes',
+                        type=int)
+    parser.add_argument('--decode-workers',
+                        dest='decode_workers',
+                        default=DECODE_WORKERS,
+                        help='number of concurrent apktool decodes',
+                        type=int)
+    parser.add_argument('--sections',
+                        dest='sections',
+                        help='comma separated sections to extract and report '
+                             '<uses-permission,provider,apk-metadata,...>, all by default',
+                        type=sections_arg)
     parser.add_argument('--version',
                         dest='version',
                         action='store_true',
                         help='version')
+
+    subparsers = parser.add_subparsers(dest='command')
+    diff_parser = subparsers.add_parser('diff',
+                                        help='diff the manifests of apk versions')
+    diff_parser.add_argument('apk_paths',
+                             nargs='+',
+                             help='apk files <old new ...> or a directory of versions',
+                             type=str)
+    watch_parser = subparsers.add_parser('watch',
+                                         help='analyse the apk files dropped in a directory')
+    watch_parser.add_argument('directory',
+                              help='watched directory',
+                              type=str)
+    search_parser = subparsers.add_parser('search',
+                                          help='search the names and authorities of the analysed apps')
+    search_parser.add_argument('pattern',
+                               help='regular expression searched anywhere in the names',
+                               type=str)
+    search_parser.add_argument('--section',
+                               dest='section',
+                               help='only search a section <\'<receiver>\', \'<permission>\', ...>',
+                               type=str)
+    subparsers.add_parser('benchmark',
+                          help='memory held per app by the extracted results of the database')
     args = parser.parse_args()
     return args
+
+
+def sections_arg(value):
+    """
+    Section names of the --sections argument
+
+    @param value: comma separated section keys
+    @type  value: str
+
+    @return: section names
+    @rtype: list
+    """
+    try:
+        return select_sections(value)
+    except ValueError as err:
+        raise argparse.ArgumentTypeError(str(err))
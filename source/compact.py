@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Compact in-memory results module. """
+
+import gc
+import sys
+import logging
+import os
+import tracemalloc
+import xml.dom.minidom
+from xml.parsers.expat import ExpatError
+from source.settings import DATABASE_DIR
+from source.parser_manifest import (
+    MANIFEST_SECTIONS,
+    extract_manifest
+)
+from source.manifest_schema import (
+    EXTRACTORS,
+    PLAIN_EXTRACTORS,
+    FLAG_SETS,
+    intern_value
+)
+
+
+class ResultStore:
+    """
+    Extracted sections of many apps
+
+    Strings are interned and identical records are stored once, so the same
+    permission, feature or framework component declared by thousands of apps
+    costs a single tuple. Booleans are the True/False/None singletons and
+    enum attributes are interned strings, so every column is one pointer.
+    """
+    __slots__ = ('records', 'apps')
+
+    def __init__(self):
+        self.records = {}
+        self.apps = {}
+
+    def add(self, app_folder, sections):
+        """
+        Store the sections of an app
+
+        @param app_folder: decompiled apk folder
+        @type  app_folder: str
+
+        @param sections: section name -> list of records
+        @type  sections: dict
+
+        @return: compacted sections
+        @rtype: dict
+        """
+        compacted = compact_sections(sections, self.records)
+        self.apps[sys.intern(app_folder)] = compacted
+        return compacted
+
+    def __getitem__(self, app_folder):
+        return self.apps[app_folder]
+
+    def __contains__(self, app_folder):
+        return app_folder in self.apps
+
+    def __iter__(self):
+        return iter(self.apps)
+
+    def __len__(self):
+        return len(self.apps)
+
+    def items(self):
+        """
+        (app folder, sections) pairs
+        """
+        return self.apps.items()
+
+
+def compact_record(record, records):
+    """
+    Shared instance of a record
+
+    @param record: section record
+    @type  record: namedtuple
+
+    @param records: record -> shared record
+    @type  records: dict
+
+    @return: shared record
+    @rtype: namedtuple
+    """
+    shared = records.get(record)
+    if shared is None:
+        shared = record._make(intern_value(value) for value in record)
+        records[shared] = shared
+    return shared
+
+
+def compact_sections(sections, records):
+    """
+    Compact the sections of an app
+
+    Also re-interns results that were unpickled from another process.
+
+    @param sections: section name -> list of records
+    @type  sections: dict
+
+    @param records: record -> shared record
+    @type  records: dict
+
+    @return: section name -> tuple of shared records
+    @rtype: dict
+    """
+    return {sys.intern(section): tuple(compact_record(record, records) for record in rows)
+            for section, rows in sections.items()}
+
+
+def pack_sections(sections):
+    """
+    Picklable form of the sections of an app: one tuple of plain value tuples
+    per section, in MANIFEST_SECTIONS order, None for the sections that were
+    not extracted
+
+    @param sections: section name -> list of records
+    @type  sections: dict
+
+    @return: packed sections
+    @rtype: tuple
+    """
+    return tuple(tuple(tuple(record) for record in sections[section])
+                 if section in sections else None
+                 for section in MANIFEST_SECTIONS)
+
+
+def unpack_sections(packed):
+    """
+    Sections of an app from their packed form
+
+    @param packed: packed sections (see pack_sections)
+    @type  packed: tuple
+
+    @return: section name -> list of records
+    @rtype: dict
+    """
+    return {section: [record._make(values) for values in rows]
+            for (section, record), rows in zip(MANIFEST_SECTIONS.items(), packed)
+            if rows is not None}
+
+
+def benchmark_memory(database_dir=DATABASE_DIR):
+    """
+    Measure the memory held by the extracted results of the decompiled apks,
+    as plain per-app lists and in a ResultStore
+
+    The plain results keep the values as parsed, without interning. Both
+    variants are extracted once unmeasured, so the one-time allocations of
+    the first extraction (caches, compiled extractors) are charged to
+    neither, and the shared flag sets are cleared before each measured run,
+    so both runs count every object they hold.
+
+    @param database_dir: decompiled apks folder
+    @type  database_dir: str
+
+    @return: (plain bytes per app, compact bytes per app)
+    @rtype: tuple
+    """
+    manifest_paths = [os.path.join(database_dir, app_folder, 'AndroidManifest.xml')
+                      for app_folder in os.listdir(database_dir)]
+    manifest_paths = [path for path in manifest_paths if os.path.isfile(path)]
+    if not manifest_paths:
+        logging.error('Could not find decompiled apks in %s', database_dir)
+        return None
+
+    def extract(store, extractors):
+        results = store()
+        for manifest_path in manifest_paths:
+            try:
+                manifest_xml = xml.dom.minidom.parse(manifest_path)
+            except ExpatError:
+                continue
+            sections = extract_manifest(manifest_xml, extractors=extractors)
+            if isinstance(results, ResultStore):
+                results.add(manifest_path, sections)
+            else:
+                results[manifest_path] = sections
+        return results
+
+    def measure(store, extractors):
+        FLAG_SETS.clear()
+        gc.collect()
+        tracemalloc.start()
+        results = extract(store, extractors)
+        # release the dom trees (minidom nodes hold reference cycles)
+        gc.collect()
+        held, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return held // max(1, len(results)), len(results)
+
+    # warm-up
+    extract(dict, PLAIN_EXTRACTORS)
+    extract(ResultStore, EXTRACTORS)
+
+    plain, apps = measure(dict, PLAIN_EXTRACTORS)
+    compact, _ = measure(ResultStore, EXTRACTORS)
+    logging.info('Memory per app for %d apps: %d bytes plain, %d bytes compact',
+                 apps, plain, compact)
+    return plain, compact
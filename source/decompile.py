@@ -3,23 +3,48 @@
 
 """ Decompile APK module. """
 
+import functools
 import logging
-import tempfile
+import time
 import os
 from os import listdir
 from source.settings import (
     DATABASE_DIR,
     TOOLS_DIR,
-    APKTOOL_JAR
+    APKTOOL_JAR,
+    DECODE_WORKERS
+)
+from source.apk_metadata import save_apk_metadata
+from source.scheduler import (
+    BULK,
+    INTERACTIVE,
+    Scheduler
+)
+from source.framework import (
+    worker_framework_dir,
+    private_framework_dir,
+    adopt_framework,
+    release_framework_dir,
+    remove_framework_dir
+)
+from source.metrics import (
+    APKS_DECODED,
+    APKS_DECODE_FAILED,
+    BYTES_READ,
+    STAGE_SECONDS,
+    track_progress
 )
 
-def decompile_apk(apk_path):
+def decompile_apk(apk_path, workers=DECODE_WORKERS):
     """
     Decompile android application
 
     @param apk_path: Apk path <file or folder>
     @type  apk_path: str
 
+    @param workers: Number of concurrent decodes
+    @type  workers: int
+
     @return: An boolean:
                 True: Apk decompiled successful
                 False: Failed to decompile the apk file
@@ -28,11 +53,12 @@ def decompile_apk(apk_path):
     status = False
     if os.path.isdir(apk_path):
         apk_files = find_apk_filenames(apk_path)
-        for apk_file in apk_files:
-            status = decompile_cmd(apk_file, apk_path)
+        status = decompile_apks(apk_files, apk_path, workers)
 
     elif os.path.isfile(apk_path):
-        status = decompile_cmd(apk_path)
+        # a single apk is an interactive job, waited for by the user
+        status = decompile_apks([os.path.basename(apk_path)], os.path.dirname(apk_path),
+                                workers, INTERACTIVE)
 
     else:
         logging.error('Could not find the file or directory %s', apk_path)
@@ -40,7 +66,46 @@ def decompile_apk(apk_path):
     return status
 
 
-def decompile_cmd(apkfile_path, root_path=None):
+def decompile_apks(apk_files, root_path=None, workers=DECODE_WORKERS, priority=BULK):
+    """
+    Decompile apk files concurrently
+
+    The decodes are ordered by the scheduler, shortest first. Each worker
+    owns an apktool framework directory, warmed from the master framework
+    cache, so concurrent decodes never share framework files.
+
+    @param apk_files: Apk file paths
+    @type  apk_files: list
+
+    @param root_path: Root path of the apk files
+    @type  root_path: str
+
+    @param workers: Number of concurrent decodes
+    @type  workers: int
+
+    @param priority: Scheduler priority class <interactive or bulk>
+    @type  priority: str
+
+    @return: An boolean:
+                True: Every apk decompiled successful
+                False: Failed to decompile at least one apk file
+    @rtype: bool
+    """
+    if not apk_files:
+        return False
+
+    with track_progress('decode', len(apk_files), APKS_DECODED, APKS_DECODE_FAILED), \
+            Scheduler(min(workers, len(apk_files)),
+                      worker_framework_dir, release_framework_dir) as scheduler:
+        futures = [scheduler.submit(os.path.join(root_path or '', apk_file), priority,
+                                    functools.partial(decompile_cmd, apk_file, root_path))
+                   for apk_file in apk_files]
+        statuses = [future.exception() is None and future.result() for future in futures]
+
+    return all(statuses)
+
+
+def decompile_cmd(apkfile_path, root_path=None, frame_path=None, database_dir=DATABASE_DIR):
     """
     Run decompile command
 
@@ -50,6 +115,12 @@ def decompile_cmd(apkfile_path, root_path=None):
     @param root_path: Root path of an apk file
     @type  root_path: str
 
+    @param frame_path: apktool framework directory, a private one is used when None
+    @type  frame_path: str
+
+    @param database_dir: folder of the decompiled apk folders
+    @type  database_dir: str
+
     @return: An boolean:
                 True: Apk decompiled successful
                 False: Failed to decompile the apk file
@@ -63,26 +134,46 @@ def decompile_cmd(apkfile_path, root_path=None):
     # decompile the apk file
     status = False
     if os.path.isfile(apktool_path):
+        # private framework directory
+        private_frame_path = frame_path is None
+        if private_frame_path:
+            frame_path = private_framework_dir()
+
         # apktool command
         apk_foldername = os.path.basename(os.path.normpath(apkfile_path))
-        decompiled_path = DATABASE_DIR + '/' + apk_foldername
+        decompiled_path = database_dir + '/' + apk_foldername
+        # no resource decode (-r): apktool keeps the raw resources.arsc, used
+        # to resolve references on demand, and still decodes the manifest
         cmd_apktool_decompile = 'java -jar ' + \
             apktool_path + \
             ' --match-original' + \
             ' --frame-path ' + \
-            tempfile.gettempdir() + \
+            frame_path + \
             ' -f' + \
             ' -s' + \
+            ' -r' + \
+            ' --force-manifest' + \
             ' d ' + \
             apkfile_path + \
             ' -o' + \
             decompiled_path
 
         # execute the apktool command
+        start = time.perf_counter()
         if os.system(cmd_apktool_decompile) == 0:
             status = True
+            adopt_framework(frame_path)
+            save_apk_metadata(apkfile_path, decompiled_path)
+            APKS_DECODED.inc()
         else:
             logging.error('Decompiling the apk file: %s', apkfile_path)
+            APKS_DECODE_FAILED.inc()
+        STAGE_SECONDS.observe('decode', time.perf_counter() - start)
+        if os.path.isfile(apkfile_path):
+            BYTES_READ.inc(os.path.getsize(apkfile_path))
+
+        if private_frame_path:
+            remove_framework_dir(frame_path)
     else:
         logging.error('Could not find the apktool file: %s', apktool_path)
 
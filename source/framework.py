@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" apktool framework cache module. """
+
+import fcntl
+import hashlib
+import itertools
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+from source.settings import (
+    FRAMEWORK_DIR,
+    FRAMEWORK_APK,
+    FRAMEWORK_SHA256,
+    TOOLS_DIR,
+    APKTOOL_JAR
+)
+
+# apktool stores the android framework of a --frame-path as 1.apk, copied
+# from this resource of its jar when the directory has none
+FRAMEWORK_FILE = '1.apk'
+BUILTIN_FRAMEWORK = 'brut/androlib/android-framework.jar'
+HASH_SUFFIX = '.sha256'
+SOURCE_SUFFIX = '.source'
+LOCK_SUFFIX = '.lock'
+
+MASTER_DIR = os.path.join(FRAMEWORK_DIR, 'master')
+
+_MASTER_LOCK = threading.Lock()
+
+# file path -> ((mtime, size), SHA-256)
+_DIGESTS = {}
+_DIGESTS_LOCK = threading.Lock()
+
+# worker framework directory -> descriptor of its lock file
+_WORKER_LOCKS = {}
+_WORKER_LOCKS_LOCK = threading.Lock()
+
+
+def file_sha256(path):
+    """
+    SHA-256 of a file
+
+    @param path: file path
+    @type  path: str
+
+    @return: hex digest
+    @rtype: str
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as input_file:
+        for block in iter(lambda: input_file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cached_sha256(path):
+    """
+    SHA-256 of a file, computed again only when its mtime or size changed
+
+    @param path: file path
+    @type  path: str
+
+    @return: hex digest
+    @rtype: str
+    """
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _DIGESTS_LOCK:
+        cached = _DIGESTS.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    digest = file_sha256(path)
+    with _DIGESTS_LOCK:
+        _DIGESTS[path] = (signature, digest)
+    return digest
+
+
+def read_hash(framework_path, suffix=HASH_SUFFIX):
+    """
+    Recorded hash of a cached framework
+
+    @param framework_path: cached framework file
+    @type  framework_path: str
+
+    @param suffix: HASH_SUFFIX for the hash of the file, SOURCE_SUFFIX for
+                   the source it was installed from (see framework_source)
+    @type  suffix: str
+
+    @return: recorded value, None when it was not recorded
+    @rtype: str
+    """
+    try:
+        with open(framework_path + suffix) as hash_file:
+            return hash_file.read().strip()
+    except OSError:
+        return None
+
+
+def framework_source():
+    """
+    Source the master framework must be installed from: the hash of the
+    pinned FRAMEWORK_APK, or of the apktool jar for its built-in framework
+
+    @return: source, None when the pinned framework can not be read
+    @rtype: str
+    """
+    if FRAMEWORK_APK:
+        try:
+            return 'apk:' + cached_sha256(FRAMEWORK_APK)
+        except OSError as err:
+            logging.error('Reading the framework %s: %s', FRAMEWORK_APK, err)
+            return None
+
+    apktool_path = os.path.join(TOOLS_DIR, APKTOOL_JAR)
+    try:
+        return 'apktool:' + cached_sha256(apktool_path)
+    except OSError:
+        return 'apktool'
+
+
+def store_master(framework_path, sha256, source):
+    """
+    Publish a framework file as the master copy
+
+    The file, its source and its hash are written next to the master and
+    renamed in place, the hash last, so concurrent runs never see a partial
+    framework with a valid hash.
+
+    @param framework_path: framework file
+    @type  framework_path: str
+
+    @param sha256: hash of the framework file
+    @type  sha256: str
+
+    @param source: source of the framework (see framework_source)
+    @type  source: str
+    """
+    os.makedirs(MASTER_DIR, exist_ok=True)
+    master_path = os.path.join(MASTER_DIR, FRAMEWORK_FILE)
+    tmp_fd, tmp_path = tempfile.mkstemp(dir=MASTER_DIR)
+    os.close(tmp_fd)
+    shutil.copyfile(framework_path, tmp_path)
+    for suffix, value in ((SOURCE_SUFFIX, source), (HASH_SUFFIX, sha256)):
+        with open(tmp_path + suffix, 'w') as hash_file:
+            hash_file.write(value)
+    os.replace(tmp_path, master_path)
+    os.replace(tmp_path + SOURCE_SUFFIX, master_path + SOURCE_SUFFIX)
+    os.replace(tmp_path + HASH_SUFFIX, master_path + HASH_SUFFIX)
+
+
+def master_framework():
+    """
+    Validated master copy of the framework
+
+    With a pinned FRAMEWORK_APK the master is installed from it through
+    apktool. Without a pinned framework the master is the built-in framework
+    of the apktool jar, or else is adopted from the first decode (see
+    adopt_framework). The source of the master is recorded next to it, so
+    the master is installed again when FRAMEWORK_APK, the pinned file or the
+    apktool jar changes. A master that does not match its hash is not used.
+
+    @return: master framework file, None when there is none yet
+    @rtype: str
+    """
+    master_path = os.path.join(MASTER_DIR, FRAMEWORK_FILE)
+    with _MASTER_LOCK:
+        source = framework_source()
+        if source is None:
+            return None
+
+        if os.path.isfile(master_path):
+            recorded = read_hash(master_path)
+            if not recorded or recorded != cached_sha256(master_path):
+                logging.warning('The framework cache %s does not match its hash', master_path)
+            elif read_hash(master_path, SOURCE_SUFFIX) != source:
+                logging.info('The framework source changed, installing the framework again')
+            else:
+                return master_path
+
+        if not FRAMEWORK_APK:
+            return extract_builtin_framework(source)
+
+        if FRAMEWORK_SHA256 and source != 'apk:' + FRAMEWORK_SHA256:
+            logging.error('The framework %s does not match its pinned hash', FRAMEWORK_APK)
+            return None
+
+        os.makedirs(FRAMEWORK_DIR, exist_ok=True)
+        install_dir = tempfile.mkdtemp(dir=FRAMEWORK_DIR)
+        try:
+            framework_path = install_framework(FRAMEWORK_APK, install_dir)
+            if framework_path is None:
+                return None
+            store_master(framework_path, file_sha256(framework_path), source)
+        finally:
+            shutil.rmtree(install_dir, ignore_errors=True)
+
+        return master_path
+
+
+def extract_builtin_framework(source):
+    """
+    Publish the framework built into the apktool jar as the master copy
+
+    This is the file apktool writes as 1.apk in an empty --frame-path, so
+    the workers start warm without installing it. The caller holds the
+    master lock.
+
+    @param source: source of the framework (see framework_source)
+    @type  source: str
+
+    @return: master framework file, None when the jar has no built-in framework
+    @rtype: str
+    """
+    apktool_path = os.path.join(TOOLS_DIR, APKTOOL_JAR)
+    if not os.path.isfile(apktool_path):
+        return None
+
+    os.makedirs(MASTER_DIR, exist_ok=True)
+    tmp_fd, tmp_path = tempfile.mkstemp(dir=MASTER_DIR)
+    try:
+        with zipfile.ZipFile(apktool_path) as apktool_jar, \
+                apktool_jar.open(BUILTIN_FRAMEWORK) as framework_file, \
+                os.fdopen(tmp_fd, 'wb') as output_file:
+            shutil.copyfileobj(framework_file, output_file)
+        store_master(tmp_path, file_sha256(tmp_path), source)
+    except (OSError, KeyError, zipfile.BadZipFile) as err:
+        logging.warning('No built-in framework in %s: %s', apktool_path, err)
+        return None
+    finally:
+        os.remove(tmp_path)
+
+    return os.path.join(MASTER_DIR, FRAMEWORK_FILE)
+
+
+def install_framework(framework_apk, frame_path):
+    """
+    Install a framework apk with apktool
+
+    @param framework_apk: framework apk file
+    @type  framework_apk: str
+
+    @param frame_path: apktool framework directory
+    @type  frame_path: str
+
+    @return: installed framework file, None on failure
+    @rtype: str
+    """
+    apktool_path = os.path.join(TOOLS_DIR, APKTOOL_JAR)
+    cmd_apktool_install = 'java -jar ' + \
+        apktool_path + \
+        ' if ' + \
+        framework_apk + \
+        ' --frame-path ' + \
+        frame_path
+
+    framework_path = os.path.join(frame_path, FRAMEWORK_FILE)
+    if os.system(cmd_apktool_install) != 0 or not os.path.isfile(framework_path):
+        logging.error('Installing the framework: %s', framework_apk)
+        return None
+    return framework_path
+
+
+def worker_framework_dir(slot):
+    """
+    Claim the framework directory of a decode worker
+
+    Worker directories are kept between runs. A directory is claimed with a
+    lock on its lock file, so concurrent workers and runs never share one; a
+    worker takes the directory of its slot, or the next free one. Its
+    framework is checked against the master and copied again only when it
+    differs.
+
+    @param slot: worker number
+    @type  slot: int
+
+    @return: apktool --frame-path directory (see release_framework_dir)
+    @rtype: str
+    """
+    os.makedirs(FRAMEWORK_DIR, exist_ok=True)
+    for number in itertools.count(slot):
+        frame_path = os.path.join(FRAMEWORK_DIR, 'worker-%d' % number)
+        lock_fd = os.open(frame_path + LOCK_SUFFIX, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(lock_fd)
+            continue
+        with _WORKER_LOCKS_LOCK:
+            _WORKER_LOCKS[frame_path] = lock_fd
+        break
+
+    os.makedirs(frame_path, exist_ok=True)
+    warm_framework_dir(frame_path)
+    return frame_path
+
+
+def private_framework_dir():
+    """
+    New framework directory for a single decode, warmed from the master
+
+    @return: apktool --frame-path directory (see remove_framework_dir)
+    @rtype: str
+    """
+    os.makedirs(FRAMEWORK_DIR, exist_ok=True)
+    frame_path = tempfile.mkdtemp(prefix='private-', dir=FRAMEWORK_DIR)
+    warm_framework_dir(frame_path)
+    return frame_path
+
+
+def warm_framework_dir(frame_path):
+    """
+    Make the framework of a directory a verified copy of the master
+
+    @param frame_path: apktool framework directory
+    @type  frame_path: str
+    """
+    master_path = master_framework()
+    if master_path is None:
+        return
+
+    master_hash = read_hash(master_path)
+    framework_path = os.path.join(frame_path, FRAMEWORK_FILE)
+    if os.path.isfile(framework_path) and cached_sha256(framework_path) == master_hash:
+        return
+
+    shutil.copyfile(master_path, framework_path)
+    if cached_sha256(framework_path) != master_hash:
+        logging.warning('Framework copy %s does not match the master, apktool will '
+                        'reinstall it', framework_path)
+        os.remove(framework_path)
+
+
+def adopt_framework(frame_path):
+    """
+    Use the framework written by apktool in a worker directory as master copy
+    when there is none yet, so the next workers start warm. A pinned
+    framework is only ever installed from FRAMEWORK_APK.
+
+    @param frame_path: apktool framework directory
+    @type  frame_path: str
+    """
+    master_path = os.path.join(MASTER_DIR, FRAMEWORK_FILE)
+    framework_path = os.path.join(frame_path, FRAMEWORK_FILE)
+    if FRAMEWORK_APK or os.path.isfile(master_path) or not os.path.isfile(framework_path):
+        return
+
+    with _MASTER_LOCK:
+        if not os.path.isfile(master_path):
+            store_master(framework_path, file_sha256(framework_path), framework_source())
+
+
+def release_framework_dir(frame_path):
+    """
+    Release the framework directory of a worker, which is kept for the next runs
+
+    @param frame_path: apktool framework directory
+    @type  frame_path: str
+    """
+    with _WORKER_LOCKS_LOCK:
+        lock_fd = _WORKER_LOCKS.pop(frame_path, None)
+    if lock_fd is not None:
+        fcntl.flock(lock_fd, fcntl.LOCK_UN)
+        os.close(lock_fd)
+
+
+def remove_framework_dir(frame_path):
+    """
+    Remove a private framework directory
+
+    @param frame_path: apktool framework directory
+    @type  frame_path: str
+    """
+    shutil.rmtree(frame_path, ignore_errors=True)
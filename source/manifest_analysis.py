@@ -1,86 +1,373 @@
-
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
 """ AndroidManifest.xml analysis module. """
 
+import logging
+import multiprocessing
 import os
+import functools
+import threading
+import time
 import xml.dom.minidom
-from source.settings import DATABASE_DIR
+from xml.parsers.expat import ExpatError
+from source.settings import (
+    DATABASE_DIR,
+    RESOURCES_LOCALE,
+    WORKERS,
+    REPORT_WRITERS,
+    REPORT_QUEUE_SIZE
+)
 from source.report import generate_report
-from source.parser_manifest import (
-    get_package,
-    get_version_code,
-    get_version_name,
-    get_uses_feature,
-    get_uses_sdk,
-    get_permission,
-    get_uses_permission,
-    get_uses_permission_sdk23,
-    get_services,
-    get_receivers,
-    get_providers
+from source.resources_arsc import (
+    RESOURCES_ARSC,
+    load_resource_table
+)
+from source.parser_manifest import ManifestResult
+from source.apk_metadata import (
+    APK_METADATA_SECTION,
+    load_apk_metadata
+)
+from source.compact import (
+    pack_sections,
+    unpack_sections
+)
+from source.search_index import (
+    IndexWriter,
+    index_entries
+)
+from source.scheduler import batch_order
+from source.metrics import (
+    APKS_PROCESSED,
+    APKS_FAILED,
+    BYTES_READ,
+    BYTES_WRITTEN,
+    REPORT_BACKLOG,
+    STAGE_SECONDS,
+    track_progress
 )
 
+# Per-process state of the parsing workers (see init_worker)
+WORKER_STATE = {}
 
-def manifest_analysis():
+
+def manifest_analysis(locale=RESOURCES_LOCALE, workers=WORKERS, sections=None):
     """
     Android Manifest Analysis.
-    
+
+    Manifests are parsed by a pool of worker processes and the reports are
+    written by dedicated writer processes. A manifest that can not be parsed
+    only fails its own app. The apps are analysed in the order of a bulk
+    scheduler class (see batch_order), their cost estimated from the size of
+    their manifest and resource table.
+
+    Only the requested sections are extracted and reported. The search index
+    is updated by the runs that extract every section.
+
+    @param locale: locale used to resolve resource references
+    @type  locale: str
+
+    @param workers: number of parsing processes
+    @type  workers: int
+
+    @param sections: section names, every section when None
+    @type  sections: list
+
+    @return: app folders that could not be analysed
+    @rtype: list
+
     Tags:
     - <uses-sdk>
     - <uses-feature>
     - <permission>
     - <uses-permission>
     - <uses-permission-sdk23>
+    - <application>
+    - <activity>
+    - <activity-alias>
     - <service>
     - <receiver>
-    - <provider>    
-    """
-    database = os.listdir(DATABASE_DIR)
-    for app_folder in database:
-        manifest_xml = xml.dom.minidom.parse(DATABASE_DIR + app_folder + '/AndroidManifest.xml')
-
-        # app basic information
-        app_basic_info_list = []
-        package_name = get_package(manifest_xml)
-        version_code = get_version_code(manifest_xml)
-        version_name = get_version_name(manifest_xml)
-        app_basic_info = (package_name, version_code, version_name)
-        app_basic_info_list.append(app_basic_info)
-
-        # get <uses-sdk> data
-        uses_sdk = get_uses_sdk(manifest_xml)
-
-        # get <uses-feature> data
-        uses_feature = get_uses_feature(manifest_xml)
-
-        # get <permission> data
-        permission = get_permission(manifest_xml)
-
-        # get <uses-permission> data
-        uses_permission = get_uses_permission(manifest_xml)
-
-        # get <uses-permission-sdk23> data
-        uses_permission_sdk23 = get_uses_permission_sdk23(manifest_xml)
-
-        # get <service> data
-        services = get_services(manifest_xml)
-
-        # get <receiver> data
-        receivers = get_receivers(manifest_xml)
-
-        # get <provider> data
-        providers = get_providers(manifest_xml)
-
-        # Generate report
-        generate_report(app_folder,                 # APK filename
-                        app_basic_info_list,        # Basic information of an APK
-                        uses_sdk,                   # <uses-sdk>
-                        uses_feature,               # <uses-feature>
-                        permission,                 # <permission>
-                        uses_permission,            # <uses-permission>
-                        uses_permission_sdk23,      # <uses-permission-sdk23>
-                        services,                   # <service>
-                        receivers,                  # <receiver>
-                        providers)                  # <provider>
+    - <provider>
+    - <intent-filter>
+    - <meta-data>
+    """
+    app_folders = batch_order(os.listdir(DATABASE_DIR), app_size, workers)
+    index = IndexWriter() if sections is None else None
+    with track_progress('analysis', len(app_folders), APKS_PROCESSED, APKS_FAILED):
+        if workers <= 1 or len(app_folders) <= 1:
+            failed = [app_folder for app_folder in app_folders
+                      if not analyse_app_serial(app_folder, locale, index, sections)]
+        else:
+            failed = analyse_apps_parallel(app_folders, locale, workers, index, sections)
+    if index is not None:
+        index.flush()
+
+    if failed:
+        logging.error('Could not analyse %d app(s): %s', len(failed), ', '.join(failed))
+    return failed
+
+
+def analyse_apps_parallel(app_folders, locale, workers, index, sections):
+    """
+    Parse the manifests in a process pool and hand them to the report writers
+
+    Folders are submitted in chunks so the inter-process traffic is one
+    message per chunk, and parsed apps go straight from the workers to the
+    writers through a bounded queue. The writers send the outcome of every
+    report back on a second queue.
+
+    @param app_folders: decompiled apk folders
+    @type  app_folders: list
+
+    @param locale: locale used to resolve resource references
+    @type  locale: str
+
+    @param workers: number of parsing processes
+    @type  workers: int
+
+    @param index: search index updated with the names of the apps, or None
+    @type  index: IndexWriter
+
+    @param sections: section names, every section when None
+    @type  sections: list
+
+    @return: app folders that could not be analysed
+    @rtype: list
+    """
+    report_queue = multiprocessing.Queue(REPORT_QUEUE_SIZE)
+    done_queue = multiprocessing.Queue()
+    writers = [multiprocessing.Process(target=report_writer, args=(report_queue, done_queue))
+               for _ in range(REPORT_WRITERS)]
+    for writer in writers:
+        writer.start()
+    report_failed = []
+    collector = threading.Thread(target=collect_reports, args=(done_queue, report_failed))
+    collector.start()
+
+    failed = []
+    chunksize = max(1, len(app_folders) // (workers * 4))
+    try:
+        with multiprocessing.Pool(workers,
+                                  initializer=init_worker,
+                                  initargs=(report_queue, locale, sections)) as pool:
+            for app_folder, error, seconds, bytes_read, entries in pool.imap_unordered(
+                    analyse_app, app_folders, chunksize):
+                STAGE_SECONDS.observe('parse', seconds)
+                BYTES_READ.inc(bytes_read)
+                if error is not None:
+                    failed.append(app_folder)
+                    APKS_FAILED.inc()
+                else:
+                    REPORT_BACKLOG.inc()
+                    if index is not None:
+                        index.add(app_folder, entries)
+    finally:
+        for _ in writers:
+            report_queue.put(None)
+        for writer in writers:
+            writer.join()
+        done_queue.put(None)
+        collector.join()
+
+    return failed + report_failed
+
+
+def init_worker(report_queue, locale, sections):
+    """
+    Initialize a parsing worker
+
+    @param report_queue: queue of the report writers
+    @type  report_queue: multiprocessing.Queue
+
+    @param locale: locale used to resolve resource references
+    @type  locale: str
+
+    @param sections: section names, every section when None
+    @type  sections: list
+    """
+    WORKER_STATE['report_queue'] = report_queue
+    WORKER_STATE['locale'] = locale
+    WORKER_STATE['sections'] = sections
+
+
+def analyse_app(app_folder):
+    """
+    Parse the manifest of an app and queue it for the report writers
+
+    @param app_folder: decompiled apk folder
+    @type  app_folder: str
+
+    @return: (app folder, error message or None, parse seconds, bytes read,
+              indexed names or None)
+    @rtype: tuple
+    """
+    start = time.perf_counter()
+    try:
+        sections = extract_app(app_folder, WORKER_STATE['locale'], WORKER_STATE['sections']).load()
+        packed_sections = pack_sections(sections)
+        entries = index_entries(sections) if WORKER_STATE['sections'] is None else None
+    except (ExpatError, OSError) as err:
+        logging.error('Parsing the manifest of %s: %s', app_folder, err)
+        return app_folder, str(err), time.perf_counter() - start, 0, None
+    except Exception as err:  # pylint: disable=broad-except
+        logging.exception('Extracting the sections of %s', app_folder)
+        return app_folder, str(err), time.perf_counter() - start, 0, None
+
+    seconds = time.perf_counter() - start
+    WORKER_STATE['report_queue'].put((app_folder, packed_sections))
+    return app_folder, None, seconds, app_size(app_folder), entries
+
+
+def analyse_app_serial(app_folder, locale, index=None, sections=None):
+    """
+    Parse the manifest of an app and write its report in this process
+
+    @param app_folder: decompiled apk folder
+    @type  app_folder: str
+
+    @param locale: locale used to resolve resource references
+    @type  locale: str
+
+    @param index: search index updated with the names of the app
+    @type  index: IndexWriter
+
+    @param sections: section names, every section when None
+    @type  sections: list
+
+    @return: True when the app was analysed
+    @rtype: bool
+    """
+    start = time.perf_counter()
+    try:
+        sections = extract_app(app_folder, locale, sections).load()
+        entries = index_entries(sections) if index is not None else None
+    except (ExpatError, OSError) as err:
+        logging.error('Parsing the manifest of %s: %s', app_folder, err)
+        APKS_FAILED.inc()
+        return False
+    except Exception:  # pylint: disable=broad-except
+        logging.exception('Extracting the sections of %s', app_folder)
+        APKS_FAILED.inc()
+        return False
+    STAGE_SECONDS.observe('parse', time.perf_counter() - start)
+    BYTES_READ.inc(app_size(app_folder))
+    if index is not None:
+        index.add(app_folder, entries)
+
+    start = time.perf_counter()
+    try:
+        report_path = generate_report(app_folder, sections)
+    except Exception:  # pylint: disable=broad-except
+        logging.exception('Generating the report of %s', app_folder)
+        APKS_FAILED.inc()
+        return False
+    STAGE_SECONDS.observe('report', time.perf_counter() - start)
+    BYTES_WRITTEN.inc(file_size(report_path))
+    APKS_PROCESSED.inc()
+    return True
+
+
+def extract_app(app_folder, locale, sections=None):
+    """
+    Sections of an app, extracted on first access
+
+    @param app_folder: decompiled apk folder
+    @type  app_folder: str
+
+    @param locale: locale used to resolve resource references
+    @type  locale: str
+
+    @param sections: section names, every section when None
+    @type  sections: list
+
+    @return: section name -> list of records
+    @rtype: ManifestResult
+    """
+    app_path = DATABASE_DIR + app_folder
+    return ManifestResult(functools.partial(xml.dom.minidom.parse, app_path + '/AndroidManifest.xml'),
+                          functools.partial(load_resource_table, app_path, locale),
+                          sections,
+                          {APK_METADATA_SECTION: functools.partial(load_apk_metadata, app_path)})
+
+
+def app_size(app_folder):
+    """
+    Bytes of the manifest and resource table of an app
+
+    @param app_folder: decompiled apk folder
+    @type  app_folder: str
+
+    @return: size in bytes
+    @rtype: int
+    """
+    return file_size(DATABASE_DIR + app_folder + '/AndroidManifest.xml') + \
+        file_size(os.path.join(DATABASE_DIR + app_folder, RESOURCES_ARSC))
+
+
+def file_size(path):
+    """
+    Size of a file, 0 when it does not exist
+
+    @param path: file path
+    @type  path: str
+
+    @return: size in bytes
+    @rtype: int
+    """
+    try:
+        return os.path.getsize(path)
+    except (OSError, TypeError):
+        return 0
+
+
+def report_writer(report_queue, done_queue):
+    """
+    Report writer process: write the reports of the queued apps until a None
+    item is received
+
+    @param report_queue: queue of (app folder, packed sections)
+    @type  report_queue: multiprocessing.Queue
+
+    @param done_queue: queue of (app folder, report seconds, bytes written, success) per app
+    @type  done_queue: multiprocessing.Queue
+    """
+    while True:
+        item = report_queue.get()
+        if item is None:
+            break
+
+        app_folder, packed_sections = item
+        start = time.perf_counter()
+        try:
+            report_path = generate_report(app_folder, unpack_sections(packed_sections))
+        except Exception:  # pylint: disable=broad-except
+            logging.exception('Generating the report of %s', app_folder)
+            done_queue.put((app_folder, time.perf_counter() - start, 0, False))
+        else:
+            done_queue.put((app_folder, time.perf_counter() - start, file_size(report_path), True))
+
+
+def collect_reports(done_queue, failed):
+    """
+    Record the outcome sent by the report writers until a None item is received
+
+    @param done_queue: queue of (app folder, report seconds, bytes written, success) per app
+    @type  done_queue: multiprocessing.Queue
+
+    @param failed: list extended with the app folders whose report failed
+    @type  failed: list
+    """
+    while True:
+        item = done_queue.get()
+        if item is None:
+            break
+
+        app_folder, seconds, bytes_written, success = item
+        REPORT_BACKLOG.inc(-1)
+        STAGE_SECONDS.observe('report', seconds)
+        BYTES_WRITTEN.inc(bytes_written)
+        if success:
+            APKS_PROCESSED.inc()
+        else:
+            failed.append(app_folder)
+            APKS_FAILED.inc()
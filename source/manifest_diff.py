@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Manifest diff module. """
+
+import time
+import hashlib
+import logging
+import os
+import tempfile
+import xml.dom.minidom
+from xml.parsers.expat import ExpatError
+import pandas as pandas
+from source.settings import REPORT_DIR
+from source.decompile import (
+    decompile_cmd,
+    find_apk_filenames
+)
+from source.parser_manifest import (
+    MANIFEST_SECTIONS,
+    extract_manifest
+)
+from source.compact import ResultStore
+from source.apk_metadata import (
+    APK_METADATA_SECTION,
+    load_apk_metadata
+)
+from source.manifest_schema import (
+    format_record,
+    format_value
+)
+
+# Columns identifying a row of each section. Rows of sections without key
+# columns are matched by position.
+DIFF_KEYS = {
+    'APK Basic Information': ('package',),
+    APK_METADATA_SECTION: None,
+    '<uses-sdk>': None,
+    '<uses-feature>': ('name',),
+    '<permission>': ('name',),
+    '<uses-permission>': ('name',),
+    '<uses-permission-sdk23>': ('name',),
+    '<application>': None,
+    '<activity>': ('name',),
+    '<activity-alias>': ('name',),
+    '<service>': ('name',),
+    '<receiver>': ('name',),
+    '<provider>': ('name',),
+    '<intent-filter>': ('component',),
+    '<meta-data>': ('componentType', 'component', 'name')
+}
+
+DIFF_COLUMNS = ['from', 'to', 'section', 'change', 'key', 'attribute', 'old', 'new']
+
+
+class ManifestVersion:
+    """
+    Extracted sections of one APK version, with a digest per section
+    """
+    __slots__ = ('apk_filename', 'sections', 'digests')
+
+    def __init__(self, apk_filename, sections):
+        self.apk_filename = apk_filename
+        self.sections = sections
+        self.digests = {section: section_digest(rows) for section, rows in sections.items()}
+
+    @property
+    def package(self):
+        """
+        Package name ('' when it is missing)
+        """
+        basic_information = self.sections['APK Basic Information']
+        if not basic_information:
+            return ''
+        return basic_information[0].package
+
+    @property
+    def version_code(self):
+        """
+        Version code as an integer (-1 when it is missing or not numeric)
+        """
+        basic_information = self.sections['APK Basic Information']
+        if not basic_information or not isinstance(basic_information[0].versionCode, int):
+            return -1
+        return basic_information[0].versionCode
+
+
+def section_digest(rows):
+    """
+    Order independent digest of the rows of a section
+
+    @param rows: section rows
+    @type  rows: list
+
+    @return: hex digest
+    @rtype: str
+    """
+    digest = hashlib.sha1()
+    for row in sorted(format_record(row) for row in rows):
+        digest.update('\x1f'.join(row).encode('utf-8'))
+        digest.update(b'\x1e')
+    return digest.hexdigest()
+
+
+def index_rows(rows, key_columns):
+    """
+    Index the rows of a section by their key
+
+    Repeated keys get an occurrence number so no row is lost.
+
+    @param rows: section rows
+    @type  rows: list
+
+    @param key_columns: key column names, None to match rows by position
+    @type  key_columns: tuple
+
+    @return: (key, occurrence) -> row
+    @rtype: dict
+    """
+    indexed = {}
+    for position, row in enumerate(rows):
+        if key_columns is None:
+            key = str(position)
+        else:
+            key = '/'.join(getattr(row, column) for column in key_columns)
+        occurrence = 0
+        while (key, occurrence) in indexed:
+            occurrence += 1
+        indexed[(key, occurrence)] = row
+    return indexed
+
+
+def diff_section(old_rows, new_rows, key_columns):
+    """
+    Set and attribute level delta of one section
+
+    @param old_rows: rows of the old version
+    @type  old_rows: list
+
+    @param new_rows: rows of the new version
+    @type  new_rows: list
+
+    @param key_columns: key column names, None to match rows by position
+    @type  key_columns: tuple
+
+    @return: (change, key, attribute, old, new) tuples
+    @rtype: list
+    """
+    changes = []
+    old_index = index_rows(old_rows, key_columns)
+    new_index = index_rows(new_rows, key_columns)
+
+    for key in old_index.keys() - new_index.keys():
+        changes.append(('removed', key[0], '', '', ''))
+
+    for key in new_index.keys() - old_index.keys():
+        changes.append(('added', key[0], '', '', ''))
+
+    for key in old_index.keys() & new_index.keys():
+        old_row = old_index[key]
+        new_row = new_index[key]
+        if old_row == new_row:
+            continue
+        for column, old_value, new_value in zip(old_row._fields, old_row, new_row):
+            if old_value != new_value:
+                changes.append(('changed', key[0], column,
+                                format_value(old_value), format_value(new_value)))
+
+    return sorted(changes)
+
+
+def diff_versions(old_version, new_version):
+    """
+    Delta between two versions of an APK
+
+    Sections with the same digest are skipped without looking at their rows.
+
+    @param old_version: old version
+    @type  old_version: ManifestVersion
+
+    @param new_version: new version
+    @type  new_version: ManifestVersion
+
+    @return: diff rows (see DIFF_COLUMNS)
+    @rtype: list
+    """
+    diff_rows = []
+    for section in MANIFEST_SECTIONS:
+        if old_version.digests[section] == new_version.digests[section]:
+            continue
+
+        changes = diff_section(old_version.sections[section],
+                               new_version.sections[section],
+                               DIFF_KEYS[section])
+        for change in changes:
+            diff_rows.append((old_version.apk_filename,
+                              new_version.apk_filename,
+                              section) + change)
+
+    return diff_rows
+
+
+def load_version(apk_path, apk_filename, store):
+    """
+    Decompile an APK and extract the sections compared by the diff
+
+    The apk is decompiled in a temporary folder, removed once the sections
+    are extracted, so versions with the same file name never overwrite each
+    other and the analysis of the database folder never sees them.
+
+    @param apk_path: Apk file path
+    @type  apk_path: str
+
+    @param apk_filename: name of the version in the report
+    @type  apk_filename: str
+
+    @param store: extracted sections of the versions of the batch
+    @type  store: ResultStore
+
+    @return: extracted version, None on failure
+    @rtype: ManifestVersion
+    """
+    with tempfile.TemporaryDirectory(prefix='ama-diff-') as database_dir:
+        if not decompile_cmd(apk_path, database_dir=database_dir):
+            return None
+
+        decompiled_path = os.path.join(database_dir, os.path.basename(os.path.normpath(apk_path)))
+        try:
+            manifest_xml = xml.dom.minidom.parse(os.path.join(decompiled_path,
+                                                              'AndroidManifest.xml'))
+        except (ExpatError, OSError) as err:
+            logging.error('Parsing the manifest of %s: %s', apk_path, err)
+            return None
+        sections = extract_manifest(manifest_xml)
+        sections[APK_METADATA_SECTION] = load_apk_metadata(decompiled_path)
+    return ManifestVersion(apk_filename, store.add(apk_filename, sections))
+
+
+def version_names(apk_paths):
+    """
+    Name of each version in the report: its file name, or its path when
+    another version has the same file name
+
+    @param apk_paths: Apk file paths
+    @type  apk_paths: list
+
+    @return: names, in the apk_paths order
+    @rtype: list
+    """
+    filenames = [os.path.basename(os.path.normpath(apk_path)) for apk_path in apk_paths]
+    return [filename if filenames.count(filename) == 1 else os.path.normpath(apk_path)
+            for apk_path, filename in zip(apk_paths, filenames)]
+
+
+def manifest_diff(apk_paths):
+    """
+    Diff consecutive versions of an APK
+
+    Versions are grouped by package and ordered by versionCode inside each
+    package. A single directory is expanded to the apk files it contains, so
+    the version histories of several apps can be diffed at once.
+
+    @param apk_paths: Apk files or a directory
+    @type  apk_paths: list
+
+    @return: diff rows (see DIFF_COLUMNS)
+    @rtype: list
+    """
+    if len(apk_paths) == 1 and os.path.isdir(apk_paths[0]):
+        directory = apk_paths[0]
+        apk_paths = [os.path.join(directory, apk_file)
+                     for apk_file in find_apk_filenames(directory)]
+
+    # versions of an app mostly share their records
+    store = ResultStore()
+    versions = []
+    for apk_path, apk_filename in zip(apk_paths, version_names(apk_paths)):
+        version = load_version(apk_path, apk_filename, store)
+        if version is None:
+            logging.error('Skipping the apk file: %s', apk_path)
+        else:
+            versions.append(version)
+
+    packages = {}
+    for version in versions:
+        packages.setdefault(version.package, []).append(version)
+
+    diff_rows = []
+    pairs = 0
+    for package, package_versions in sorted(packages.items()):
+        if len(package_versions) < 2:
+            logging.info('Only one version of %s, nothing to diff', package)
+            continue
+        package_versions.sort(key=lambda version: version.version_code)
+        for old_version, new_version in zip(package_versions, package_versions[1:]):
+            pair_rows = diff_versions(old_version, new_version)
+            logging.info('%s -> %s: %d change(s)',
+                         old_version.apk_filename, new_version.apk_filename, len(pair_rows))
+            diff_rows.extend(pair_rows)
+            pairs += 1
+
+    if not pairs:
+        logging.error('At least two apk versions of the same package are required to '
+                      'generate a diff')
+        return []
+
+    generate_diff_report(diff_rows)
+    return diff_rows
+
+
+def generate_diff_report(diff_rows):
+    """
+    Write the diff rows to an Excel report
+
+    @param diff_rows: diff rows (see DIFF_COLUMNS)
+    @type  diff_rows: list
+    """
+    report_filename = 'manifest-diff-' + time.strftime("%Y%m%d-%H%M%S") + '.xlsx'
+    report_path = os.path.join(REPORT_DIR, report_filename)
+
+    data_frame = pandas.DataFrame(diff_rows, columns=DIFF_COLUMNS)
+    try:
+        data_frame.to_excel(report_path, sheet_name='Manifest Diff', index=False)
+    except OSError as err:
+        logging.exception("Failed to write the file %s - %s", report_filename, err.strerror)
+        return
+
+    logging.info('Generated diff report file %s', 'report/' + report_filename)
@@ -0,0 +1,529 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+AndroidManifest.xml schema
+
+Declares the sections extracted from a manifest: the element of each section,
+its attributes and their types. Records, per-tag extractors and the report
+columns are all generated from this table.
+'''
+
+import sys
+from collections import namedtuple
+from xml.dom import EMPTY_NAMESPACE
+from source.resources_arsc import resolve_reference
+
+# Namespaces
+ANDROID_NS = 'http://schemas.android.com/apk/res/android'
+
+# Separators
+FLAG_SEPARATOR = '|'                            # android:protectionLevel="signature|privileged"
+VALUE_SEPARATOR = ', '                          # multi-valued report columns
+
+# Shared flag sets, flag attributes only take a few distinct values
+FLAG_SETS = {}
+
+
+class HexInteger(int):
+    '''
+    Integer reported in hexadecimal, as declared in the manifest (0x00020000)
+    '''
+    __slots__ = ()
+
+    def __str__(self):
+        return '0x%08x' % self
+
+
+def to_text(value, resources=None):  # pylint: disable=unused-argument
+    '''
+    Plain string attribute
+
+    @param value: attribute value ('' when the attribute is missing)
+    @type  value: str
+
+    @return: value
+    @rtype: str
+    '''
+    return value
+
+
+def to_reference(value, resources=None):
+    '''
+    String attribute that may reference a resource (@string/...)
+
+    @param value: attribute value ('' when the attribute is missing)
+    @type  value: str
+
+    @param resources: resource table used to resolve references
+    @type  resources: ResourceTable
+
+    @return: resolved value
+    @rtype: str
+    '''
+    return resolve_reference(value, resources)
+
+
+def to_boolean(value, resources=None):
+    '''
+    Boolean attribute
+
+    @param value: attribute value ('' when the attribute is missing)
+    @type  value: str
+
+    @param resources: resource table used to resolve references
+    @type  resources: ResourceTable
+
+    @return: True/False, None when missing, the raw value when it is not a boolean
+    @rtype: bool
+    '''
+    if not value:
+        return None
+    value = resolve_reference(value, resources)
+    if value == 'true':
+        return True
+    if value == 'false':
+        return False
+    return value
+
+
+def to_integer(value, resources=None):
+    '''
+    Integer attribute (decimal or 0x hexadecimal)
+
+    @param value: attribute value ('' when the attribute is missing)
+    @type  value: str
+
+    @param resources: resource table used to resolve references
+    @type  resources: ResourceTable
+
+    @return: integer, None when missing, the raw value when it is not an integer
+    @rtype: int
+    '''
+    if not value:
+        return None
+    value = resolve_reference(value, resources)
+    try:
+        return int(value, 16) if value.lower().startswith('0x') else int(value)
+    except ValueError:
+        return value
+
+
+def to_hex_integer(value, resources=None):
+    '''
+    Integer attribute reported in hexadecimal (android:glEsVersion)
+
+    @param value: attribute value ('' when the attribute is missing)
+    @type  value: str
+
+    @param resources: resource table used to resolve references
+    @type  resources: ResourceTable
+
+    @return: integer, None when missing, the raw value when it is not an integer
+    @rtype: HexInteger
+    '''
+    value = to_integer(value, resources)
+    if isinstance(value, int):
+        return HexInteger(value)
+    return value
+
+
+def to_float(value, resources=None):
+    '''
+    Float attribute
+
+    @param value: attribute value ('' when the attribute is missing)
+    @type  value: str
+
+    @param resources: resource table used to resolve references
+    @type  resources: ResourceTable
+
+    @return: float, None when missing, the raw value when it is not a float
+    @rtype: float
+    '''
+    if not value:
+        return None
+    value = resolve_reference(value, resources)
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def to_flags(value, resources=None):  # pylint: disable=unused-argument
+    '''
+    Flag attribute (values separated by |)
+
+    @param value: attribute value ('' when the attribute is missing)
+    @type  value: str
+
+    @return: flags
+    @rtype: frozenset
+    '''
+    return frozenset(flag for flag in value.split(FLAG_SEPARATOR) if flag)
+
+
+def intern_value(value):
+    '''
+    Shared instance of a typed value
+
+    Strings are interned and equal flag sets are one frozenset, so a value
+    repeated by many elements and apps is stored once. Booleans and None are
+    singletons already.
+
+    @param value: typed value
+    @type  value: object
+
+    @return: shared value
+    @rtype: object
+    '''
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, tuple):
+        return tuple(sys.intern(item) for item in value)
+    if isinstance(value, frozenset):
+        flags = FLAG_SETS.get(value)
+        if flags is None:
+            flags = frozenset(sys.intern(flag) for flag in value)
+            FLAG_SETS[flags] = flags
+        return flags
+    return value
+
+
+# Attribute types
+TEXT = to_text
+REFERENCE = to_reference
+BOOLEAN = to_boolean
+INTEGER = to_integer
+HEX_INTEGER = to_hex_integer
+FLOAT = to_float
+FLAGS = to_flags
+
+# Attribute types kept as declared, every other type resolves references
+RAW_TYPES = (TEXT, FLAGS)
+
+
+def format_value(value):
+    '''
+    Format a typed value as text for reports and digests
+
+    @param value: typed value
+    @type  value: object
+
+    @return: text
+    @rtype: str
+    '''
+    if value is None:
+        return ''
+    if value is True:
+        return 'true'
+    if value is False:
+        return 'false'
+    if isinstance(value, frozenset):
+        return FLAG_SEPARATOR.join(sorted(value))
+    if isinstance(value, tuple):
+        return VALUE_SEPARATOR.join(value)
+    return str(value)
+
+
+def format_record(record):
+    '''
+    Format every value of a record as text
+
+    @param record: section record
+    @type  record: namedtuple
+
+    @return: values as text
+    @rtype: tuple
+    '''
+    return tuple(format_value(value) for value in record)
+
+
+def intent_filter_children(intent_filter):
+    '''
+    <action>, <category> and <data> children of an <intent-filter>
+
+    @param intent_filter: <intent-filter> element
+    @type  intent_filter: xml dom
+
+    @return: (actions, categories, data)
+    @rtype: tuple
+    '''
+    actions = []
+    categories = []
+    data = []
+    for child in intent_filter.childNodes:
+        if child.nodeType != child.ELEMENT_NODE:
+            continue
+        if child.tagName == 'action':
+            actions.append(child.getAttributeNS(ANDROID_NS, 'name'))
+        elif child.tagName == 'category':
+            categories.append(child.getAttributeNS(ANDROID_NS, 'name'))
+        elif child.tagName == 'data':
+            data.append(format_intent_data(child))
+
+    return tuple(actions), tuple(categories), tuple(data)
+
+
+def format_intent_data(data):
+    '''
+    Format an intent-filter <data> element as an URI pattern
+
+    @param data: <data> element
+    @type  data: xml dom
+
+    @return: URI pattern, e.g. https://example.com:443/path* (text/plain)
+    @rtype: str
+    '''
+    scheme = data.getAttributeNS(ANDROID_NS, 'scheme')
+    host = data.getAttributeNS(ANDROID_NS, 'host')
+    port = data.getAttributeNS(ANDROID_NS, 'port')
+    path = data.getAttributeNS(ANDROID_NS, 'path') or \
+        data.getAttributeNS(ANDROID_NS, 'pathPattern') or \
+        data.getAttributeNS(ANDROID_NS, 'pathAdvancedPattern')
+    path_prefix = data.getAttributeNS(ANDROID_NS, 'pathPrefix')
+    mimetype = data.getAttributeNS(ANDROID_NS, 'mimeType')
+
+    uri = scheme + ':' if scheme else ''
+    if host:
+        uri += '//' + host
+    if port:
+        uri += ':' + port
+    if path:
+        uri += path
+    elif path_prefix:
+        uri += path_prefix + '*'
+    if mimetype:
+        uri = (uri + ' (' + mimetype + ')') if uri else mimetype
+    return uri
+
+
+# Section declaration:
+# - section: report sheet name
+# - tag: manifest element
+# - record: record name
+# - context: columns filled from the enclosing component ('component', 'componentType')
+# - attributes: (attribute, type) or (attribute, type, namespace), android namespace by default
+# - children: (columns, function) filling columns from the children of the element
+Section = namedtuple('Section', ['section', 'tag', 'record', 'context', 'attributes', 'children'])
+
+MANIFEST_SCHEMA = (
+    Section('APK Basic Information', 'manifest', 'BasicInformation', (), (
+        ('package', TEXT, EMPTY_NAMESPACE),
+        ('versionCode', INTEGER),
+        ('versionName', TEXT)), None),
+    Section('<uses-sdk>', 'uses-sdk', 'UsesSdk', (), (
+        ('minSdkVersion', INTEGER),
+        ('targetSdkVersion', INTEGER),
+        ('maxSdkVersion', INTEGER)), None),
+    Section('<uses-feature>', 'uses-feature', 'UsesFeature', (), (
+        ('name', TEXT),
+        ('required', BOOLEAN),
+        ('glEsVersion', HEX_INTEGER)), None),
+    Section('<permission>', 'permission', 'Permission', (), (
+        ('name', TEXT),
+        ('description', REFERENCE),
+        ('permissionGroup', TEXT),
+        ('protectionLevel', FLAGS)), None),
+    Section('<uses-permission>', 'uses-permission', 'UsesPermission', (), (
+        ('name', TEXT),
+        ('maxSdkVersion', INTEGER)), None),
+    Section('<uses-permission-sdk23>', 'uses-permission-sdk-23', 'UsesPermission', (), (
+        ('name', TEXT),
+        ('maxSdkVersion', INTEGER)), None),
+    Section('<application>', 'application', 'Application', (), (
+        ('name', TEXT),
+        ('label', REFERENCE),
+        ('debuggable', BOOLEAN),
+        ('allowBackup', BOOLEAN),
+        ('fullBackupContent', TEXT),
+        ('usesCleartextTraffic', BOOLEAN),
+        ('networkSecurityConfig', TEXT),
+        ('permission', TEXT),
+        ('process', TEXT),
+        ('taskAffinity', TEXT),
+        ('testOnly', BOOLEAN)), None),
+    Section('<activity>', 'activity', 'Activity', (), (
+        ('name', TEXT),
+        ('label', REFERENCE),
+        ('allowEmbedded', BOOLEAN),
+        ('allowTaskReparenting', BOOLEAN),
+        ('alwaysRetainTaskState', BOOLEAN),
+        ('autoRemoveFromRecents', BOOLEAN),
+        ('clearTaskOnLaunch', BOOLEAN),
+        ('colorMode', TEXT),
+        ('configChanges', FLAGS),
+        ('directBootAware', BOOLEAN),
+        ('documentLaunchMode', TEXT),
+        ('enabled', BOOLEAN),
+        ('excludeFromRecents', BOOLEAN),
+        ('exported', BOOLEAN),
+        ('finishOnTaskLaunch', BOOLEAN),
+        ('hardwareAccelerated', BOOLEAN),
+        ('immersive', BOOLEAN),
+        ('launchMode', TEXT),
+        ('lockTaskMode', TEXT),
+        ('maxRecents', INTEGER),
+        ('maxAspectRatio', FLOAT),
+        ('multiprocess', BOOLEAN),
+        ('noHistory', BOOLEAN),
+        ('parentActivityName', TEXT),
+        ('persistableMode', TEXT),
+        ('permission', TEXT),
+        ('relinquishTaskIdentity', BOOLEAN),
+        ('resizeableActivity', BOOLEAN),
+        ('screenOrientation', TEXT),
+        ('showForAllUsers', BOOLEAN),
+        ('stateNotNeeded', BOOLEAN),
+        ('supportsPictureInPicture', BOOLEAN),
+        ('taskAffinity', TEXT),
+        ('theme', TEXT),
+        ('uiOptions', TEXT),
+        ('windowSoftInputMode', FLAGS)), None),
+    Section('<activity-alias>', 'activity-alias', 'ActivityAlias', (), (
+        ('name', TEXT),
+        ('label', REFERENCE),
+        ('enabled', BOOLEAN),
+        ('exported', BOOLEAN),
+        ('permission', TEXT),
+        ('targetActivity', TEXT)), None),
+    Section('<service>', 'service', 'Service', (), (
+        ('name', TEXT),
+        ('description', REFERENCE),
+        ('directBootAware', BOOLEAN),
+        ('enabled', BOOLEAN),
+        ('exported', BOOLEAN),
+        ('foregroundServiceType', FLAGS),
+        ('isolatedProcess', BOOLEAN),
+        ('permission', TEXT),
+        ('process', TEXT)), None),
+    Section('<receiver>', 'receiver', 'Receiver', (), (
+        ('name', TEXT),
+        ('directBootAware', BOOLEAN),
+        ('enabled', BOOLEAN),
+        ('exported', BOOLEAN),
+        ('permission', TEXT),
+        ('process', TEXT)), None),
+    Section('<provider>', 'provider', 'Provider', (), (
+        ('name', TEXT),
+        ('authorities', TEXT),
+        ('directBootAware', BOOLEAN),
+        ('enabled', BOOLEAN),
+        ('exported', BOOLEAN),
+        ('grantUriPermissions', BOOLEAN),
+        ('initOrder', INTEGER),
+        ('multiprocess', BOOLEAN),
+        ('permission', TEXT),
+        ('process', TEXT),
+        ('readPermission', TEXT),
+        ('syncable', BOOLEAN),
+        ('writePermission', TEXT)), None),
+    Section('<intent-filter>', 'intent-filter', 'IntentFilter', ('component', 'componentType'), (
+        ('priority', INTEGER),
+        ('autoVerify', BOOLEAN)),
+            (('actions', 'categories', 'data'), intent_filter_children)),
+    Section('<meta-data>', 'meta-data', 'MetaData', ('component', 'componentType'), (
+        ('name', TEXT),
+        ('value', REFERENCE),
+        ('resource', TEXT)), None),
+)
+
+
+def build_records(schema):
+    '''
+    Generate one namedtuple per record name of the schema
+
+    @param schema: sections
+    @type  schema: tuple
+
+    @return: record name -> namedtuple
+    @rtype: dict
+    '''
+    records = {}
+    for section in schema:
+        columns = list(section.context)
+        columns += [attribute[0] for attribute in section.attributes]
+        if section.children:
+            columns += list(section.children[0])
+
+        record = records.get(section.record)
+        if record is None:
+            records[section.record] = namedtuple(section.record, columns)
+        elif list(record._fields) != columns:
+            raise ValueError('Record %s declared with different columns' % section.record)
+
+    return records
+
+
+def compile_extractor(section, record, shared=True):
+    '''
+    Build the extractor of a section
+
+    The namespace qualified attribute keys and their converters are computed
+    once, so extracting an element is a single pass over its attributes.
+
+    @param section: section declaration
+    @type  section: Section
+
+    @param record: section record
+    @type  record: namedtuple
+
+    @param shared: whether the values are interned (see intern_value)
+    @type  shared: bool
+
+    @return: extractor(element, resources, component, component_type) -> record
+    @rtype: function
+    '''
+    keys = tuple((attribute[2] if len(attribute) > 2 else ANDROID_NS, attribute[0])
+                 for attribute in section.attributes)
+    converters = tuple(attribute[1] for attribute in section.attributes)
+    fields = tuple(zip(keys, converters))
+    context = section.context
+    children = section.children[1] if section.children else None
+    make = record._make
+
+    def extract(element, resources=None, component='', component_type=''):
+        attributes = dict(element.attributes.itemsNS())
+        values = [convert(attributes.get(key, ''), resources) for key, convert in fields]
+        if context:
+            enclosing = {'component': component, 'componentType': component_type}
+            values[0:0] = [enclosing[name] for name in context]
+        if children is not None:
+            values.extend(children(element))
+        if shared:
+            return make(map(intern_value, values))
+        return make(values)
+
+    return extract
+
+
+def needs_resources(sections):
+    '''
+    Whether extracting sections resolves resource references
+
+    @param sections: section names
+    @type  sections: list
+
+    @return: True when a column of the sections resolves references
+    @rtype: bool
+    '''
+    return any(attribute[1] not in RAW_TYPES
+               for section in MANIFEST_SCHEMA if section.section in sections
+               for attribute in section.attributes)
+
+
+# Records (record name -> namedtuple)
+RECORDS = build_records(MANIFEST_SCHEMA)
+
+# Sections (report sheet name -> record)
+SECTION_RECORDS = {section.section: RECORDS[section.record] for section in MANIFEST_SCHEMA}
+
+# Extractors (tag -> (report sheet name, extractor))
+EXTRACTORS = {section.tag: (section.section,
+                            compile_extractor(section, RECORDS[section.record]))
+              for section in MANIFEST_SCHEMA}
+
+# Extractors keeping the values as parsed, the baseline of the memory benchmark
+PLAIN_EXTRACTORS = {section.tag: (section.section,
+                                  compile_extractor(section, RECORDS[section.record], False))
+                    for section in MANIFEST_SCHEMA}
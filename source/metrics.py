@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Run metrics module. """
+
+import bisect
+import contextlib
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from source.settings import (
+    METRICS_INTERVAL,
+    METRICS_TEXTFILE
+)
+
+# upper bounds of the stage duration buckets, in seconds
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# a single lock for every update: updates are a few integer operations, far
+# cheaper than any stage they measure
+_LOCK = threading.Lock()
+
+
+class Counter:
+    """
+    Monotonic counter
+    """
+    __slots__ = ('name', 'description', 'value')
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.value = 0
+
+    def inc(self, amount=1):
+        """
+        Increment the counter
+
+        @param amount: increment
+        @type  amount: int
+        """
+        with _LOCK:
+            self.value += amount
+
+    def render(self):
+        """
+        Prometheus text exposition lines
+        """
+        return ['# HELP %s %s' % (self.name, self.description),
+                '# TYPE %s counter' % self.name,
+                '%s %s' % (self.name, self.value)]
+
+
+class Gauge:
+    """
+    Value that goes up and down, one series per label value when the gauge
+    has a label
+    """
+    __slots__ = ('name', 'description', 'label', 'series')
+
+    def __init__(self, name, description, label=None):
+        self.name = name
+        self.description = description
+        self.label = label
+        # label value -> value, '' without label
+        self.series = {}
+
+    @property
+    def value(self):
+        """
+        Value of the unlabelled series
+        """
+        return self.series.get('', 0)
+
+    def inc(self, amount=1, label_value=''):
+        """
+        Increment the gauge, decrement with a negative amount
+
+        @param amount: increment
+        @type  amount: int
+
+        @param label_value: series label value
+        @type  label_value: str
+        """
+        with _LOCK:
+            self.series[label_value] = self.series.get(label_value, 0) + amount
+
+    def render(self):
+        """
+        Prometheus text exposition lines
+        """
+        with _LOCK:
+            series = sorted(self.series.items())
+        lines = ['# HELP %s %s' % (self.name, self.description),
+                 '# TYPE %s gauge' % self.name]
+        if self.label is None:
+            lines.append('%s %s' % (self.name, dict(series).get('', 0)))
+        else:
+            lines.extend('%s{%s="%s"} %s' % (self.name, self.label, label_value, value)
+                         for label_value, value in series)
+        return lines
+
+
+class Histogram:
+    """
+    Bucketed observations, one series per label value
+    """
+    __slots__ = ('name', 'description', 'label', 'bounds', 'series')
+
+    def __init__(self, name, description, label, bounds=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.bounds = bounds
+        # label value -> [bucket counts..., sum, count]
+        self.series = {}
+
+    def observe(self, label_value, value):
+        """
+        Record an observation
+
+        @param label_value: series label value
+        @type  label_value: str
+
+        @param value: observed value
+        @type  value: float
+        """
+        index = bisect.bisect_left(self.bounds, value)
+        with _LOCK:
+            series = self.series.get(label_value)
+            if series is None:
+                series = self.series[label_value] = [0] * (len(self.bounds) + 3)
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        """
+        Prometheus text exposition lines (cumulative buckets)
+        """
+        # observations made while rendering must not change the series
+        with _LOCK:
+            snapshot = sorted((label_value, list(series))
+                              for label_value, series in self.series.items())
+        lines = ['# HELP %s %s' % (self.name, self.description),
+                 '# TYPE %s histogram' % self.name]
+        for label_value, series in snapshot:
+            label = '%s="%s"' % (self.label, label_value)
+            cumulative = 0
+            for bound, count in zip(self.bounds + ('+Inf',), series):
+                cumulative += count
+                lines.append('%s_bucket{%s,le="%s"} %d' % (self.name, label, bound, cumulative))
+            lines.append('%s_sum{%s} %f' % (self.name, label, series[-2]))
+            lines.append('%s_count{%s} %d' % (self.name, label, series[-1]))
+        return lines
+
+
+APKS_DECODED = Counter('ama_apks_decoded_total', 'Apk files decoded by apktool')
+APKS_DECODE_FAILED = Counter('ama_apks_decode_failed_total', 'Apk files apktool failed to decode')
+APKS_PROCESSED = Counter('ama_apks_processed_total', 'Apps analysed and reported')
+APKS_FAILED = Counter('ama_apks_failed_total', 'Apps that could not be analysed or reported')
+BYTES_READ = Counter('ama_bytes_read_total', 'Bytes of apks, manifests and resource tables read')
+BYTES_WRITTEN = Counter('ama_bytes_written_total', 'Bytes of reports written')
+REPORT_BACKLOG = Gauge('ama_report_backlog', 'Parsed apps waiting for a report writer')
+SCHEDULER_QUEUE_DEPTH = Gauge('ama_scheduler_queue_depth',
+                              'Decode and analysis jobs waiting for a scheduler worker', 'priority')
+STAGE_SECONDS = Histogram('ama_stage_duration_seconds', 'Duration of a stage per apk', 'stage')
+
+METRICS = (APKS_DECODED, APKS_DECODE_FAILED, APKS_PROCESSED, APKS_FAILED,
+           BYTES_READ, BYTES_WRITTEN, REPORT_BACKLOG, SCHEDULER_QUEUE_DEPTH, STAGE_SECONDS)
+
+
+def render_metrics():
+    """
+    Every metric in the Prometheus text exposition format
+
+    @return: exposition text
+    @rtype: str
+    """
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def write_textfile(textfile=METRICS_TEXTFILE):
+    """
+    Write the metrics for the node exporter textfile collector
+
+    The file is written next to its destination and renamed in place, so the
+    collector never reads a partial file.
+
+    @param textfile: .prom file path, '' to disable
+    @type  textfile: str
+    """
+    if not textfile:
+        return
+    directory = os.path.dirname(os.path.abspath(textfile))
+    try:
+        tmp_fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(tmp_fd, 'w') as tmp_file:
+            tmp_file.write(render_metrics())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, textfile)
+    except OSError as err:
+        logging.error('Writing the metrics file %s: %s', textfile, err)
+
+
+def format_duration(seconds):
+    """
+    [h:]mm:ss form of a duration
+
+    @param seconds: duration
+    @type  seconds: float
+
+    @return: formatted duration
+    @rtype: str
+    """
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return '%d:%02d:%02d' % (hours, minutes, seconds)
+    return '%02d:%02d' % (minutes, seconds)
+
+
+def progress_line(phase, total, done, failed, elapsed):
+    """
+    Progress of a phase: completed apps, rate and ETA
+
+    @param phase: phase name
+    @type  phase: str
+
+    @param total: apps of the phase, None when unknown
+    @type  total: int
+
+    @param done: completed apps, failed ones included
+    @type  done: int
+
+    @param failed: failed apps
+    @type  failed: int
+
+    @param elapsed: seconds since the phase started
+    @type  elapsed: float
+
+    @return: progress line
+    @rtype: str
+    """
+    rate = done / elapsed if elapsed > 0 else 0.0
+    line = '%s: %d' % (phase, done)
+    if total is not None:
+        line += '/%d' % total
+    line += ' apks (%d failed), %.1f apks/s' % (failed, rate)
+    if total is not None and rate > 0:
+        line += ', ETA %s' % format_duration((total - done) / rate)
+    if REPORT_BACKLOG.value:
+        line += ', report backlog %d' % REPORT_BACKLOG.value
+    return line
+
+
+@contextlib.contextmanager
+def track_progress(phase, total, done_counter, failed_counter, interval=METRICS_INTERVAL):
+    """
+    Show a live progress line and refresh the metrics textfile every interval
+    while the block runs
+
+    The progress line is redrawn in place on a terminal and logged otherwise,
+    then only when apps were completed since the last line.
+
+    @param phase: phase name
+    @type  phase: str
+
+    @param total: apps of the phase, None when unknown
+    @type  total: int
+
+    @param done_counter: counter of the successful apps of the phase
+    @type  done_counter: Counter
+
+    @param failed_counter: counter of the failed apps of the phase
+    @type  failed_counter: Counter
+
+    @param interval: refresh interval in seconds
+    @type  interval: float
+    """
+    start = time.monotonic()
+    done_start, failed_start = done_counter.value, failed_counter.value
+    interactive = sys.stderr.isatty()
+    stop = threading.Event()
+    last_state = [(0, 0)]
+
+    def refresh():
+        failed = failed_counter.value - failed_start
+        done = done_counter.value - done_start + failed
+        line = progress_line(phase, total, done, failed, time.monotonic() - start)
+        if interactive:
+            sys.stderr.write('\r\033[K' + line)
+            sys.stderr.flush()
+        elif (done, failed) != last_state[0]:
+            logging.info(line)
+        last_state[0] = (done, failed)
+        write_textfile()
+
+    def reporter():
+        while not stop.wait(interval):
+            refresh()
+
+    thread = threading.Thread(target=reporter, name='progress-' + phase, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+        refresh()
+        if interactive:
+            sys.stderr.write('\n')
+
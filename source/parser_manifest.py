@@ -1,4 +1,3 @@
-
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
@@ -6,6 +5,286 @@
 AndroidManifest.xml Parser
 '''
 
+from collections.abc import Mapping
+from source.manifest_schema import (
+    ANDROID_NS,
+    RECORDS,
+    SECTION_RECORDS,
+    EXTRACTORS,
+    needs_resources
+)
+from source.apk_metadata import (
+    APK_METADATA_SECTION,
+    ApkMetadata
+)
+
+# Section records
+BasicInformation = RECORDS['BasicInformation']
+UsesSdk = RECORDS['UsesSdk']
+UsesFeature = RECORDS['UsesFeature']
+Permission = RECORDS['Permission']
+UsesPermission = RECORDS['UsesPermission']
+Application = RECORDS['Application']
+Activity = RECORDS['Activity']
+ActivityAlias = RECORDS['ActivityAlias']
+Service = RECORDS['Service']
+Receiver = RECORDS['Receiver']
+Provider = RECORDS['Provider']
+IntentFilter = RECORDS['IntentFilter']
+MetaData = RECORDS['MetaData']
+
+# Sections of a manifest (report sheet name -> record). APK Metadata is not
+# read from the manifest but from the apk file when it is decompiled.
+MANIFEST_SECTIONS = {**SECTION_RECORDS, APK_METADATA_SECTION: ApkMetadata}
+
+# Elements that own <intent-filter> and <meta-data> elements
+COMPONENT_TAGS = ('application', 'activity', 'activity-alias', 'service', 'receiver', 'provider')
+
+# Sections of the elements nested in components
+NESTED_SECTIONS = (EXTRACTORS['intent-filter'][0], EXTRACTORS['meta-data'][0])
+
+
+class ManifestResult(Mapping):
+    '''
+    Sections of an app, extracted when first accessed
+
+    Only the requested sections are keys. Accessing one section extracts it
+    alone; iterating the items extracts every pending section in a single
+    traversal. The manifest is parsed and the resource table opened only
+    when a section that needs them is extracted.
+    '''
+
+    def __init__(self, load_manifest, load_resources=None, sections=None, loaders=None):
+        '''
+        @param load_manifest: function returning the manifest xml dom
+        @type  load_manifest: function
+
+        @param load_resources: function returning the resource table, or None
+        @type  load_resources: function
+
+        @param sections: requested section names, every section when None
+        @type  sections: list
+
+        @param loaders: section name -> function returning the records of a
+                        section that is not read from the manifest
+        @type  loaders: dict
+        '''
+        self.load_manifest = load_manifest
+        self.load_resources = load_resources
+        self.sections = tuple(section for section in MANIFEST_SECTIONS
+                              if sections is None or section in sections)
+        self.loaders = loaders or {}
+        self.manifest_xml = None
+        self.extracted = {}
+
+    def __getitem__(self, section):
+        if section not in self.sections:
+            raise KeyError(section)
+        if section not in self.extracted:
+            self.extract((section,))
+        return self.extracted[section]
+
+    def __contains__(self, section):
+        return section in self.sections
+
+    def __iter__(self):
+        return iter(self.sections)
+
+    def __len__(self):
+        return len(self.sections)
+
+    def items(self):
+        self.load()
+        return [(section, self.extracted[section]) for section in self.sections]
+
+    def values(self):
+        self.load()
+        return [self.extracted[section] for section in self.sections]
+
+    def load(self):
+        '''
+        Extract every requested section that was not accessed yet
+
+        @return: this result
+        @rtype: ManifestResult
+        '''
+        self.extract(self.sections)
+        return self
+
+    def extract(self, sections):
+        '''
+        Extract sections in a single traversal of the manifest
+
+        @param sections: section names
+        @type  sections: tuple
+        '''
+        pending = [section for section in sections if section not in self.extracted]
+        manifest_sections = [section for section in pending if section not in self.loaders]
+        for section in pending:
+            if section in self.loaders:
+                self.extracted[section] = self.loaders[section]()
+
+        if manifest_sections:
+            if self.manifest_xml is None:
+                self.manifest_xml = self.load_manifest()
+            resources = None
+            if self.load_resources is not None and needs_resources(manifest_sections):
+                resources = self.load_resources()
+            self.extracted.update(extract_manifest(self.manifest_xml, resources, manifest_sections))
+
+
+def select_sections(names):
+    '''
+    Section names from user friendly keys, such as 'uses-permission' for
+    '<uses-permission>' or 'apk-metadata' for 'APK Metadata'
+
+    @param names: comma separated keys
+    @type  names: str
+
+    @return: section names
+    @rtype: list
+    '''
+    keys = {section_key(section): section for section in MANIFEST_SECTIONS}
+    sections = []
+    for name in names.split(','):
+        key = section_key(name)
+        if key not in keys:
+            raise ValueError('unknown section %s, choose from: %s' % (name, ', '.join(keys)))
+        sections.append(keys[key])
+    return sections
+
+
+def section_key(section):
+    '''
+    User friendly key of a section name
+    '''
+    return section.strip().strip('<>').lower().replace(' ', '-')
+
+
+def extract_manifest(manifest_xml, resources=None, sections=None, extractors=EXTRACTORS):
+    '''
+    Extract the sections of an AndroidManifest.xml in a single traversal
+
+    Elements of unrequested sections are not extracted, and components are
+    not descended into when no nested section is requested.
+
+    @param manifest_xml: manifest xml dom
+    @type  manifest_xml: xml dom
+
+    @param resources: resource table used to resolve references
+    @type  resources: ResourceTable
+
+    @param sections: section names, every manifest section when None
+    @type  sections: list
+
+    @param extractors: tag -> (section name, extractor)
+    @type  extractors: dict
+
+    @return: section name -> list of records (see MANIFEST_SECTIONS)
+    @rtype: dict
+    '''
+    if sections is None:
+        sections = MANIFEST_SECTIONS
+    sections = {section: [] for section in sections}
+    nested = any(section in sections for section in NESTED_SECTIONS)
+    manifest = get_manifest_element(manifest_xml)
+    if manifest is not None:
+        section, extract = extractors['manifest']
+        if section in sections:
+            sections[section].append(extract(manifest, resources))
+        walk_element(manifest, '', '', sections, resources, nested, extractors)
+
+    return sections
+
+
+def walk_element(element, component, component_type, sections, resources, nested=True,
+                 extractors=EXTRACTORS):
+    '''
+    Add the records of the children of an element to the requested sections
+
+    @param element: xml element
+    @type  element: xml dom
+
+    @param component: name of the enclosing component
+    @type  component: str
+
+    @param component_type: tag of the enclosing component
+    @type  component_type: str
+
+    @param sections: section name -> list of records
+    @type  sections: dict
+
+    @param resources: resource table used to resolve references
+    @type  resources: ResourceTable
+
+    @param nested: whether the elements nested in components are requested
+    @type  nested: bool
+
+    @param extractors: tag -> (section name, extractor)
+    @type  extractors: dict
+    '''
+    for child in element.childNodes:
+        if child.nodeType != child.ELEMENT_NODE:
+            continue
+
+        tag = child.tagName
+        extractor = extractors.get(tag)
+        if extractor is None:
+            walk_element(child, component, component_type, sections, resources, nested,
+                         extractors)
+            continue
+
+        section, extract = extractor
+        if section in sections:
+            sections[section].append(extract(child, resources, component, component_type))
+        if tag in COMPONENT_TAGS:
+            if nested or tag == 'application':
+                walk_element(child, child.getAttributeNS(ANDROID_NS, 'name'), tag,
+                             sections, resources, nested, extractors)
+        elif tag != 'intent-filter':
+            walk_element(child, component, component_type, sections, resources, nested,
+                         extractors)
+
+
+def get_elements(manifest_xml, tag, resources=None):
+    '''
+    Records of every element of a tag
+
+    @param manifest_xml: manifest xml dom
+    @type  manifest_xml: xml dom
+
+    @param tag: element tag (see MANIFEST_SCHEMA)
+    @type  tag: str
+
+    @param resources: resource table used to resolve references
+    @type  resources: ResourceTable
+
+    @return: records
+    @rtype: list
+    '''
+    _, extract = EXTRACTORS[tag]
+    return [extract(element, resources, *enclosing_component(element))
+            for element in manifest_xml.getElementsByTagName(tag)]
+
+
+def enclosing_component(element):
+    '''
+    Name and tag of the component that owns an element
+
+    @param element: xml element
+    @type  element: xml dom
+
+    @return: (component name, component tag), empty strings outside of components
+    @rtype: tuple
+    '''
+    parent = element.parentNode
+    while parent is not None and parent.nodeType == parent.ELEMENT_NODE:
+        if parent.tagName in COMPONENT_TAGS:
+            return parent.getAttributeNS(ANDROID_NS, 'name'), parent.tagName
+        parent = parent.parentNode
+    return '', ''
+
+
 def get_package(manifest_xml):
     '''
     Get APK package from AndroidManifest.xml
@@ -32,7 +311,7 @@ def get_version_code(manifest_xml):
     @rtype: str
     '''
     manifest = get_manifest_element(manifest_xml)
-    versioncode = manifest.getAttribute('android:versionCode')
+    versioncode = manifest.getAttributeNS(ANDROID_NS, 'versionCode')
     return versioncode
 
 
@@ -47,11 +326,11 @@ def get_version_name(manifest_xml):
     @rtype: str
     '''
     manifest = get_manifest_element(manifest_xml)
-    versionname = manifest.getAttribute('android:versionName')
+    versionname = manifest.getAttributeNS(ANDROID_NS, 'versionName')
     return versionname
 
 
-def get_uses_feature(manifest_xml):
+def get_uses_feature(manifest_xml, resources=None):
     '''
     Get APK <uses-feature> attributes from AndroidManifest.xml
     See: https://developer.android.com/guide/topics/manifest/uses-feature-element
@@ -59,28 +338,16 @@ def get_uses_feature(manifest_xml):
     @param manifest_xml: manifest xml dom
     @type  manifest_xml: xml dom
 
+    @param resources: resource table used to resolve references
+    @type  resources: ResourceTable
+
     @return: uses-feature
     @rtype: list
     '''
-    uses_feature_list = []
-    uses_features = manifest_xml.getElementsByTagName('uses-feature')
-    if uses_features:
-        for uses_feature in uses_features:
-            # uses-feature attributes
-            name = uses_feature.getAttribute('android:name')
-            required = uses_feature.getAttribute('android:required')
-            gles_version = uses_feature.getAttribute('android:glEsVersion')
-
-            # uses-feature information list
-            uses_feature_info = (name,
-                                 required,
-                                 gles_version)
-            uses_feature_list.append(uses_feature_info)
+    return get_elements(manifest_xml, 'uses-feature', resources)
 
-    return uses_feature_list
 
-
-def get_uses_sdk(manifest_xml):
+def get_uses_sdk(manifest_xml, resources=None):
     '''
     Get APK <uses-sdk> attributes from AndroidManifest.xml
     See: https://developer.android.com/guide/topics/manifest/uses-sdk-element
@@ -88,28 +355,16 @@ def get_uses_sdk(manifest_xml):
     @param manifest_xml: manifest xml dom
     @type  manifest_xml: xml dom
 
+    @param resources: resource table used to resolve references
+    @type  resources: ResourceTable
+
     @return: uses-sdk
     @rtype: list
     '''
-    uses_sdk_list = []
-    uses_sdks = manifest_xml.getElementsByTagName('uses-sdk')
-    if uses_sdks:
-        for uses_feature in uses_sdks:
-            # uses-sdk attributes
-            minsdkversion = uses_feature.getAttribute('android:minSdkVersion')
-            targetsdkversion = uses_feature.getAttribute('android:targetSdkVersion')
-            maxsdkversion = uses_feature.getAttribute('android:maxSdkVersion')
-
-            # uses-sdk information list
-            uses_sdk_info = (minsdkversion,
-                             targetsdkversion,
-                             maxsdkversion)
-            uses_sdk_list.append(uses_sdk_info)
+    return get_elements(manifest_xml, 'uses-sdk', resources)
 
-    return uses_sdk_list
 
-
-def get_permission(manifest_xml):
+def get_permission(manifest_xml, resources=None):
     '''
     Get APK <permission> attributes from AndroidManifest.xml
     See: https://developer.android.com/guide/topics/manifest/permission-element
@@ -117,30 +372,16 @@ def get_permission(manifest_xml):
     @param manifest_xml: manifest xml dom
     @type  manifest_xml: xml dom
 
+    @param resources: resource table used to resolve references
+    @type  resources: ResourceTable
+
     @return: permission
     @rtype: list
     '''
-    permission_list = []
-    permissions = manifest_xml.getElementsByTagName('permission')
-    if permissions:
-        for permission in permissions:
-            # permission attributes
-            name = permission.getAttribute('android:name')
-            description = permission.getAttribute('android:description')
-            permissiongroup = permission.getAttribute('android:permissionGroup')
-            protectionlevel = permission.getAttribute('android:protectionLevel')
-
-            # permission information list
-            permission_info = (name,
-                               description,
-                               permissiongroup,
-                               protectionlevel)
-            permission_list.append(permission_info)
+    return get_elements(manifest_xml, 'permission', resources)
 
-    return permission_list
 
-
-def get_uses_permission(manifest_xml):
+def get_uses_permission(manifest_xml, resources=None):
     '''
     Get APK <uses-permission> attributes from AndroidManifest.xml
     See: https://developer.android.com/guide/topics/manifest/uses-permission-element
@@ -148,26 +389,16 @@ def get_uses_permission(manifest_xml):
     @param manifest_xml: manifest xml dom
     @type  manifest_xml: xml dom
 
+    @param resources: resource table used to resolve references
+    @type  resources: ResourceTable
+
     @return: uses-permission
     @rtype: list
     '''
-    uses_permission_list = []
-    uses_permissions = manifest_xml.getElementsByTagName('uses-permission')
-    if uses_permissions:
-        for uses_perm in uses_permissions:
-            # uses-permission attributes
-            name = uses_perm.getAttribute('android:name')
-            maxsdkversion = uses_perm.getAttribute('android:maxSdkVersion')
-
-            # uses-permission information list
-            usespermission_info = (name,
-                                   maxsdkversion)
-            uses_permission_list.append(usespermission_info)
+    return get_elements(manifest_xml, 'uses-permission', resources)
 
-    return uses_permission_list
 
-
-def get_uses_permission_sdk23(manifest_xml):
+def get_uses_permission_sdk23(manifest_xml, resources=None):
     '''
     Get APK <uses-permission-sdk-23> attributes from AndroidManifest.xml
     See: https://developer.android.com/guide/topics/manifest/uses-permission-sdk-23-element
@@ -175,26 +406,33 @@ def get_uses_permission_sdk23(manifest_xml):
     @param manifest_xml: manifest xml dom
     @type  manifest_xml: xml dom
 
+    @param resources: resource table used to resolve references
+    @type  resources: ResourceTable
+
     @return: uses-permission-sdk-23
     @rtype: list
     '''
-    uses_permission_list = []
-    uses_permissions = manifest_xml.getElementsByTagName('uses-permission-sdk-23')
-    if uses_permissions:
-        for uses_perm in uses_permissions:
-            # uses-permission-23 attributes
-            name = uses_perm.getAttribute('android:name')
-            maxsdkversion = uses_perm.getAttribute('android:maxSdkVersion')
+    return get_elements(manifest_xml, 'uses-permission-sdk-23', resources)
 
-            # uses-permission-23 information list
-            usespermission_info = (name,
-                                   maxsdkversion)
-            uses_permission_list.append(usespermission_info)
 
-    return uses_permission_list
+def get_application(manifest_xml, resources=None):
+    '''
+    Get APK <application> attributes from AndroidManifest.xml
+    See: https://developer.android.com/guide/topics/manifest/application-element
+
+    @param manifest_xml: manifest xml dom
+    @type  manifest_xml: xml dom
 
+    @param resources: resource table used to resolve references
+    @type  resources: ResourceTable
 
-def get_activities(manifest_xml):
+    @return: application
+    @rtype: list
+    '''
+    return get_elements(manifest_xml, 'application', resources)
+
+
+def get_activities(manifest_xml, resources=None):
     '''
     Get APK <activity> attributes from AndroidManifest.xml
     See: https://developer.android.com/guide/topics/manifest/activity-element
@@ -202,133 +440,33 @@ def get_activities(manifest_xml):
     @param manifest_xml: manifest xml dom
     @type  manifest_xml: xml dom
 
+    @param resources: resource table used to resolve references
+    @type  resources: ResourceTable
+
     @return: activity
     @rtype: list
     '''
-    activities_list = []
-    applications = manifest_xml.getElementsByTagName('application')
-    for application in applications:
-        for app_childnode in application.childNodes:
-            manifest_tag_name = ''
-            if app_childnode.nodeName == 'activity':
-                manifest_tag_name = 'Activity'
-
-            if manifest_tag_name in ['Activity']:
-                # activity attributes
-                name = app_childnode.getAttribute('android:name')
-                allowembedded = app_childnode.getAttribute('android:allowembedded')
-                allowtaskreparenting = app_childnode.getAttribute('android:allowTaskReparenting')
-                alwaysretaintaskstate = app_childnode.getAttribute('android:alwaysRetainTaskState')
-                autoremovefromrecents = app_childnode.getAttribute('android:autoRemoveFromRecents')
-                cleartaskonlaunch = app_childnode.getAttribute('android:clearTaskOnLaunch')
-                colormode = app_childnode.getAttribute('android:colorMode')
-                configchanges = app_childnode.getAttribute('android:configChanges')
-                directbootaware = app_childnode.getAttribute('android:directBootAware')
-                documentlaunchmode = app_childnode.getAttribute('android:documentLaunchMode')
-                enabled = app_childnode.getAttribute('android:enabled')
-                excludefromrecents = app_childnode.getAttribute('android:excludeFromRecents')
-                exported = app_childnode.getAttribute('android:exported')
-                finishontasklaunch = app_childnode.getAttribute('android:finishOnTaskLaunch')
-                hardwareaccelerated = app_childnode.getAttribute('android:hardwareAccelerated')
-                immersive = app_childnode.getAttribute('android:immersive')
-                launchmode = app_childnode.getAttribute('android:launchMode')
-                locktaskmode = app_childnode.getAttribute('android:lockTaskMode')
-                maxrecents = app_childnode.getAttribute('android:maxRecents')
-                maxaspectratio = app_childnode.getAttribute('android:maxAspectRatio')
-                multiprocess = app_childnode.getAttribute('android:multiprocess')
-                nohistory = app_childnode.getAttribute('android:noHistory')
-                parentactivityname = app_childnode.getAttribute('android:parentActivityName')
-                persistablemode = app_childnode.getAttribute('android:persistableMode')
-                permission = app_childnode.getAttribute('android:permission')
-                relinquishtaskidentity = app_childnode.getAttribute('android:relinquishTaskIdentity')
-                resizeableactivity = app_childnode.getAttribute('android:resizeableActivity')
-                screenorientation = app_childnode.getAttribute('android:screenOrientation')
-                showforallusers = app_childnode.getAttribute('android:showForAllUsers')
-                statenotneeded = app_childnode.getAttribute('android:stateNotNeeded')
-                pictureinpicture = app_childnode.getAttribute('android:supportsPictureInPicture')
-                taskaffinity = app_childnode.getAttribute('android:taskAffinity')
-                theme = app_childnode.getAttribute('android:theme')
-                uioptions = app_childnode.getAttribute('android:uiOptions')
-                windowsoftinputmode = app_childnode.getAttribute('android:windowSoftInputMode')
-
-                # activity information list
-                activity_info = (name,
-                                 allowembedded,
-                                 allowtaskreparenting,
-                                 alwaysretaintaskstate,
-                                 autoremovefromrecents,
-                                 cleartaskonlaunch,
-                                 colormode,
-                                 configchanges,
-                                 directbootaware,
-                                 documentlaunchmode,
-                                 enabled,
-                                 excludefromrecents,
-                                 exported,
-                                 finishontasklaunch,
-                                 hardwareaccelerated,
-                                 immersive,
-                                 launchmode,
-                                 locktaskmode,
-                                 maxrecents,
-                                 maxaspectratio,
-                                 multiprocess,
-                                 nohistory,
-                                 parentactivityname,
-                                 persistablemode,
-                                 permission,
-                                 relinquishtaskidentity,
-                                 resizeableactivity,
-                                 screenorientation,
-                                 showforallusers,
-                                 statenotneeded,
-                                 pictureinpicture,
-                                 taskaffinity,
-                                 theme,
-                                 uioptions,
-                                 windowsoftinputmode)
-                activities_list.append(activity_info)
-
-    return activities_list
-
-
-def get_activities_alias(manifest_xml):
+    return get_elements(manifest_xml, 'activity', resources)
+
+
+def get_activities_alias(manifest_xml, resources=None):
     '''
     Get APK <activity-alias> attributes from AndroidManifest.xml
+    See: https://developer.android.com/guide/topics/manifest/activity-alias-element
 
     @param manifest_xml: manifest xml dom
     @type  manifest_xml: xml dom
 
+    @param resources: resource table used to resolve references
+    @type  resources: ResourceTable
+
     @return: activity-alias
     @rtype: list
     '''
-    activities_alias_list = []
-    applications = manifest_xml.getElementsByTagName('application')
-    for application in applications:
-        for app_childnode in application.childNodes:
-            manifest_tag_name = ''
-            if app_childnode.nodeName == 'activity-alias':
-                manifest_tag_name = 'Activity-Alias'
-
-            if manifest_tag_name in ['Activity-Alias']:
-                # activity-alias attributes
-                name = app_childnode.getAttribute('android:name')
-                enabled = app_childnode.getAttribute('android:enabled')
-                exported = app_childnode.getAttribute('android:exported')
-                permission = app_childnode.getAttribute('android:permission')
-                targetactivity = app_childnode.getAttribute('android:targetActivity')
-
-                # activity-alias information list
-                activities_alias_list.append(name,
-                                             enabled,
-                                             exported,
-                                             permission,
-                                             targetactivity)
+    return get_elements(manifest_xml, 'activity-alias', resources)
 
-    return activities_alias_list
 
-
-def get_services(manifest_xml):
+def get_services(manifest_xml, resources=None):
     '''
     Get APK <services> attributes from AndroidManifest.xml
     See: https://developer.android.com/guide/topics/manifest/service-element
@@ -336,40 +474,16 @@ def get_services(manifest_xml):
     @param manifest_xml: manifest xml dom
     @type  manifest_xml: xml dom
 
+    @param resources: resource table used to resolve references
+    @type  resources: ResourceTable
+
     @return: service
     @rtype: list
     '''
-    services_list = []
-    services = manifest_xml.getElementsByTagName('service')
-    if services:
-        for service in services:
-            # services attributes
-            name = service.getAttribute('android:name')
-            description = service.getAttribute('android:description')
-            directbootaware = service.getAttribute('android:directBootAware')
-            enabled = service.getAttribute('android:enabled')
-            exported = service.getAttribute('android:exported')
-            foregroundservicetype = service.getAttribute('android:foregroundServiceType')
-            isolatedprocess = service.getAttribute('android:isolatedProcess')
-            permission = service.getAttribute('android:permission')
-            process = service.getAttribute('android:process')
-
-            # services information list
-            service_info = (name,
-                            description,
-                            directbootaware,
-                            enabled,
-                            exported,
-                            foregroundservicetype,
-                            isolatedprocess,
-                            permission,
-                            process)
-            services_list.append(service_info)
-
-    return services_list
-
-
-def get_receivers(manifest_xml):
+    return get_elements(manifest_xml, 'service', resources)
+
+
+def get_receivers(manifest_xml, resources=None):
     '''
     Get APK <receiver> attributes from AndroidManifest.xml
     See: https://developer.android.com/guide/topics/manifest/receiver-element
@@ -377,79 +491,30 @@ def get_receivers(manifest_xml):
     @param manifest_xml: manifest xml dom
     @type  manifest_xml: xml dom
 
+    @param resources: resource table used to resolve references
+    @type  resources: ResourceTable
+
     @return: receiver
     @rtype: list
     '''
-    receivers_list = []
-    receivers = manifest_xml.getElementsByTagName('receiver')
-    if receivers:
-        for receiver in receivers:
-            # receiver attributes
-            name = receiver.getAttribute('android:name')
-            directbootaware = receiver.getAttribute('android:directBootAware')
-            enabled = receiver.getAttribute('android:enabled')
-            exported = receiver.getAttribute('android:exported')
-            permission = receiver.getAttribute('android:permission')
-            process = receiver.getAttribute('android:process')
-
-            # receiver information list
-            receiver_info = (name,
-                             directbootaware,
-                             enabled,
-                             exported,
-                             permission,
-                             process)
-            receivers_list.append(receiver_info)
+    return get_elements(manifest_xml, 'receiver', resources)
 
-    return receivers_list
 
-
-def get_providers(manifest_xml):
+def get_providers(manifest_xml, resources=None):
     '''
     Get APK <provider> attributes from AndroidManifest.xml
+    See: https://developer.android.com/guide/topics/manifest/provider-element
 
     @param manifest_xml: manifest xml dom
     @type  manifest_xml: xml dom
 
+    @param resources: resource table used to resolve references
+    @type  resources: ResourceTable
+
     @return: provider
     @rtype: list
     '''
-    providers_list = []
-    providers = manifest_xml.getElementsByTagName('provider')
-    if providers:
-        for provider in providers:
-            # provider attributes
-            name = provider.getAttribute('android:name')
-            authorities = provider.getAttribute('android:authorities')
-            directbootaware = provider.getAttribute('android:directBootAware')
-            enabled = provider.getAttribute('android:enabled')
-            exported = provider.getAttribute('android:exported')
-            granturipermissions = provider.getAttribute('android:grantUriPermissions')
-            initorder = provider.getAttribute('android:initOrder')
-            multiprocess = provider.getAttribute('android:multiprocess')
-            permission = provider.getAttribute('android:permission')
-            process = provider.getAttribute('android:process')
-            readpermission = provider.getAttribute('android:readPermission')
-            syncable = provider.getAttribute('android:syncable')
-            writepermission = provider.getAttribute('android:writePermission')
-
-            # provider information list
-            providers_info = (name,
-                              authorities,
-                              directbootaware,
-                              enabled,
-                              exported,
-                              granturipermissions,
-                              initorder,
-                              multiprocess,
-                              permission,
-                              process,
-                              readpermission,
-                              syncable,
-                              writepermission)
-            providers_list.append(providers_info)
-
-    return providers_list
+    return get_elements(manifest_xml, 'provider', resources)
 
 
 def get_manifest_element(manifest_xml):
@@ -462,8 +527,8 @@ def get_manifest_element(manifest_xml):
     @return: manifest xml dom
     @rtype: xml dom
     '''
-    manifest = manifest_xml.getElementsByTagName('manifest')
-    if not manifest:
+    manifest = getattr(manifest_xml, 'documentElement', manifest_xml)
+    if manifest is None or manifest.tagName != 'manifest':
         return None
 
-    return manifest[0]
+    return manifest
@@ -13,42 +13,22 @@ from source.settings import (
     REPORT_TEMPLATE,
     REPORT_DIR
 )
+from source.parser_manifest import MANIFEST_SECTIONS
+from source.manifest_schema import format_record
 
 
-def generate_report(apk_filename, app_basic_info, uses_sdk, uses_feature, permission,
-                    uses_permission, uses_permission_sdk23, services, receivers, providers):
+def generate_report(apk_filename, sections):
     """
     Generate the report.
 
     @param apk_filename: Basic information of an apk file
     @type  apk_filename: list
 
-    @param app_basic_info: Basic information of an apk file
-    @type  app_basic_info: list
+    @param sections: section name -> records of an apk file (see MANIFEST_SECTIONS)
+    @type  sections: dict
 
-    @param uses_sdk: uses-sdk of an apk file
-    @type  uses_sdk: list
-
-    @param uses_feature: uses-feature of an apk file
-    @type  uses_feature: list
-
-    @param permission: permission of an sdk file
-    @type  permission: list
-
-    @param uses_permission: uses-permission of an apk file
-    @type  uses_permission: list
-
-    @param uses_permission_sdk23: uses-permission-sdk23 of apk file
-    @type  uses_permission_sdk23: list
-
-    @param services: services of an apk file
-    @type  services: list
-
-    @param receivers: receivers of an apk file
-    @type  receivers: list
-
-    @param providers: providers of an apk file
-    @type  providers: list
+    @return: report file path
+    @rtype: str
     """
     logging.info('Generating report ...')
 
@@ -63,82 +43,14 @@ def generate_report(apk_filename, app_basic_info, uses_sdk, uses_feature, permis
     except OSError as err:
         logging.exception("Failed to copy the file %s - %s", report_filename, err.strerror)
 
-    # write APK Basic Information sheet
-    data_frame = pandas.DataFrame(app_basic_info, columns=['package',
-                                                           'versionCode',
-                                                           'versionName'])
-    append_data_sheet(report_path, data_frame, sheet_name='APK Basic Information', header=0,
-                      index=False)
-
-    # write <uses-sdk> sheet
-    data_frame = pandas.DataFrame(uses_sdk, columns=['minSdkVersion',
-                                                     'targetSdkVersion',
-                                                     'maxSdkVersion'])
-    append_data_sheet(report_path, data_frame, sheet_name='<uses-sdk>', header=0, index=False)
-
-    # write <uses-feature> sheet
-    data_frame = pandas.DataFrame(uses_feature, columns=['name',
-                                                         'required',
-                                                         'glEsVersion'])
-    append_data_sheet(report_path, data_frame, sheet_name='<uses-feature>', header=0, index=False)
-
-    # write <permission> sheet
-    data_frame = pandas.DataFrame(permission, columns=['name',
-                                                       'description',
-                                                       'permissionGroup',
-                                                       'protectionLevel'])
-    append_data_sheet(report_path, data_frame, sheet_name='<permission>', header=0, index=False)
-
-    # write <uses-permission> sheet
-    data_frame = pandas.DataFrame(uses_permission, columns=['name',
-                                                            'maxSdkVersion'])
-    append_data_sheet(report_path, data_frame, sheet_name='<uses-permission>', header=0,
-                      index=False)
-
-    # write <uses-permission-sdk23> sheet
-    data_frame = pandas.DataFrame(uses_permission_sdk23, columns=['name',
-                                                                  'maxSdkVersion'])
-    append_data_sheet(report_path, data_frame, sheet_name='<uses-permission>', header=0,
-                      index=False)
-
-    # write <service> sheet
-    data_frame = pandas.DataFrame(services, columns=['name',
-                                                     'description',
-                                                     'directBootAware',
-                                                     'enabled',
-                                                     'exported',
-                                                     'foregroundServiceType',
-                                                     'isolatedProcess',
-                                                     'permission',
-                                                     'process'])
-    append_data_sheet(report_path, data_frame, sheet_name='<service>', header=0, index=False)
-
-    # write <receiver> sheet
-    data_frame = pandas.DataFrame(receivers, columns=['name',
-                                                      'directBootAware',
-                                                      'enabled',
-                                                      'exported',
-                                                      'permission',
-                                                      'process'])
-    append_data_sheet(report_path, data_frame, sheet_name='<receiver>', header=0, index=False)
-
-    # write <provider> sheet
-    data_frame = pandas.DataFrame(providers, columns=['name',
-                                                      'authorities',
-                                                      'directBootAware',
-                                                      'enabled',
-                                                      'exported',
-                                                      'grantUriPermissions',
-                                                      'initOrder',
-                                                      'multiprocess',
-                                                      'permission',
-                                                      'process',
-                                                      'readPermission',
-                                                      'syncable',
-                                                      'writePermission'])
-    append_data_sheet(report_path, data_frame, sheet_name='<provider>', header=0, index=False)
+    # write one sheet per section
+    for sheet_name, records in sections.items():
+        data_frame = pandas.DataFrame([format_record(record) for record in records],
+                                      columns=MANIFEST_SECTIONS[sheet_name]._fields)
+        append_data_sheet(report_path, data_frame, sheet_name=sheet_name, header=0, index=False)
 
     logging.info('Generated report file %s', 'report/' + report_filename)
+    return report_path
 
 
 def append_data_sheet(filename, dataframe, sheet_name='New Sheet', startrow=None,
@@ -146,6 +58,8 @@ def append_data_sheet(filename, dataframe, sheet_name='New Sheet', startrow=None
     """
     Append a dataframe to an existing Excel file
 
+    Sheets that are not in the report template are created with the dataframe header.
+
     @param filename: Excel path
     @type  filename: str
 
@@ -177,6 +91,10 @@ def append_data_sheet(filename, dataframe, sheet_name='New Sheet', startrow=None
             if startrow is None and sheet_name in writer.book.sheetnames:
                 startrow = writer.book[sheet_name].max_row
 
+            # sheets missing from the template get the dataframe header
+            if sheet_name not in writer.book.sheetnames:
+                to_excel_kwargs['header'] = True
+
             # truncate the sheet
             if truncate_sheet and sheet_name in writer.book.sheetnames:
                 idx = writer.book.sheetnames.index(sheet_name)
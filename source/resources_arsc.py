@@ -0,0 +1,584 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" resources.arsc module. """
+
+import functools
+import logging
+import mmap
+import os
+import struct
+from array import array
+from source.settings import RESOURCES_LOCALE
+
+# Chunk types
+RES_STRING_POOL_TYPE = 0x0001
+RES_TABLE_TYPE = 0x0002
+RES_TABLE_PACKAGE_TYPE = 0x0200
+RES_TABLE_TYPE_TYPE = 0x0201
+
+# String pool flags
+UTF8_FLAG = 0x100
+
+# ResTable_type flags
+FLAG_SPARSE = 0x01
+FLAG_OFFSET16 = 0x02
+
+# ResTable_entry flags
+FLAG_COMPLEX = 0x0001
+FLAG_COMPACT = 0x0008                           # key, flags and value packed in 8 bytes
+
+# Res_value data types
+TYPE_REFERENCE = 0x01
+TYPE_STRING = 0x03
+TYPE_FLOAT = 0x04
+TYPE_INT_DEC = 0x10
+TYPE_INT_HEX = 0x11
+TYPE_INT_BOOLEAN = 0x12
+
+NO_ENTRY = 0xFFFFFFFF
+NO_ENTRY16 = 0xFFFF
+
+# Maximum number of @reference hops followed while resolving a value
+MAX_REFERENCE_DEPTH = 8
+
+RESOURCES_ARSC = 'resources.arsc'
+
+
+class StringPool:
+    """
+    ResStringPool, strings are decoded on demand
+    """
+    __slots__ = ('data', 'offsets_start', 'count', 'strings_start', 'utf8', 'cache')
+
+    def __init__(self, data, offset):
+        header_size, = struct.unpack_from('<H', data, offset + 2)
+        count, _, flags, strings_start = struct.unpack_from('<IIII', data, offset + 8)
+        self.data = data
+        self.offsets_start = offset + header_size
+        self.count = count
+        self.strings_start = offset + strings_start
+        self.utf8 = bool(flags & UTF8_FLAG)
+        self.cache = {}
+
+    def get(self, index):
+        """
+        String at index
+
+        @param index: string index
+        @type  index: int
+
+        @return: string
+        @rtype: str
+        """
+        if index in self.cache:
+            return self.cache[index]
+        if index >= self.count:
+            return ''
+
+        string_offset, = struct.unpack_from('<I', self.data, self.offsets_start + index * 4)
+        position = self.strings_start + string_offset
+        if self.utf8:
+            # utf-16 length, then utf-8 byte length, each 1 or 2 bytes
+            position += 2 if self.data[position] & 0x80 else 1
+            length = self.data[position]
+            if length & 0x80:
+                length = ((length & 0x7F) << 8) | self.data[position + 1]
+                position += 1
+            position += 1
+            value = bytes(self.data[position:position + length]).decode('utf-8', 'replace')
+        else:
+            length, = struct.unpack_from('<H', self.data, position)
+            position += 2
+            if length & 0x8000:
+                low, = struct.unpack_from('<H', self.data, position)
+                length = ((length & 0x7FFF) << 16) | low
+                position += 2
+            value = bytes(self.data[position:position + length * 2]).decode('utf-16-le',
+                                                                             'replace')
+
+        self.cache[index] = value
+        return value
+
+
+class ResourceTable:
+    """
+    Lazy resources.arsc reader
+
+    Opening a table only walks the chunk headers to index the type chunks of
+    every package. Entries are decoded when a resource is first resolved and
+    the results are memoized. The names of a type are indexed the first time
+    a @type/name reference of that type is resolved, so later references are
+    dictionary lookups.
+    """
+
+    def __init__(self, arsc_path, locale=RESOURCES_LOCALE):
+        with open(arsc_path, 'rb') as arsc_file:
+            self.data = mmap.mmap(arsc_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.locale_preference = locale_preference(locale)
+        self.values = None
+        self.packages = {}
+        self.resolved = {}
+        self.index_chunks()
+
+    def index_chunks(self):
+        """
+        Index the string pool, packages and type chunks of the table
+        """
+        chunk_type, header_size, size = struct.unpack_from('<HHI', self.data, 0)
+        if chunk_type != RES_TABLE_TYPE:
+            raise ValueError('Not a resources.arsc file')
+
+        offset = header_size
+        while offset < size:
+            chunk_type, _, chunk_size = struct.unpack_from('<HHI', self.data, offset)
+            if chunk_size == 0:
+                break
+            if chunk_type == RES_STRING_POOL_TYPE and self.values is None:
+                self.values = StringPool(self.data, offset)
+            elif chunk_type == RES_TABLE_PACKAGE_TYPE:
+                self.index_package(offset, chunk_size)
+            offset += chunk_size
+
+    def index_package(self, offset, size):
+        """
+        Index the type chunks of a package
+
+        @param offset: package chunk offset
+        @type  offset: int
+
+        @param size: package chunk size
+        @type  size: int
+        """
+        header_size, = struct.unpack_from('<H', self.data, offset + 2)
+        package_id, = struct.unpack_from('<I', self.data, offset + 8)
+        type_strings, _, key_strings = struct.unpack_from('<III', self.data, offset + 268)
+
+        package = {
+            'types': StringPool(self.data, offset + type_strings),
+            'keys': StringPool(self.data, offset + key_strings),
+            # type id -> [(locale, chunk offset)]
+            'chunks': {},
+            # type name -> type id, built on the first name lookup
+            'type_ids': None,
+            # type id -> {name: entry id}, built on the first lookup of the type
+            'names': {}
+        }
+
+        position = offset + header_size
+        end = offset + size
+        while position < end:
+            chunk_type, _, chunk_size = struct.unpack_from('<HHI', self.data, position)
+            if chunk_size == 0:
+                break
+            if chunk_type == RES_TABLE_TYPE_TYPE:
+                type_id = self.data[position + 8]
+                locale = config_locale(self.data, position + 20)
+                package['chunks'].setdefault(type_id, []).append((locale, position))
+            position += chunk_size
+
+        self.packages[package_id] = package
+
+    def entry_offset(self, chunk, entry_id):
+        """
+        Offset of an entry in a type chunk
+
+        @param chunk: type chunk offset
+        @type  chunk: int
+
+        @param entry_id: entry id
+        @type  entry_id: int
+
+        @return: entry offset, None when the chunk has no such entry
+        @rtype: int
+        """
+        header_size, = struct.unpack_from('<H', self.data, chunk + 2)
+        flags = self.data[chunk + 9]
+        entry_count, entries_start = struct.unpack_from('<II', self.data, chunk + 12)
+        offsets = chunk + header_size
+
+        if flags & FLAG_SPARSE:
+            # sorted (entry id, offset / 4) pairs
+            low, high = 0, entry_count - 1
+            while low <= high:
+                middle = (low + high) // 2
+                idx, sparse_offset = struct.unpack_from('<HH', self.data, offsets + middle * 4)
+                if idx == entry_id:
+                    return chunk + entries_start + sparse_offset * 4
+                if idx < entry_id:
+                    low = middle + 1
+                else:
+                    high = middle - 1
+            return None
+
+        if entry_id >= entry_count:
+            return None
+
+        if flags & FLAG_OFFSET16:
+            entry, = struct.unpack_from('<H', self.data, offsets + entry_id * 2)
+            if entry == NO_ENTRY16:
+                return None
+            return chunk + entries_start + entry * 4
+
+        entry, = struct.unpack_from('<I', self.data, offsets + entry_id * 4)
+        if entry == NO_ENTRY:
+            return None
+        return chunk + entries_start + entry
+
+    def find_entry(self, res_id):
+        """
+        Offset of the entry of a resource id in the preferred locale
+
+        @param res_id: resource id
+        @type  res_id: int
+
+        @return: entry offset, None when the id is not defined
+        @rtype: int
+        """
+        package = self.packages.get(res_id >> 24)
+        if package is None:
+            return None
+
+        chunks = package['chunks'].get((res_id >> 16) & 0xFF, [])
+        entry_id = res_id & 0xFFFF
+        for locale in self.locale_preference:
+            for chunk_locale, chunk in chunks:
+                if chunk_locale == locale:
+                    entry = self.entry_offset(chunk, entry_id)
+                    if entry is not None:
+                        return entry
+
+        # fall back to any configuration that defines the entry
+        for _, chunk in chunks:
+            entry = self.entry_offset(chunk, entry_id)
+            if entry is not None:
+                return entry
+        return None
+
+    def resolve_id(self, res_id, depth=0):
+        """
+        Value of a resource id
+
+        @param res_id: resource id
+        @type  res_id: int
+
+        @return: value, None when the id can not be resolved
+        @rtype: str
+        """
+        if res_id in self.resolved:
+            return self.resolved[res_id]
+
+        value = None
+        entry = self.find_entry(res_id)
+        if entry is not None:
+            entry_size, entry_flags = struct.unpack_from('<HH', self.data, entry)
+            if entry_flags & FLAG_COMPACT:
+                # the value type is the high byte of the flags
+                data, = struct.unpack_from('<I', self.data, entry + 4)
+                value = self.format_value(entry_flags >> 8, data, depth)
+            elif not entry_flags & FLAG_COMPLEX:
+                data_type = self.data[entry + entry_size + 3]
+                data, = struct.unpack_from('<I', self.data, entry + entry_size + 4)
+                value = self.format_value(data_type, data, depth)
+
+        self.resolved[res_id] = value
+        return value
+
+    def format_value(self, data_type, data, depth):
+        """
+        Format a Res_value
+
+        @param data_type: value type
+        @type  data_type: int
+
+        @param data: value data
+        @type  data: int
+
+        @param depth: number of references followed so far
+        @type  depth: int
+
+        @return: value
+        @rtype: str
+        """
+        if data_type == TYPE_STRING:
+            return self.values.get(data)
+        if data_type == TYPE_REFERENCE:
+            if depth >= MAX_REFERENCE_DEPTH or data == 0:
+                return None
+            return self.resolve_id(data, depth + 1)
+        if data_type == TYPE_INT_BOOLEAN:
+            return 'true' if data else 'false'
+        if data_type == TYPE_INT_DEC:
+            return str(struct.unpack('<i', struct.pack('<I', data))[0])
+        if data_type == TYPE_INT_HEX:
+            return hex(data)
+        if data_type == TYPE_FLOAT:
+            return str(struct.unpack('<f', struct.pack('<I', data))[0])
+        return hex(data)
+
+    def find_id(self, type_name, key_name):
+        """
+        Resource id of a type/name pair of the application package
+
+        @param type_name: resource type (string, drawable, ...)
+        @type  type_name: str
+
+        @param key_name: resource name
+        @type  key_name: str
+
+        @return: resource id, None when the name is not defined
+        @rtype: int
+        """
+        for package_id, package in self.packages.items():
+            if package['type_ids'] is None:
+                types = package['types']
+                package['type_ids'] = {types.get(index): index + 1
+                                       for index in range(types.count)}
+            type_id = package['type_ids'].get(type_name)
+            if type_id is None:
+                continue
+
+            names = package['names'].get(type_id)
+            if names is None:
+                names = package['names'][type_id] = self.index_names(package, type_id)
+            entry_id = names.get(key_name)
+            if entry_id is not None:
+                return (package_id << 24) | (type_id << 16) | entry_id
+        return None
+
+    def index_names(self, package, type_id):
+        """
+        Names of the entries of a type, over every configuration
+
+        @param package: package index (see index_package)
+        @type  package: dict
+
+        @param type_id: type id
+        @type  type_id: int
+
+        @return: name -> entry id
+        @rtype: dict
+        """
+        entry_keys = {}
+        for _, chunk in package['chunks'].get(type_id, []):
+            for entry_id, entry in self.chunk_entries(chunk):
+                if entry_id not in entry_keys:
+                    entry_keys[entry_id] = self.entry_key(entry)
+
+        keys = package['keys']
+        names = {}
+        for entry_id, key in sorted(entry_keys.items()):
+            names.setdefault(keys.get(key), entry_id)
+        return names
+
+    def chunk_entries(self, chunk):
+        """
+        Entries of a type chunk
+
+        @param chunk: type chunk offset
+        @type  chunk: int
+
+        @return: (entry id, entry offset) pairs
+        @rtype: iterator
+        """
+        header_size, = struct.unpack_from('<H', self.data, chunk + 2)
+        flags = self.data[chunk + 9]
+        entry_count, entries_start = struct.unpack_from('<II', self.data, chunk + 12)
+        offsets = chunk + header_size
+        entries = chunk + entries_start
+
+        if flags & FLAG_SPARSE:
+            for entry_id, offset in struct.iter_unpack(
+                    '<HH', self.data[offsets:offsets + entry_count * 4]):
+                yield entry_id, entries + offset * 4
+        elif flags & FLAG_OFFSET16:
+            for entry_id, offset in enumerate(array(
+                    'H', self.data[offsets:offsets + entry_count * 2])):
+                if offset != NO_ENTRY16:
+                    yield entry_id, entries + offset * 4
+        else:
+            for entry_id, offset in enumerate(array(
+                    'I', self.data[offsets:offsets + entry_count * 4])):
+                if offset != NO_ENTRY:
+                    yield entry_id, entries + offset
+
+    def entry_key(self, entry):
+        """
+        Key string index of an entry
+
+        @param entry: entry offset
+        @type  entry: int
+
+        @return: key index
+        @rtype: int
+        """
+        entry_flags, = struct.unpack_from('<H', self.data, entry + 2)
+        if entry_flags & FLAG_COMPACT:
+            key, = struct.unpack_from('<H', self.data, entry)
+        else:
+            key, = struct.unpack_from('<I', self.data, entry + 4)
+        return key
+
+    def resolve(self, reference):
+        """
+        Resolve a manifest attribute value
+
+        Accepts @type/name and @0xXXXXXXXX references. Other values, framework
+        references and unresolved references are returned unchanged.
+
+        @param reference: attribute value
+        @type  reference: str
+
+        @return: resolved value
+        @rtype: str
+        """
+        if not reference.startswith('@') or reference.startswith('@android:'):
+            return reference
+        if reference in self.resolved:
+            return self.resolved[reference]
+
+        res_id = None
+        if '/' in reference:
+            type_name, key_name = reference[1:].split('/', 1)
+            res_id = self.find_id(type_name.split(':')[-1], key_name)
+        else:
+            try:
+                res_id = int(reference[1:], 16)
+            except ValueError:
+                pass
+
+        value = self.resolve_id(res_id) if res_id is not None else None
+        if value is None:
+            value = reference
+        self.resolved[reference] = value
+        return value
+
+    def close(self):
+        """
+        Release the memory map
+        """
+        self.data.close()
+
+
+def config_locale(data, offset):
+    """
+    Locale of a ResTable_config
+
+    @param data: resources.arsc data
+    @type  data: mmap
+
+    @param offset: config offset
+    @type  offset: int
+
+    @return: locale ('' for the default configuration, 'pt', 'pt-BR', ...)
+    @rtype: str
+    """
+    language = unpack_locale_code(data[offset + 8], data[offset + 9])
+    country = unpack_locale_code(data[offset + 10], data[offset + 11])
+    if country:
+        return language + '-' + country.upper()
+    return language
+
+
+def unpack_locale_code(first, second):
+    """
+    Unpack a two or three letter language/country code
+
+    @return: code
+    @rtype: str
+    """
+    if first & 0x80:
+        letters = (second & 0x1F,
+                   ((second & 0xE0) >> 5) | ((first & 0x03) << 3),
+                   (first & 0x7C) >> 2)
+        return ''.join(chr(letter + ord('a')) for letter in letters)
+    if first == 0:
+        return ''
+    return chr(first) + chr(second)
+
+
+def locale_preference(locale):
+    """
+    Locales tried in order when resolving a value
+
+    @param locale: preferred locale ('' for the default configuration)
+    @type  locale: str
+
+    @return: locales
+    @rtype: list
+    """
+    preference = []
+    if locale:
+        preference.append(locale)
+        if '-' in locale:
+            preference.append(locale.split('-')[0])
+    preference.append('')
+    return preference
+
+
+def load_resource_table(app_folder, locale=RESOURCES_LOCALE):
+    """
+    Resource table of a decompiled apk, memoized per resources.arsc file
+
+    A folder decompiled again gets a new resources.arsc, so its table is
+    opened again.
+
+    @param app_folder: decompiled apk folder
+    @type  app_folder: str
+
+    @param locale: preferred locale
+    @type  locale: str
+
+    @return: resource table, None when the apk has no resources.arsc
+    @rtype: ResourceTable
+    """
+    arsc_path = os.path.join(app_folder, RESOURCES_ARSC)
+    try:
+        stat = os.stat(arsc_path)
+    except OSError:
+        return None
+
+    return open_resource_table(arsc_path, locale,
+                               (stat.st_ino, stat.st_mtime_ns, stat.st_size))
+
+
+@functools.lru_cache(maxsize=32)
+def open_resource_table(arsc_path, locale, signature):  # pylint: disable=unused-argument
+    """
+    Open a resource table, memoized per file version
+
+    @param arsc_path: resources.arsc path
+    @type  arsc_path: str
+
+    @param locale: preferred locale
+    @type  locale: str
+
+    @param signature: (inode, mtime, size) of the file, part of the memoization key
+    @type  signature: tuple
+
+    @return: resource table, None when it can not be read
+    @rtype: ResourceTable
+    """
+    try:
+        return ResourceTable(arsc_path, locale)
+    except (OSError, ValueError, struct.error) as err:
+        logging.error('Could not read the resource table %s: %s', arsc_path, err)
+        return None
+
+
+def resolve_reference(value, resources):
+    """
+    Resolve a manifest attribute value when a resource table is available
+
+    @param value: attribute value
+    @type  value: str
+
+    @param resources: resource table
+    @type  resources: ResourceTable
+
+    @return: resolved value
+    @rtype: str
+    """
+    if resources is None or not value:
+        return value
+    return resources.resolve(value)
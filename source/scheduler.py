@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Job scheduler module. """
+
+import heapq
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from source.settings import (
+    INTERACTIVE_WEIGHT,
+    SCHEDULER_AGING,
+    SCHEDULER_HISTORY
+)
+from source.metrics import SCHEDULER_QUEUE_DEPTH
+
+# Priority classes
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+PRIORITY_WEIGHTS = {INTERACTIVE: INTERACTIVE_WEIGHT, BULK: 1}
+
+# Cost model of an apk without history: fixed cost plus a cost per MB,
+# the cost per MB is then learnt from the finished jobs
+BASE_SECONDS = 2.0
+INITIAL_SECONDS_PER_MB = 0.3
+LEARNING_RATE = 0.2
+MAX_HISTORY = 10000
+MB = 1024 * 1024
+
+
+class CostModel:
+    """
+    Estimated run time of a job, from the past run time of the same apk or
+    from its size
+    """
+
+    def __init__(self, history_path=SCHEDULER_HISTORY):
+        self.history_path = history_path
+        self.history = {}
+        self.seconds_per_mb = INITIAL_SECONDS_PER_MB
+        self.lock = threading.Lock()
+        self.load()
+
+    def estimate(self, key, size):
+        """
+        Estimated seconds of a job
+
+        @param key: apk key (see job_key)
+        @type  key: str
+
+        @param size: apk size in bytes
+        @type  size: int
+
+        @return: seconds
+        @rtype: float
+        """
+        seconds = self.history.get(key)
+        if seconds is None:
+            seconds = BASE_SECONDS + self.seconds_per_mb * size / MB
+        return seconds
+
+    def observe(self, key, size, seconds):
+        """
+        Learn from a finished job
+
+        @param key: apk key (see job_key)
+        @type  key: str
+
+        @param size: apk size in bytes
+        @type  size: int
+
+        @param seconds: run time
+        @type  seconds: float
+        """
+        with self.lock:
+            self.history.pop(key, None)
+            self.history[key] = seconds
+            if len(self.history) > MAX_HISTORY:
+                del self.history[next(iter(self.history))]
+            if size >= MB:
+                observed = max(0.0, seconds - BASE_SECONDS) * MB / size
+                self.seconds_per_mb += LEARNING_RATE * (observed - self.seconds_per_mb)
+
+    def load(self):
+        """
+        Read the stored history
+        """
+        try:
+            with open(self.history_path) as history_file:
+                stored = json.load(history_file)
+            self.history = dict(stored['history'])
+            self.seconds_per_mb = float(stored['seconds_per_mb'])
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as err:
+            logging.error('Could not read the scheduler history %s: %s', self.history_path, err)
+
+    def save(self):
+        """
+        Store the history, replacing the file atomically
+        """
+        tmp_path = self.history_path + '.tmp'
+        try:
+            with self.lock, open(tmp_path, 'w') as history_file:
+                json.dump({'seconds_per_mb': self.seconds_per_mb, 'history': self.history},
+                          history_file)
+            os.replace(tmp_path, self.history_path)
+        except OSError as err:
+            logging.error('Could not write the scheduler history %s: %s', self.history_path, err)
+
+
+class Job:
+    """
+    Scheduled call of a function on an apk
+    """
+    __slots__ = ('key', 'group', 'size', 'priority', 'function', 'estimate', 'future', 'started')
+
+    def __init__(self, key, group, size, priority, function, estimate):
+        self.key = key
+        self.group = group
+        self.size = size
+        self.priority = priority
+        self.function = function
+        self.estimate = estimate
+        self.future = Future()
+        self.started = False
+
+
+class Scheduler:
+    """
+    Run apk jobs on a fixed number of worker threads
+
+    - Classes share the workers in proportion to PRIORITY_WEIGHTS (stride
+      scheduling on the estimated cost), so interactive jobs get the next
+      free worker while bulk jobs keep their share.
+    - Inside a class the shortest estimated job runs first. A job gains
+      SCHEDULER_AGING estimated seconds per second it waits, so large jobs
+      are never starved.
+    - When the largest pending bulk job is as long as the remaining bulk
+      work per worker and more than one worker is idle, it starts right away
+      so it does not end the batch alone on one worker. This trades the
+      latency of the small jobs for the makespan of the batch; the other
+      idle workers still take the small jobs at the same time.
+    - Jobs of apk files with the same name decode into the same folder, so
+      they run one at a time, in submission order.
+
+    The jobs waiting for a worker, queued or held behind their group, are
+    counted per class in SCHEDULER_QUEUE_DEPTH.
+
+    Each worker thread owns a context (e.g. an apktool framework directory)
+    created by worker_context(slot) and passed to every job it runs. A
+    worker whose context can not be created runs its jobs with None.
+    """
+
+    def __init__(self, workers, worker_context=None, release_context=None, model=None):
+        self.workers = max(1, workers)
+        self.worker_context = worker_context
+        self.release_context = release_context
+        self.model = model if model is not None else CostModel()
+        self.condition = threading.Condition()
+        self.sequence = itertools.count()
+        self.queues = {priority: [] for priority in PRIORITY_WEIGHTS}
+        self.largest = {priority: [] for priority in PRIORITY_WEIGHTS}
+        self.pending = {priority: 0 for priority in PRIORITY_WEIGHTS}
+        self.pending_cost = {priority: 0.0 for priority in PRIORITY_WEIGHTS}
+        self.passes = {priority: 0.0 for priority in PRIORITY_WEIGHTS}
+        for priority in PRIORITY_WEIGHTS:
+            # export the empty classes too
+            SCHEDULER_QUEUE_DEPTH.inc(0, priority)
+        self.virtual_time = 0.0
+        self.running = 0
+        # group -> jobs waiting for the running or queued job of their group
+        self.waiting = {}
+        self.closed = False
+        self.threads = [threading.Thread(target=self.run_worker, args=(slot,),
+                                         name='scheduler-%d' % slot, daemon=True)
+                        for slot in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def submit(self, apk_path, priority, function):
+        """
+        Schedule a job
+
+        @param apk_path: apk file path, its size drives the estimate
+        @type  apk_path: str
+
+        @param priority: INTERACTIVE or BULK
+        @type  priority: str
+
+        @param function: job, called with the worker context
+        @type  function: function
+
+        @return: result of the job
+        @rtype: concurrent.futures.Future
+        """
+        try:
+            size = os.path.getsize(apk_path)
+        except OSError:
+            size = 0
+        key = job_key(apk_path, size)
+        job = Job(key, os.path.basename(apk_path), size, priority, function,
+                  self.model.estimate(key, size))
+
+        with self.condition:
+            if self.closed:
+                raise RuntimeError('The scheduler is shut down')
+            SCHEDULER_QUEUE_DEPTH.inc(1, priority)
+            if job.group in self.waiting:
+                self.waiting[job.group].append(job)
+            else:
+                self.waiting[job.group] = deque()
+                self.enqueue(job)
+        return job.future
+
+    def enqueue(self, job):
+        """
+        Queue a job in its class, the caller holds the condition
+
+        @param job: job
+        @type  job: Job
+        """
+        priority = job.priority
+        if not self.pending[priority]:
+            # an idle class does not bank credit while it has no jobs
+            self.passes[priority] = max(self.passes[priority], self.virtual_time)
+        sequence = next(self.sequence)
+        heapq.heappush(self.queues[priority],
+                       (job.estimate + SCHEDULER_AGING * time.monotonic(), sequence, job))
+        heapq.heappush(self.largest[priority], (-job.estimate, sequence, job))
+        self.pending[priority] += 1
+        self.pending_cost[priority] += job.estimate
+        self.condition.notify()
+
+    def finish(self, job):
+        """
+        Queue the next job of the group of a finished job
+
+        @param job: finished job
+        @type  job: Job
+        """
+        with self.condition:
+            self.running -= 1
+            waiting = self.waiting[job.group]
+            if waiting:
+                self.enqueue(waiting.popleft())
+            else:
+                del self.waiting[job.group]
+
+    def next_job(self):
+        """
+        Pop the job to run next, the caller holds the condition
+
+        @return: job
+        @rtype: Job
+        """
+        priority = min((priority for priority in PRIORITY_WEIGHTS if self.pending[priority]),
+                       key=lambda priority: self.passes[priority])
+
+        largest = self.largest[priority]
+        while largest[0][2].started:
+            heapq.heappop(largest)
+        idle = self.workers - self.running
+        if priority == BULK and idle > 1 and \
+                -largest[0][0] * self.workers >= self.pending_cost[priority]:
+            job = heapq.heappop(largest)[2]
+        else:
+            queue = self.queues[priority]
+            while queue[0][2].started:
+                heapq.heappop(queue)
+            job = heapq.heappop(queue)[2]
+
+        job.started = True
+        SCHEDULER_QUEUE_DEPTH.inc(-1, priority)
+        self.running += 1
+        self.pending[priority] -= 1
+        self.pending_cost[priority] -= job.estimate
+        self.virtual_time = self.passes[priority]
+        self.passes[priority] += job.estimate / PRIORITY_WEIGHTS[priority]
+        return job
+
+    def run_worker(self, slot):
+        """
+        Worker thread: run jobs until the scheduler is shut down
+
+        @param slot: worker number
+        @type  slot: int
+        """
+        context = None
+        try:
+            if self.worker_context is not None:
+                try:
+                    context = self.worker_context(slot)
+                except Exception:  # pylint: disable=broad-except
+                    logging.exception('Creating the context of worker %d, running its jobs '
+                                      'without one', slot)
+            while True:
+                with self.condition:
+                    while not any(self.pending.values()) and not self.closed:
+                        self.condition.wait()
+                    if not any(self.pending.values()):
+                        return
+                    job = self.next_job()
+
+                try:
+                    self.run_job(job, context)
+                finally:
+                    self.finish(job)
+        finally:
+            if self.release_context is not None and context is not None:
+                self.release_context(context)
+
+    def run_job(self, job, context):
+        """
+        Run a job and set its result, unless it was cancelled
+
+        @param job: job
+        @type  job: Job
+
+        @param context: context of the worker
+        @type  context: object
+        """
+        if not job.future.set_running_or_notify_cancel():
+            return
+        start = time.monotonic()
+        try:
+            result = job.function(context)
+        except Exception as err:  # pylint: disable=broad-except
+            logging.exception('Running the job of %s', job.key)
+            job.future.set_exception(err)
+        else:
+            self.model.observe(job.key, job.size, time.monotonic() - start)
+            job.future.set_result(result)
+
+    def shutdown(self, cancel_pending=False):
+        """
+        Stop the workers once the pending jobs ran, and store the cost history
+
+        @param cancel_pending: cancel the jobs that did not start instead of running them
+        @type  cancel_pending: bool
+        """
+        with self.condition:
+            self.closed = True
+            if cancel_pending:
+                for priority, queue in self.queues.items():
+                    for _, _, job in queue:
+                        if not job.started:
+                            job.started = True
+                            job.future.cancel()
+                    queue.clear()
+                    self.largest[priority].clear()
+                    SCHEDULER_QUEUE_DEPTH.inc(-self.pending[priority], priority)
+                    self.pending[priority] = 0
+                    self.pending_cost[priority] = 0.0
+                for waiting in self.waiting.values():
+                    for job in waiting:
+                        job.future.cancel()
+                        SCHEDULER_QUEUE_DEPTH.inc(-1, job.priority)
+                    waiting.clear()
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.model.save()
+
+
+def batch_order(items, cost, workers):
+    """
+    Order of a batch run without a scheduler, by the rules of its bulk class:
+    shortest first, except the items longer than a worker's share of the
+    batch, which start first, largest first, so they do not end the batch
+    alone on one worker
+
+    @param items: items of the batch
+    @type  items: list
+
+    @param cost: function returning the estimated cost of an item
+    @type  cost: function
+
+    @param workers: number of workers
+    @type  workers: int
+
+    @return: items in run order
+    @rtype: list
+    """
+    costs = {item: cost(item) for item in items}
+    share = sum(costs.values()) / max(1, workers)
+    ordered = sorted(items, key=costs.get)
+    return [item for item in reversed(ordered) if workers > 1 and costs[item] >= share] + \
+        [item for item in ordered if workers <= 1 or costs[item] < share]
+
+
+def job_key(apk_path, size):
+    """
+    History key of an apk: its file name and size
+
+    @param apk_path: apk file path
+    @type  apk_path: str
+
+    @param size: apk size in bytes
+    @type  size: int
+
+    @return: key
+    @rtype: str
+    """
+    return '%s:%d' % (os.path.basename(apk_path), size)
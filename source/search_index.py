@@ -0,0 +1,586 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Name search index module. """
+
+import bisect
+import glob
+import logging
+import mmap
+import os
+import pickle
+import re
+import struct
+import tempfile
+import threading
+from array import array
+from source.settings import (
+    INDEX_DIR,
+    INDEX_MAX_SEGMENTS
+)
+
+# The regular expression parser is not a public API: without it, or when
+# it changes, searches check every name instead of narrowing on trigrams
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    try:
+        import sre_parse  # pylint: disable=deprecated-module
+    except ImportError:
+        sre_parse = None
+
+# Columns indexed in every section that has them
+INDEXED_COLUMNS = ('package', 'name', 'authorities')
+
+# Trigram intersection stops once the candidates are this few, the regex is
+# cheaper than looking up the remaining posting lists
+MIN_CANDIDATES = 256
+
+# Posting lists this many times longer than the candidates are probed with
+# a binary search per candidate instead of being intersected as a whole
+BISECT_RATIO = 32
+
+# An occurrence packs (app number, field number) in one 64-bit item
+FIELD_BITS = 8
+FIELD_MASK = (1 << FIELD_BITS) - 1
+
+# A trigram key packs its three code points in one 64-bit item
+CODE_POINT_BITS = 21
+
+SEGMENT_PATTERN = 'segment-*.tri'
+SEGMENT_FORMAT = 'segment-%08d.tri'
+SEGMENT_MAGIC = b'AMATRI02'
+SEGMENT_FOOTER = struct.Struct('<Q8s')
+ALIGNMENT = 8
+
+
+class IndexWriter:
+    """
+    Names of the apps analysed since the last flush
+
+    Every flush writes them as a new immutable segment of the index, so the
+    index grows with each analysis without rewriting what is stored. An app
+    analysed again is superseded by the newer segment.
+    """
+
+    def __init__(self, index_dir=INDEX_DIR):
+        self.index_dir = index_dir
+        self.apps = {}
+        self.lock = threading.Lock()
+
+    def add(self, app_folder, entries):
+        """
+        Add the names of an app
+
+        @param app_folder: decompiled apk folder
+        @type  app_folder: str
+
+        @param entries: (section, column, value) names of the app (see index_entries)
+        @type  entries: list
+        """
+        with self.lock:
+            self.apps[app_folder] = entries
+
+    def __len__(self):
+        return len(self.apps)
+
+    def flush(self):
+        """
+        Write the added apps as a new segment and merge the small segments
+        """
+        with self.lock:
+            if not self.apps:
+                return
+            os.makedirs(self.index_dir, exist_ok=True)
+            paths = segment_paths(self.index_dir)
+            number = segment_number(paths[-1]) + 1 if paths else 0
+            write_segment(os.path.join(self.index_dir, SEGMENT_FORMAT % number), self.apps)
+            self.apps = {}
+
+            paths = segment_paths(self.index_dir)
+            if len(paths) > INDEX_MAX_SEGMENTS:
+                try:
+                    merge_segments(merge_run(paths))
+                except (OSError, ValueError, struct.error, pickle.UnpicklingError) as err:
+                    logging.error('Merging the search index segments: %s', err)
+
+
+class Segment:
+    """
+    Memory-mapped index segment
+
+    Layout: app names (sorted utf-8 blob and offsets), values (utf-8 blob
+    and offsets), occurrences of every value (offsets and packed items),
+    sorted trigram keys with the offsets of their posting lists, the posting
+    lists of value numbers, then a small pickled directory of these parts
+    and the footer. Opening a segment only reads the directory; a search
+    reads the posting lists of its trigrams and the names it checks.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as segment_file:
+            self.data = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+        directory_offset, magic = SEGMENT_FOOTER.unpack_from(self.data,
+                                                             len(self.data) - SEGMENT_FOOTER.size)
+        if magic != SEGMENT_MAGIC:
+            self.data.close()
+            raise ValueError('Not an index segment')
+
+        directory = pickle.loads(self.data[directory_offset:len(self.data) - SEGMENT_FOOTER.size])
+        self.fields = directory['fields']
+        self.app_blob = self.view(directory['app_blob'], 'B')
+        self.app_offsets = self.view(directory['app_offsets'], 'Q')
+        self.blob = self.view(directory['blob'], 'B')
+        self.value_offsets = self.view(directory['value_offsets'], 'Q')
+        self.occurrence_offsets = self.view(directory['occurrence_offsets'], 'Q')
+        self.occurrences = self.view(directory['occurrences'], 'Q')
+        self.trigram_keys = self.view(directory['trigram_keys'], 'Q')
+        self.trigram_offsets = self.view(directory['trigram_offsets'], 'Q')
+        self.postings = self.view(directory['postings'], 'I')
+        self.app_names = {}
+
+    def view(self, part, item_format):
+        """
+        Typed view of a part of the segment
+
+        @param part: (offset, size in bytes)
+        @type  part: tuple
+
+        @param item_format: array item format
+        @type  item_format: str
+
+        @return: view
+        @rtype: memoryview
+        """
+        offset, size = part
+        return memoryview(self.data)[offset:offset + size].cast(item_format)
+
+    def __len__(self):
+        return len(self.value_offsets) - 1
+
+    def value(self, value_id):
+        """
+        Value of a value number
+        """
+        return bytes(self.blob[self.value_offsets[value_id]:
+                               self.value_offsets[value_id + 1]]).decode('utf-8')
+
+    def app_count(self):
+        """
+        Number of apps stored in the segment
+        """
+        return len(self.app_offsets) - 1
+
+    def app(self, app_id):
+        """
+        App folder of an app number
+        """
+        app = self.app_names.get(app_id)
+        if app is None:
+            app = self.app_names[app_id] = bytes(
+                self.app_blob[self.app_offsets[app_id]:self.app_offsets[app_id + 1]]).decode('utf-8')
+        return app
+
+    def has_app(self, app):
+        """
+        Whether the segment stores an app, by binary search of the sorted names
+        """
+        low, high = 0, self.app_count()
+        while low < high:
+            middle = (low + high) // 2
+            if self.app(middle) < app:
+                low = middle + 1
+            else:
+                high = middle
+        return low < self.app_count() and self.app(low) == app
+
+    def posting_list(self, trigram):
+        """
+        Sorted value numbers containing a trigram
+        """
+        key = trigram_key(trigram)
+        position = bisect.bisect_left(self.trigram_keys, key)
+        if position == len(self.trigram_keys) or self.trigram_keys[position] != key:
+            return self.postings[0:0]
+        return self.postings[self.trigram_offsets[position]:self.trigram_offsets[position + 1]]
+
+    def value_occurrences(self, value_id):
+        """
+        (app, section, column) occurrences of a value number
+        """
+        for occurrence in self.occurrences[self.occurrence_offsets[value_id]:
+                                           self.occurrence_offsets[value_id + 1]]:
+            yield (self.app(occurrence >> FIELD_BITS),) + self.fields[occurrence & FIELD_MASK]
+
+    def candidates(self, required):
+        """
+        Value numbers containing every required trigram
+
+        @param required: trigrams
+        @type  required: set
+
+        @return: value numbers
+        @rtype: iterable
+        """
+        if not required:
+            return range(len(self))
+
+        postings = sorted((self.posting_list(trigram) for trigram in required), key=len)
+        candidates = set(postings[0])
+        for other in postings[1:]:
+            if len(candidates) <= MIN_CANDIDATES:
+                break
+            if len(other) < BISECT_RATIO * len(candidates):
+                candidates.intersection_update(other)
+            else:
+                candidates = {value_id for value_id in candidates if contains(other, value_id)}
+        return sorted(candidates)
+
+    def entries(self):
+        """
+        app -> (section, column, value) names stored in the segment
+        """
+        apps = {self.app(app_id): [] for app_id in range(self.app_count())}
+        for value_id in range(len(self)):
+            value = self.value(value_id)
+            for app, section, column in self.value_occurrences(value_id):
+                apps[app].append((section, column, value))
+        return apps
+
+    def close(self):
+        """
+        Release the views and the mapping
+        """
+        for view in (self.app_blob, self.app_offsets, self.blob, self.value_offsets,
+                     self.occurrence_offsets, self.occurrences, self.trigram_keys,
+                     self.trigram_offsets, self.postings):
+            view.release()
+        self.data.close()
+
+
+def contains(postings, value_id):
+    """
+    Whether a sorted posting list contains a value number
+    """
+    position = bisect.bisect_left(postings, value_id)
+    return position < len(postings) and postings[position] == value_id
+
+
+def write_segment(path, apps):
+    """
+    Write apps as an index segment, replacing the file atomically
+
+    @param path: segment file
+    @type  path: str
+
+    @param apps: app -> (section, column, value) names
+    @type  apps: dict
+    """
+    app_names = sorted(apps)
+    fields = []
+    field_ids = {}
+    value_ids = {}
+    occurrences = []
+    for app_id, app in enumerate(app_names):
+        for section, column, value in apps[app]:
+            field_id = field_ids.get((section, column))
+            if field_id is None:
+                if len(fields) > FIELD_MASK:
+                    raise ValueError('Too many indexed section columns')
+                field_id = field_ids[(section, column)] = len(fields)
+                fields.append((section, column))
+            value_id = value_ids.get(value)
+            if value_id is None:
+                value_id = value_ids[value] = len(occurrences)
+                occurrences.append([])
+            occurrences[value_id].append(app_id << FIELD_BITS | field_id)
+
+    blob = bytearray()
+    value_offsets = array('Q', [0])
+    posting_lists = {}
+    for value_id, value in enumerate(value_ids):
+        blob += value.encode('utf-8')
+        value_offsets.append(len(blob))
+        for trigram in trigrams(value.lower()):
+            posting_list = posting_lists.get(trigram)
+            if posting_list is None:
+                posting_list = posting_lists[trigram] = array('I')
+            posting_list.append(value_id)
+
+    occurrence_offsets = array('Q', [0])
+    packed_occurrences = array('Q')
+    for value_occurrences in occurrences:
+        packed_occurrences.extend(value_occurrences)
+        occurrence_offsets.append(len(packed_occurrences))
+
+    trigram_keys = array('Q')
+    trigram_offsets = array('Q', [0])
+    postings = array('I')
+    for key, trigram in sorted((trigram_key(trigram), trigram) for trigram in posting_lists):
+        trigram_keys.append(key)
+        postings.extend(posting_lists[trigram])
+        trigram_offsets.append(len(postings))
+
+    app_blob = bytearray()
+    app_offsets = array('Q', [0])
+    for app in app_names:
+        app_blob += app.encode('utf-8')
+        app_offsets.append(len(app_blob))
+
+    directory = {'fields': fields}
+    tmp_fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(tmp_fd, 'wb') as segment_file:
+        for name, part in (('app_blob', app_blob),
+                           ('app_offsets', app_offsets),
+                           ('blob', blob),
+                           ('value_offsets', value_offsets),
+                           ('occurrence_offsets', occurrence_offsets),
+                           ('occurrences', packed_occurrences),
+                           ('trigram_keys', trigram_keys),
+                           ('trigram_offsets', trigram_offsets),
+                           ('postings', postings)):
+            offset = segment_file.tell()
+            segment_file.write(part)
+            directory[name] = (offset, segment_file.tell() - offset)
+            segment_file.write(b'\0' * (-segment_file.tell() % ALIGNMENT))
+
+        directory_offset = segment_file.tell()
+        segment_file.write(pickle.dumps(directory, protocol=pickle.HIGHEST_PROTOCOL))
+        segment_file.write(SEGMENT_FOOTER.pack(directory_offset, SEGMENT_MAGIC))
+    os.replace(tmp_path, path)
+
+
+def segment_paths(index_dir=INDEX_DIR):
+    """
+    Segment files of the index, oldest first
+    """
+    return sorted(glob.glob(os.path.join(index_dir, SEGMENT_PATTERN)))
+
+
+def segment_number(path):
+    """
+    Sequence number of a segment file
+    """
+    return int(os.path.basename(path)[len('segment-'):-len('.tri')])
+
+
+def merge_run(paths):
+    """
+    Newest segments to merge: the run is extended to an older segment only
+    while that segment is not larger than the run, so big segments are
+    rewritten rarely
+
+    @param paths: segment files, oldest first
+    @type  paths: list
+
+    @return: segment files, oldest first
+    @rtype: list
+    """
+    run = paths[-2:]
+    size = sum(os.path.getsize(path) for path in run)
+    for path in reversed(paths[:-2]):
+        if os.path.getsize(path) > size:
+            break
+        run.insert(0, path)
+        size += os.path.getsize(path)
+    return run
+
+
+def merge_segments(paths):
+    """
+    Merge consecutive segments into the newest of them
+
+    @param paths: consecutive segment files, oldest first
+    @type  paths: list
+    """
+    apps = {}
+    for path in paths:
+        segment = Segment(path)
+        try:
+            apps.update(segment.entries())
+        finally:
+            segment.close()
+
+    write_segment(paths[-1], apps)
+    for path in paths[:-1]:
+        os.remove(path)
+
+
+def trigrams(value):
+    """
+    Distinct trigrams of a string
+
+    @param value: string
+    @type  value: str
+
+    @return: trigrams
+    @rtype: set
+    """
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+def trigram_key(trigram):
+    """
+    Sortable 64-bit key of a trigram
+
+    @param trigram: three characters
+    @type  trigram: str
+
+    @return: key
+    @rtype: int
+    """
+    first, second, third = (ord(character) for character in trigram)
+    return (first << 2 * CODE_POINT_BITS) | (second << CODE_POINT_BITS) | third
+
+
+def required_literals(pattern):
+    """
+    Literal strings every match of a regular expression contains
+
+    Only literals that are not under an alternation or an optional repeat
+    are collected, so the result is safe for narrowing the candidates. No
+    literal is returned when the regular expression parser is not available
+    or does not work as expected, so every name is checked.
+
+    @param pattern: regular expression
+    @type  pattern: str
+
+    @return: literals
+    @rtype: list
+    """
+    if sre_parse is None:
+        return []
+
+    literals = []
+    try:
+        collect_literals(sre_parse.parse(pattern), literals)
+    except Exception:  # pylint: disable=broad-except
+        logging.warning('Could not narrow the search of %s, checking every name', pattern)
+        return []
+    return [literal for literal in literals if len(literal) >= 3]
+
+
+def collect_literals(parsed, literals):
+    """
+    Add the runs of required literals of a parsed expression
+
+    @param parsed: parsed regular expression
+    @type  parsed: sre_parse.SubPattern
+
+    @param literals: literal runs
+    @type  literals: list
+    """
+    run = []
+    for operator, argument in parsed:
+        if operator == sre_parse.LITERAL:
+            run.append(chr(argument))
+            continue
+        if operator == sre_parse.AT:
+            # anchors do not consume characters
+            continue
+
+        literals.append(''.join(run))
+        run = []
+        if operator == sre_parse.SUBPATTERN:
+            collect_literals(argument[-1], literals)
+        elif operator in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and argument[0] >= 1:
+            collect_literals(argument[2], literals)
+    literals.append(''.join(run))
+
+
+def index_entries(sections):
+    """
+    Indexed names of the sections of an app
+
+    @param sections: section name -> list of records
+    @type  sections: dict
+
+    @return: (section, column, value) names
+    @rtype: list
+    """
+    entries = []
+    for section, records in sections.items():
+        for record in records:
+            for column in INDEXED_COLUMNS:
+                value = getattr(record, column, None)
+                if value:
+                    entries.append((section, column, value))
+    return entries
+
+
+def search_index(pattern, section=None, index_dir=INDEX_DIR):
+    """
+    Names of the analysed apps matching a regular expression
+
+    Candidates are narrowed with the trigrams every match must contain and
+    only they are checked with the regular expression. Matches of an app
+    that is also stored in a newer segment are skipped.
+
+    @param pattern: regular expression, searched anywhere in the names
+    @type  pattern: str
+
+    @param section: only search this section, all sections when None
+    @type  section: str
+
+    @param index_dir: index directory
+    @type  index_dir: str
+
+    @return: (app folder, section, column, value) rows
+    @rtype: list
+    """
+    regex = re.compile(pattern)
+    required = set()
+    for literal in required_literals(pattern):
+        required.update(trigrams(literal.lower()))
+
+    rows = set()
+    newer_segments = []
+    try:
+        for path in reversed(segment_paths(index_dir)):
+            try:
+                segment = Segment(path)
+            except (OSError, ValueError, struct.error, pickle.UnpicklingError) as err:
+                logging.error('Skipping the search index segment %s: %s', path, err)
+                continue
+            superseded = {}
+            for value_id in segment.candidates(required):
+                value = segment.value(value_id)
+                if not regex.search(value):
+                    continue
+                for app, value_section, column in segment.value_occurrences(value_id):
+                    if section not in (None, value_section):
+                        continue
+                    if app not in superseded:
+                        superseded[app] = any(newer.has_app(app) for newer in newer_segments)
+                    if not superseded[app]:
+                        rows.add((app, value_section, column, value))
+            newer_segments.append(segment)
+    finally:
+        for segment in newer_segments:
+            segment.close()
+    return sorted(rows)
+
+
+def search_names(pattern, section=None):
+    """
+    Names of the analysed apps matching a regular expression
+
+    @param pattern: regular expression, searched anywhere in the names
+    @type  pattern: str
+
+    @param section: only search this section, all sections when None
+    @type  section: str
+
+    @return: (app folder, section, column, value) rows
+    @rtype: list
+    """
+    try:
+        re.compile(pattern)
+    except re.error as err:
+        logging.error('Invalid pattern %s: %s', pattern, err)
+        return []
+
+    rows = search_index(pattern, section)
+    logging.info('%d match(es) in %d app(s)', len(rows), len({row[0] for row in rows}))
+    return rows
@@ -12,12 +12,42 @@ DATABASE_DIR = os.path.join(HOME, 'database/')  # database
 TEMPLATE_DIR = os.path.join(HOME, 'template/')  # template
 REPORT_DIR = os.path.join(HOME, 'report/')      # report
 TOOLS_DIR = os.path.join(HOME, 'tools/')        # tools
+FRAMEWORK_DIR = os.path.join(HOME, 'framework/')  # apktool framework caches
+INDEX_DIR = os.path.join(HOME, 'index/')        # search index
 
 # Report template
 REPORT_TEMPLATE = os.path.join(TEMPLATE_DIR, 'manifest_analysis_template.xlsx')
 
+# Search index
+INDEX_MAX_SEGMENTS = 8                          # index segments before the newest ones are merged
+
 # Tools
 APKTOOL_JAR = 'apktool_2.5.0.jar'
+FRAMEWORK_APK = ''                              # pinned framework-res.apk ('' = apktool built-in)
+FRAMEWORK_SHA256 = ''                           # expected SHA-256 of FRAMEWORK_APK ('' = not checked)
+
+# Parallelism
+WORKERS = os.cpu_count() or 1                   # manifest parsing processes
+DECODE_WORKERS = 4                              # concurrent apktool decodes
+REPORT_WRITERS = 2                              # report writing processes
+REPORT_QUEUE_SIZE = 64                          # parsed apps waiting for a report writer
+
+# Scheduler
+INTERACTIVE_WEIGHT = 4                          # worker share of interactive jobs per bulk share
+SCHEDULER_AGING = 1.0                           # estimated seconds a waiting job gains per second
+SCHEDULER_HISTORY = os.path.join(HOME, 'scheduler_history.json')  # past run time per apk
+
+# Resources
+RESOURCES_LOCALE = ''                           # '' = default configuration, or 'en', 'pt-BR', ...
+
+# Metrics
+METRICS_INTERVAL = 5.0                          # progress line and textfile refresh, in seconds
+METRICS_TEXTFILE = ''                           # node exporter textfile collector .prom file ('' = disabled)
+
+# Watch mode
+WATCH_SETTLE_SECONDS = 2.0                      # unchanged size/mtime time before an apk is analysed
+WATCH_POLL_SECONDS = 5.0                        # listing interval when inotify is not available
+WATCH_HISTORY = os.path.join(HOME, 'watch_history.json')  # content hash of the analysed apks
 
 
 def config_logging():
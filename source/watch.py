@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Watch folder module. """
+
+import ctypes
+import ctypes.util
+import functools
+import json
+import logging
+import os
+import select
+import struct
+import threading
+import time
+from source.settings import (
+    RESOURCES_LOCALE,
+    DECODE_WORKERS,
+    WATCH_SETTLE_SECONDS,
+    WATCH_POLL_SECONDS,
+    WATCH_HISTORY
+)
+from source.decompile import decompile_cmd
+from source.framework import (
+    file_sha256,
+    worker_framework_dir,
+    release_framework_dir
+)
+from source.scheduler import (
+    BULK,
+    INTERACTIVE,
+    Scheduler
+)
+from source.manifest_analysis import analyse_app_serial
+from source.search_index import IndexWriter
+from source.metrics import (
+    APKS_PROCESSED,
+    APKS_FAILED,
+    track_progress
+)
+
+APK_EXTENSION = '.apk'
+
+# inotify events (see inotify(7))
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class InotifyWatcher:
+    """
+    Directory watcher based on Linux inotify
+    """
+
+    def __init__(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.directory = directory
+        self.fd = libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init failed')
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, 'inotify_add_watch failed: ' + directory)
+
+    def wait(self, timeout):
+        """
+        Wait for changes
+
+        @param timeout: seconds to wait, None to wait for the next change
+        @type  timeout: float
+
+        @return: changed apk paths
+        @rtype: set
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        changed = set()
+        buffer = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(buffer):
+            _, mask, _, name_length = INOTIFY_EVENT.unpack_from(buffer, offset)
+            offset += INOTIFY_EVENT.size
+            name = buffer[offset:offset + name_length].rstrip(b'\0')
+            offset += name_length
+
+            if mask & IN_Q_OVERFLOW:
+                # events were dropped, fall back to a listing
+                changed.update(find_apks(self.directory))
+            elif name.endswith(APK_EXTENSION.encode()):
+                changed.add(os.path.join(self.directory, os.fsdecode(name)))
+
+        return changed
+
+    def close(self):
+        """
+        Release the inotify descriptor
+        """
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """
+    Directory watcher based on periodic listings
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.signatures = {}
+
+    def wait(self, timeout):
+        """
+        Wait for changes
+
+        @param timeout: seconds to wait, None to wait one polling interval
+        @type  timeout: float
+
+        @return: changed apk paths
+        @rtype: set
+        """
+        time.sleep(WATCH_POLL_SECONDS if timeout is None else min(timeout, WATCH_POLL_SECONDS))
+
+        changed = set()
+        signatures = {}
+        for apk_path in find_apks(self.directory):
+            signature = file_signature(apk_path)
+            signatures[apk_path] = signature
+            if self.signatures.get(apk_path) != signature:
+                changed.add(apk_path)
+        self.signatures = signatures
+        return changed
+
+    def close(self):
+        """
+        Nothing to release
+        """
+
+
+def create_watcher(directory):
+    """
+    inotify watcher, or a polling watcher where inotify is not available
+
+    @param directory: watched directory
+    @type  directory: str
+
+    @return: watcher
+    @rtype: InotifyWatcher
+    """
+    try:
+        return InotifyWatcher(directory)
+    except (OSError, AttributeError, TypeError) as err:
+        logging.info('inotify is not available (%s), polling every %s seconds',
+                     err, WATCH_POLL_SECONDS)
+        return PollingWatcher(directory)
+
+
+def find_apks(directory):
+    """
+    Apk files of a directory
+
+    @param directory: directory
+    @type  directory: str
+
+    @return: apk paths
+    @rtype: list
+    """
+    return [entry.path for entry in os.scandir(directory)
+            if entry.is_file() and entry.name.endswith(APK_EXTENSION)]
+
+
+def file_signature(path):
+    """
+    (size, mtime) of a file, None when it does not exist anymore
+
+    @param path: file path
+    @type  path: str
+
+    @return: signature
+    @rtype: tuple
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class AnalysedApks:
+    """
+    Content hashes of the analysed apk files, kept between watch runs
+
+    The signature of each analysed file is stored with its hash, so an
+    unchanged file found at startup is recognised without being read again.
+    """
+
+    def __init__(self, history_path=WATCH_HISTORY):
+        self.history_path = history_path
+        self.hashes = set()
+        self.scheduled = set()
+        # apk path -> [size, mtime, sha256]
+        self.files = {}
+        self.lock = threading.Lock()
+        self.load()
+
+    def file_hash(self, apk_path):
+        """
+        SHA-256 and signature of an apk file, from the history when the file
+        did not change since its analysis
+
+        @param apk_path: apk file path
+        @type  apk_path: str
+
+        @return: (sha256, signature)
+        @rtype: tuple
+
+        @raise OSError: the file can not be read
+        """
+        signature = file_signature(apk_path)
+        known = self.files.get(apk_path)
+        if signature is not None and known is not None and tuple(known[:2]) == signature:
+            return known[2], signature
+        return file_sha256(apk_path), signature
+
+    def claim(self, sha256):
+        """
+        Mark a content as scheduled, unless it was already analysed or is
+        being analysed
+
+        @param sha256: SHA-256 of the apk file
+        @type  sha256: str
+
+        @return: whether the content must be analysed
+        @rtype: bool
+        """
+        with self.lock:
+            if sha256 in self.hashes or sha256 in self.scheduled:
+                return False
+            self.scheduled.add(sha256)
+            return True
+
+    def finish(self, apk_path, sha256, signature, analysed):
+        """
+        Record the end of an analysis, storing the history when it succeeded
+
+        A failed content is released, so a new drop of it is retried.
+
+        @param apk_path: apk file path
+        @type  apk_path: str
+
+        @param sha256: SHA-256 of the apk file
+        @type  sha256: str
+
+        @param signature: signature of the file when it was hashed
+        @type  signature: tuple
+
+        @param analysed: whether the analysis succeeded
+        @type  analysed: bool
+        """
+        with self.lock:
+            self.scheduled.discard(sha256)
+            if not analysed:
+                return
+            self.hashes.add(sha256)
+            if signature is not None:
+                self.files[apk_path] = list(signature) + [sha256]
+        self.save()
+
+    def load(self):
+        """
+        Read the stored history
+        """
+        try:
+            with open(self.history_path) as history_file:
+                stored = json.load(history_file)
+            self.hashes = set(stored['hashes'])
+            self.files = dict(stored['files'])
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as err:
+            logging.error('Could not read the watch history %s: %s', self.history_path, err)
+
+    def save(self):
+        """
+        Store the history, replacing the file atomically
+
+        Workers finish concurrently, so the file is replaced under the lock.
+        """
+        tmp_path = self.history_path + '.tmp'
+        try:
+            with self.lock:
+                with open(tmp_path, 'w') as history_file:
+                    json.dump({'hashes': sorted(self.hashes), 'files': self.files},
+                              history_file)
+                os.replace(tmp_path, self.history_path)
+        except OSError as err:
+            logging.error('Could not write the watch history %s: %s', self.history_path, err)
+
+
+def watch_folder(directory, locale=RESOURCES_LOCALE):
+    """
+    Analyse the apk files dropped in a directory as soon as they are complete
+
+    A file is complete once its size and mtime did not change for
+    WATCH_SETTLE_SECONDS. Files with an already analysed content are skipped,
+    including the content analysed by previous runs (see AnalysedApks).
+    The files found when the watch starts are bulk jobs, the files dropped
+    afterwards are interactive jobs served first (see Scheduler). A file
+    dropped again runs after its previous drop, as both decode into the
+    same folder.
+
+    @param directory: watched directory
+    @type  directory: str
+
+    @param locale: locale used to resolve resource references
+    @type  locale: str
+    """
+    if not os.path.isdir(directory):
+        logging.error('Could not find the directory %s', directory)
+        return
+
+    watcher = create_watcher(directory)
+    scheduler = Scheduler(DECODE_WORKERS, worker_framework_dir, release_framework_dir)
+    analysed = AnalysedApks()
+    index = IndexWriter()
+
+    # apk path -> (signature, time the signature was first seen)
+    pending = {apk_path: (None, 0.0) for apk_path in find_apks(directory)}
+    backlog = set(pending)
+
+    logging.info('Watching %s', directory)
+    try:
+        with track_progress('watch', None, APKS_PROCESSED, APKS_FAILED):
+            while True:
+                timeout = WATCH_SETTLE_SECONDS / 2 if pending else None
+                for apk_path in watcher.wait(timeout):
+                    pending[apk_path] = (None, 0.0)
+                    backlog.discard(apk_path)
+
+                now = time.monotonic()
+                for apk_path, (signature, since) in list(pending.items()):
+                    current = file_signature(apk_path)
+                    if current is None:
+                        del pending[apk_path]
+                    elif current != signature:
+                        pending[apk_path] = (current, now)
+                    elif now - since >= WATCH_SETTLE_SECONDS:
+                        del pending[apk_path]
+                        priority = BULK if apk_path in backlog else INTERACTIVE
+                        backlog.discard(apk_path)
+                        submit_dropped_apk(scheduler, apk_path, priority,
+                                           analysed, locale, index)
+    except KeyboardInterrupt:
+        logging.info('Stopped watching %s', directory)
+    finally:
+        watcher.close()
+        scheduler.shutdown(cancel_pending=True)
+
+
+def submit_dropped_apk(scheduler, apk_path, priority, analysed, locale, index):
+    """
+    Schedule the analysis of a dropped apk file, unless its content was
+    already analysed or is being analysed
+
+    @param scheduler: decode scheduler
+    @type  scheduler: Scheduler
+
+    @param apk_path: apk file path
+    @type  apk_path: str
+
+    @param priority: scheduler priority class
+    @type  priority: str
+
+    @param analysed: analysed and scheduled apk contents
+    @type  analysed: AnalysedApks
+
+    @param locale: locale used to resolve resource references
+    @type  locale: str
+
+    @param index: search index updated with the names of the app
+    @type  index: IndexWriter
+    """
+    try:
+        sha256, signature = analysed.file_hash(apk_path)
+    except OSError as err:
+        logging.error('Reading the apk file %s: %s', apk_path, err)
+        return
+
+    if not analysed.claim(sha256):
+        logging.info('Skipping %s, already analysed', apk_path)
+        return
+
+    scheduler.submit(apk_path, priority,
+                     functools.partial(analyse_dropped_apk, apk_path, sha256, signature,
+                                       analysed, locale, index))
+
+
+def analyse_dropped_apk(apk_path, sha256, signature, analysed, locale, index, frame_path):
+    """
+    Decompile and analyse a dropped apk file, on a scheduler worker
+
+    @param apk_path: apk file path
+    @type  apk_path: str
+
+    @param sha256: SHA-256 of the apk file
+    @type  sha256: str
+
+    @param signature: signature of the apk file when it was hashed
+    @type  signature: tuple
+
+    @param analysed: analysed and scheduled apk contents
+    @type  analysed: AnalysedApks
+
+    @param locale: locale used to resolve resource references
+    @type  locale: str
+
+    @param index: search index updated with the names of the app
+    @type  index: IndexWriter
+
+    @param frame_path: apktool framework directory of the worker
+    @type  frame_path: str
+    """
+    start = time.monotonic()
+    success = False
+    try:
+        if decompile_cmd(apk_path, frame_path=frame_path):
+            apk_foldername = os.path.basename(os.path.normpath(apk_path))
+            if analyse_app_serial(apk_foldername, locale, index):
+                index.flush()
+                logging.info('Analysed %s in %.1f seconds', apk_path, time.monotonic() - start)
+                success = True
+    finally:
+        analysed.finish(apk_path, sha256, signature, success)
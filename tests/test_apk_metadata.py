@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" APK metadata tests. """
+
+import hashlib
+import io
+import json
+import os
+import struct
+import tempfile
+import unittest
+import zipfile
+from source.apk_metadata import (
+    APK_METADATA_FILE,
+    SIGNATURE_SCHEME_V2_ID,
+    SIGNATURE_SCHEME_V3_ID,
+    SIGNING_BLOCK_MAGIC,
+    ApkMetadata,
+    find_central_directory,
+    load_apk_metadata,
+    pkcs7_certificates,
+    read_apk_metadata,
+    read_signing_block,
+    save_apk_metadata
+)
+
+OID_SIGNED_DATA = bytes.fromhex('06092a864886f70d010702')
+OID_DATA = bytes.fromhex('06092a864886f70d010701')
+
+
+def der(tag, content):
+    """
+    DER element with a short or long form length
+    """
+    if len(content) < 0x80:
+        return bytes((tag, len(content))) + content
+    length = len(content).to_bytes((len(content).bit_length() + 7) // 8, 'big')
+    return bytes((tag, 0x80 | len(length))) + length + content
+
+
+def certificate(serial):
+    """
+    DER blob standing for a certificate, only its bytes are fingerprinted
+    """
+    return der(0x30, der(0x02, bytes((serial,))) + der(0x04, bytes(range(200))))
+
+
+def pkcs7(certificates):
+    """
+    PKCS#7 ContentInfo holding a SignedData with certificates
+    """
+    signed_data = der(0x30, der(0x02, b'\x01') +
+                      der(0x31, b'') +
+                      der(0x30, OID_DATA) +
+                      der(0xa0, b''.join(certificates)) +
+                      der(0x31, b''))
+    return der(0x30, OID_SIGNED_DATA + der(0xa0, signed_data))
+
+
+def length_prefix(value):
+    """
+    uint32 length-prefixed value
+    """
+    return struct.pack('<I', len(value)) + value
+
+
+def scheme_block(certificates):
+    """
+    v2/v3 signature scheme block with one signer
+    """
+    signed_data = length_prefix(b'') + \
+        length_prefix(b''.join(length_prefix(cert) for cert in certificates)) + \
+        length_prefix(b'')
+    signer = length_prefix(signed_data) + length_prefix(b'') + length_prefix(b'')
+    return length_prefix(length_prefix(signer))
+
+
+def insert_signing_block(apk, blocks):
+    """
+    Insert an APK Signing Block before the central directory of a zip
+    """
+    cd_offset, _ = find_central_directory(apk)
+    pairs = b''.join(struct.pack('<QI', len(value) + 4, block_id) + value
+                     for block_id, value in blocks.items())
+    size = len(pairs) + 8 + len(SIGNING_BLOCK_MAGIC)
+    block = struct.pack('<Q', size) + pairs + struct.pack('<Q', size) + SIGNING_BLOCK_MAGIC
+
+    eocd_offset = apk.rfind(b'PK\x05\x06')
+    eocd = bytearray(apk[eocd_offset:])
+    struct.pack_into('<I', eocd, 16, cd_offset + len(block))
+    return apk[:cd_offset] + block + apk[cd_offset:eocd_offset] + bytes(eocd)
+
+
+def build_apk(entries, blocks=None):
+    """
+    Zip file with entries, and optionally an APK Signing Block
+    """
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as apk_zip:
+        for name, content in entries.items():
+            apk_zip.writestr(name, content)
+    apk = output.getvalue()
+    if blocks:
+        apk = insert_signing_block(apk, blocks)
+    return apk
+
+
+def fingerprint(cert):
+    """
+    SHA-256 fingerprint of a certificate
+    """
+    return hashlib.sha256(cert).hexdigest()
+
+
+class ApkMetadataTest(unittest.TestCase):
+    """
+    ZIP, APK Signing Block and PKCS#7 parsing
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def write_apk(self, apk):
+        apk_path = os.path.join(self.tmp_dir.name, 'app.apk')
+        with open(apk_path, 'wb') as apk_file:
+            apk_file.write(apk)
+        return apk_path
+
+    def test_entries(self):
+        apk = build_apk({'AndroidManifest.xml': b'x' * 1000,
+                         'classes.dex': b'dex',
+                         'classes2.dex': b'dex',
+                         'lib/arm64-v8a/libx.so': b'so',
+                         'lib/x86/libx.so': b'so',
+                         'res/raw/classes3.dex': b'not a dex'})
+        metadata = read_apk_metadata(self.write_apk(apk))
+
+        self.assertEqual(metadata.fileSize, len(apk))
+        self.assertEqual(metadata.entries, 6)
+        self.assertEqual(metadata.uncompressedSize, 1000 + 3 + 3 + 2 + 2 + 9)
+        self.assertEqual(metadata.dexCount, 2)
+        self.assertEqual(metadata.abis, ('arm64-v8a', 'x86'))
+        self.assertEqual(metadata.signatureSchemes, ())
+
+    def test_v1_certificates(self):
+        certificates = [certificate(1), certificate(2)]
+        self.assertEqual(pkcs7_certificates(pkcs7(certificates)), certificates)
+
+        apk = build_apk({'classes.dex': b'dex',
+                         'META-INF/CERT.SF': b'sf',
+                         'META-INF/CERT.RSA': pkcs7(certificates)})
+        metadata = read_apk_metadata(self.write_apk(apk))
+
+        self.assertEqual(metadata.signatureSchemes, ('v1',))
+        self.assertEqual(metadata.v1Certificates,
+                         tuple(sorted(fingerprint(cert) for cert in certificates)))
+
+    def test_signing_block(self):
+        v2_certificate = certificate(3)
+        v3_certificate = certificate(4)
+        apk = build_apk({'classes.dex': b'dex'},
+                        {SIGNATURE_SCHEME_V2_ID: scheme_block([v2_certificate]),
+                         SIGNATURE_SCHEME_V3_ID: scheme_block([v3_certificate]),
+                         0x42726577: b'\0' * 64})
+        metadata = read_apk_metadata(self.write_apk(apk))
+
+        self.assertEqual(metadata.signatureSchemes, ('v2', 'v3'))
+        self.assertEqual(metadata.v2Certificates, (fingerprint(v2_certificate),))
+        self.assertEqual(metadata.v3Certificates, (fingerprint(v3_certificate),))
+        self.assertEqual(metadata.dexCount, 1)
+
+    def test_no_signing_block(self):
+        apk = build_apk({'classes.dex': b'dex'})
+        cd_offset, _ = find_central_directory(apk)
+        self.assertEqual(read_signing_block(apk, cd_offset), {})
+
+    def test_corrupted_signing_block(self):
+        apk = bytearray(build_apk({'classes.dex': b'dex'}, {SIGNATURE_SCHEME_V2_ID: b''}))
+        cd_offset, _ = find_central_directory(apk)
+        block_start = apk.find(struct.pack('<QI', 4, SIGNATURE_SCHEME_V2_ID)) - 8
+        struct.pack_into('<Q', apk, block_start, 1)
+        with self.assertRaises(ValueError):
+            read_signing_block(bytes(apk), cd_offset)
+
+    def test_not_a_zip(self):
+        with self.assertRaises(ValueError):
+            read_apk_metadata(self.write_apk(b'not a zip file' * 10))
+
+    def test_save_and_load(self):
+        apk_path = self.write_apk(build_apk({'classes.dex': b'dex', 'lib/x86/libx.so': b'so'}))
+        save_apk_metadata(apk_path, self.tmp_dir.name)
+
+        rows = load_apk_metadata(self.tmp_dir.name)
+        self.assertEqual(rows, [read_apk_metadata(apk_path)])
+        self.assertIsInstance(rows[0], ApkMetadata)
+
+    def test_load_missing_or_unreadable(self):
+        self.assertEqual(load_apk_metadata(self.tmp_dir.name), [])
+
+        os.mkdir(os.path.join(self.tmp_dir.name, APK_METADATA_FILE))
+        with self.assertLogs(level='ERROR'):
+            self.assertEqual(load_apk_metadata(self.tmp_dir.name), [])
+
+    def test_load_invalid(self):
+        with open(os.path.join(self.tmp_dir.name, APK_METADATA_FILE), 'w') as metadata_file:
+            json.dump(['not', 'an', 'object'], metadata_file)
+        with self.assertLogs(level='ERROR'):
+            self.assertEqual(load_apk_metadata(self.tmp_dir.name), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" apktool framework cache tests. """
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+from source import framework
+from source.framework import (
+    BUILTIN_FRAMEWORK,
+    FRAMEWORK_FILE,
+    master_framework,
+    release_framework_dir,
+    worker_framework_dir
+)
+
+
+def fake_install(framework_apk, frame_path):
+    """
+    apktool if: the installed framework is derived from the framework apk
+    """
+    with open(framework_apk, 'rb') as apk_file:
+        content = apk_file.read()
+    framework_path = os.path.join(frame_path, FRAMEWORK_FILE)
+    with open(framework_path, 'wb') as framework_file:
+        framework_file.write(b'installed:' + content)
+    return framework_path
+
+
+class FrameworkTest(unittest.TestCase):
+    """
+    Master framework source and worker directories
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        root = self.tmp_dir.name
+        framework_dir = os.path.join(root, 'framework')
+        tools_dir = os.path.join(root, 'tools')
+        os.makedirs(tools_dir)
+        with zipfile.ZipFile(os.path.join(tools_dir, 'apktool.jar'), 'w') as apktool_jar:
+            apktool_jar.writestr(BUILTIN_FRAMEWORK, b'builtin framework')
+        self.pinned_apk = os.path.join(root, 'framework-res.apk')
+
+        self.settings = {'FRAMEWORK_DIR': framework_dir,
+                         'MASTER_DIR': os.path.join(framework_dir, 'master'),
+                         'TOOLS_DIR': tools_dir,
+                         'APKTOOL_JAR': 'apktool.jar',
+                         'FRAMEWORK_APK': '',
+                         'FRAMEWORK_SHA256': ''}
+        for name, value in self.settings.items():
+            self.patch(name, value)
+        self.install = mock.Mock(side_effect=fake_install)
+        self.patch('install_framework', self.install)
+        self.addCleanup(framework._DIGESTS.clear)
+
+    def patch(self, name, value):
+        patcher = mock.patch.object(framework, name, value)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def pin(self, content, sha256=''):
+        with open(self.pinned_apk, 'wb') as apk_file:
+            apk_file.write(content)
+        # a rewrite within the mtime granularity must still be seen
+        framework._DIGESTS.clear()
+        self.patch('FRAMEWORK_APK', self.pinned_apk)
+        self.patch('FRAMEWORK_SHA256', sha256)
+
+    def master_content(self):
+        master_path = master_framework()
+        self.assertIsNotNone(master_path)
+        with open(master_path, 'rb') as master_file:
+            return master_file.read()
+
+    def test_builtin_framework(self):
+        self.assertEqual(self.master_content(), b'builtin framework')
+        self.assertEqual(self.master_content(), b'builtin framework')
+        self.install.assert_not_called()
+
+    def test_pin_after_builtin_master(self):
+        self.assertEqual(self.master_content(), b'builtin framework')
+
+        self.pin(b'framework v1')
+        self.assertEqual(self.master_content(), b'installed:framework v1')
+        self.assertEqual(self.master_content(), b'installed:framework v1')
+        self.assertEqual(self.install.call_count, 1)
+
+        self.pin(b'framework v2')
+        self.assertEqual(self.master_content(), b'installed:framework v2')
+        self.assertEqual(self.install.call_count, 2)
+
+    def test_unpin(self):
+        self.pin(b'framework v1')
+        self.assertEqual(self.master_content(), b'installed:framework v1')
+        self.patch('FRAMEWORK_APK', '')
+        self.assertEqual(self.master_content(), b'builtin framework')
+
+    def test_pinned_hash(self):
+        self.pin(b'framework v1', hashlib.sha256(b'framework v1').hexdigest())
+        self.assertEqual(self.master_content(), b'installed:framework v1')
+
+        self.pin(b'framework v2', hashlib.sha256(b'framework v1').hexdigest())
+        with self.assertLogs(level='ERROR'):
+            self.assertIsNone(master_framework())
+
+    def test_corrupted_master(self):
+        master_path = master_framework()
+        with open(master_path, 'wb') as master_file:
+            master_file.write(b'corrupted')
+        with self.assertLogs(level='WARNING'):
+            self.assertEqual(self.master_content(), b'builtin framework')
+
+    def test_worker_directory_follows_master(self):
+        frame_path = worker_framework_dir(0)
+        self.addCleanup(shutil.rmtree, frame_path, True)
+        release_framework_dir(frame_path)
+        with open(os.path.join(frame_path, FRAMEWORK_FILE), 'rb') as framework_file:
+            self.assertEqual(framework_file.read(), b'builtin framework')
+
+        self.pin(b'framework v1')
+        self.assertEqual(worker_framework_dir(0), frame_path)
+        release_framework_dir(frame_path)
+        with open(os.path.join(frame_path, FRAMEWORK_FILE), 'rb') as framework_file:
+            self.assertEqual(framework_file.read(), b'installed:framework v1')
+
+
+if __name__ == '__main__':
+    unittest.main()
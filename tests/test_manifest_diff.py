@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Manifest diff tests. """
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+from source import manifest_diff
+
+MANIFEST = '''<?xml version="1.0" encoding="utf-8"?>
+<manifest xmlns:android="http://schemas.android.com/apk/res/android"
+          package="%s" android:versionCode="%d">
+    <uses-permission android:name="%s"/>
+</manifest>
+'''
+
+# apk file -> (package, versionCode, permission)
+APKS = {
+    'a-1.apk': ('com.a', 1, 'android.permission.INTERNET'),
+    'a-2.apk': ('com.a', 2, 'android.permission.CAMERA'),
+    'b-1.apk': ('com.b', 1, 'android.permission.INTERNET'),
+    'b-3.apk': ('com.b', 3, 'android.permission.INTERNET'),
+    'c-1.apk': ('com.c', 1, 'android.permission.INTERNET'),
+}
+
+
+class ManifestDiffTest(unittest.TestCase):
+    """
+    Version pairing and decode folders
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.decode_dirs = []
+        for apk_file in APKS:
+            with open(os.path.join(self.tmp_dir.name, apk_file), 'wb') as apk:
+                apk.write(b'not an apk')
+
+        patchers = [mock.patch.object(manifest_diff, 'decompile_cmd', self.decompile_cmd),
+                    mock.patch.object(manifest_diff, 'generate_diff_report')]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def decompile_cmd(self, apk_path, database_dir):
+        """
+        Write the manifest of a fake apk as apktool would
+        """
+        self.decode_dirs.append(database_dir)
+        decompiled_path = os.path.join(database_dir, os.path.basename(apk_path))
+        os.makedirs(decompiled_path)
+        with open(os.path.join(decompiled_path, 'AndroidManifest.xml'), 'w') as manifest:
+            manifest.write(MANIFEST % APKS[os.path.basename(apk_path)])
+        return True
+
+    def test_versions_are_paired_per_package(self):
+        diff_rows = manifest_diff.manifest_diff([self.tmp_dir.name])
+
+        pairs = {(row[0], row[1]) for row in diff_rows}
+        self.assertEqual(pairs, {('a-1.apk', 'a-2.apk'), ('b-1.apk', 'b-3.apk')})
+        self.assertIn(('a-1.apk', 'a-2.apk', '<uses-permission>', 'added',
+                       'android.permission.CAMERA', '', '', ''), diff_rows)
+
+    def test_decode_folders_are_removed(self):
+        manifest_diff.manifest_diff([self.tmp_dir.name])
+
+        self.assertEqual(len(self.decode_dirs), len(APKS))
+        self.assertFalse(any(os.path.exists(path) for path in self.decode_dirs))
+
+    def test_different_packages(self):
+        apk_paths = [os.path.join(self.tmp_dir.name, apk_file) for apk_file in ('a-1.apk',
+                                                                                 'c-1.apk')]
+        with self.assertLogs(level='ERROR'):
+            self.assertEqual(manifest_diff.manifest_diff(apk_paths), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
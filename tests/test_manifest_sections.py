@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Manifest section extraction tests. """
+
+import functools
+import os
+import tempfile
+import unittest
+import xml.dom.minidom
+from source.parser_manifest import ManifestResult
+from source.resources_arsc import (
+    TYPE_INT_BOOLEAN,
+    load_resource_table
+)
+from tests.test_resources_arsc import (
+    resource_table,
+    type_chunk,
+    write_table
+)
+
+MANIFEST = '''<?xml version="1.0" encoding="utf-8"?>
+<manifest xmlns:android="http://schemas.android.com/apk/res/android" package="com.example">
+    <application android:label="@string/app_name">
+        <meta-data android:name="com.example.API_KEY" android:value="key"/>
+        <receiver android:name="com.example.BootReceiver"
+                  android:enabled="@bool/receiver_enabled"
+                  android:exported="@bool/receiver_exported">
+            <meta-data android:name="com.example.API_KEY" android:value="receiver key"/>
+        </receiver>
+    </application>
+</manifest>
+'''
+
+
+class ManifestSectionsTest(unittest.TestCase):
+    """
+    Sections extracted alone or together
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        app_folder = self.tmp_dir.name
+        with open(os.path.join(app_folder, 'AndroidManifest.xml'), 'w') as manifest_file:
+            manifest_file.write(MANIFEST)
+        write_table(app_folder, resource_table(
+            [], ['attr', 'bool'], ['receiver_enabled', 'receiver_exported'],
+            [type_chunk(2, [(0, TYPE_INT_BOOLEAN, 0), (1, TYPE_INT_BOOLEAN, 0xFFFFFFFF)])]))
+
+    def result(self, sections=None):
+        app_folder = self.tmp_dir.name
+        return ManifestResult(functools.partial(xml.dom.minidom.parse,
+                                                os.path.join(app_folder, 'AndroidManifest.xml')),
+                              functools.partial(load_resource_table, app_folder),
+                              sections)
+
+    def test_boolean_reference_in_selective_run(self):
+        selective = self.result(['<receiver>'])['<receiver>']
+        full = self.result()['<receiver>']
+
+        self.assertEqual(selective, full)
+        self.assertIs(selective[0].enabled, False)
+        self.assertIs(selective[0].exported, True)
+
+    def test_meta_data_owner(self):
+        expected = [('', 'application', 'key'),
+                    ('com.example.BootReceiver', 'receiver', 'receiver key')]
+        for sections in (['<meta-data>'], None):
+            with self.subTest(sections=sections):
+                meta_data = self.result(sections)['<meta-data>']
+                self.assertEqual([(record.component, record.componentType, record.value)
+                                  for record in meta_data], expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" resources.arsc tests. """
+
+import os
+import struct
+import tempfile
+import unittest
+from unittest import mock
+from source.resources_arsc import (
+    FLAG_COMPACT,
+    FLAG_OFFSET16,
+    FLAG_SPARSE,
+    NO_ENTRY,
+    NO_ENTRY16,
+    RESOURCES_ARSC,
+    TYPE_INT_BOOLEAN,
+    TYPE_INT_DEC,
+    TYPE_REFERENCE,
+    TYPE_STRING,
+    ResourceTable,
+    load_resource_table
+)
+
+PACKAGE_ID = 0x7f
+PACKAGE_HEADER_SIZE = 288
+CONFIG_SIZE = 64
+TYPE_HEADER_SIZE = 20 + CONFIG_SIZE
+
+
+def length8(length):
+    """
+    utf-8 pool length prefix, 1 or 2 bytes
+    """
+    if length > 0x7F:
+        return bytes((0x80 | (length >> 8), length & 0xFF))
+    return bytes((length,))
+
+
+def string_pool(strings, utf8=True):
+    """
+    String pool chunk
+    """
+    offsets = []
+    body = b''
+    for string in strings:
+        offsets.append(len(body))
+        if utf8:
+            encoded = string.encode('utf-8')
+            body += length8(len(string.encode('utf-16-le')) // 2) + length8(len(encoded)) + \
+                encoded + b'\0'
+        else:
+            encoded = string.encode('utf-16-le')
+            body += struct.pack('<H', len(encoded) // 2) + encoded + b'\0\0'
+    body += b'\0' * (-len(body) % 4)
+    strings_start = 28 + 4 * len(strings)
+    return struct.pack('<HHIIIIII', 0x0001, 28, strings_start + len(body), len(strings),
+                       0, 0x100 if utf8 else 0, strings_start, 0) + \
+        b''.join(struct.pack('<I', offset) for offset in offsets) + body
+
+
+def type_chunk(type_id, entries, locale='', layout=0, compact=False):
+    """
+    Type chunk of a configuration
+
+    @param entries: (key index, data type, data) entries, None for a missing entry
+    @param locale: '', 'pt' or 'pt-BR'
+    @param layout: 0 (32-bit offsets), FLAG_OFFSET16 or FLAG_SPARSE
+    @param compact: whether entries use the 8-byte compact encoding
+    """
+    language, _, country = locale.partition('-')
+    config = struct.pack('<I', CONFIG_SIZE) + b'\0' * 4 + \
+        language.encode('ascii').ljust(2, b'\0') + country.encode('ascii').ljust(2, b'\0')
+    config = config.ljust(CONFIG_SIZE, b'\0')
+
+    body = b''
+    offsets = []
+    for entry in entries:
+        if entry is None:
+            offsets.append(None)
+            continue
+        key, data_type, data = entry
+        offsets.append(len(body))
+        if compact:
+            body += struct.pack('<HHI', key, FLAG_COMPACT | (data_type << 8), data)
+        else:
+            body += struct.pack('<HHIHBBI', 8, 0, key, 8, 0, data_type, data)
+
+    if layout == FLAG_SPARSE:
+        table = b''.join(struct.pack('<HH', entry_id, offset // 4)
+                         for entry_id, offset in enumerate(offsets) if offset is not None)
+        count = len(table) // 4
+    elif layout == FLAG_OFFSET16:
+        table = b''.join(struct.pack('<H', NO_ENTRY16 if offset is None else offset // 4)
+                         for offset in offsets)
+        count = len(offsets)
+    else:
+        table = b''.join(struct.pack('<I', NO_ENTRY if offset is None else offset)
+                         for offset in offsets)
+        count = len(offsets)
+    table += b'\0' * (-len(table) % 4)
+
+    entries_start = TYPE_HEADER_SIZE + len(table)
+    return struct.pack('<HHIBBHII', 0x0201, TYPE_HEADER_SIZE, entries_start + len(body),
+                       type_id, layout, 0, count, entries_start) + config + table + body
+
+
+def resource_table(values, type_names, keys, chunks, utf8=True):
+    """
+    resources.arsc with one package
+
+    @param values: value strings
+    @param type_names: type names, the type id of a name is its index + 1
+    @param keys: entry names
+    @param chunks: type chunks (see type_chunk)
+    @param utf8: whether the string pools are utf-8 or utf-16
+    """
+    value_pool = string_pool(values, utf8)
+    types = string_pool(type_names, utf8)
+    key_pool = string_pool(keys, utf8)
+    body = types + key_pool + b''.join(chunks)
+    package = struct.pack('<HHII', 0x0200, PACKAGE_HEADER_SIZE, PACKAGE_HEADER_SIZE + len(body),
+                          PACKAGE_ID) + \
+        'com.example'.encode('utf-16-le').ljust(256, b'\0') + \
+        struct.pack('<IIIII', PACKAGE_HEADER_SIZE, 0, PACKAGE_HEADER_SIZE + len(types), 0, 0)
+    package = package.ljust(PACKAGE_HEADER_SIZE, b'\0') + body
+    return struct.pack('<HHII', 0x0002, 12, 12 + len(value_pool) + len(package), 1) + \
+        value_pool + package
+
+
+def write_table(folder, table):
+    """
+    Write a resources.arsc in a folder
+    """
+    with open(os.path.join(folder, RESOURCES_ARSC), 'wb') as arsc_file:
+        arsc_file.write(table)
+    return os.path.join(folder, RESOURCES_ARSC)
+
+
+LONG_VALUE = 'Descrição ' * 20
+
+VALUES = ['My App', 'Minha App', 'Minha Aplicação', LONG_VALUE, 'Only in pt']
+TYPES = ['attr', 'string', 'bool', 'integer']
+KEYS = ['app_name', 'perm_desc', 'alias', 'pt_only', 'enabled', 'retries']
+STRING_TYPE = 2
+BOOL_TYPE = 3
+INTEGER_TYPE = 4
+
+
+def sample_chunks(layout=0, compact=False):
+    """
+    Type chunks of a small app, with default, pt and pt-BR strings
+    """
+    string_id = (PACKAGE_ID << 24) | (STRING_TYPE << 16)
+    return [
+        type_chunk(STRING_TYPE, [(0, TYPE_STRING, 0),
+                                 (1, TYPE_STRING, 3),
+                                 (2, TYPE_REFERENCE, string_id),
+                                 None], '', layout, compact),
+        type_chunk(STRING_TYPE, [(0, TYPE_STRING, 1), None, None,
+                                 (3, TYPE_STRING, 4)], 'pt', layout, compact),
+        type_chunk(STRING_TYPE, [(0, TYPE_STRING, 2)], 'pt-BR', layout, compact),
+        type_chunk(BOOL_TYPE, [None, None, None, None, (4, TYPE_INT_BOOLEAN, 0xFFFFFFFF)],
+                   '', layout, compact),
+        type_chunk(INTEGER_TYPE, [(5, TYPE_INT_DEC, 0xFFFFFFFD)], '', layout, compact)]
+
+
+class ResourceTableTest(unittest.TestCase):
+    """
+    Entry layouts, string pools, locales and name lookups
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def open_table(self, table, locale=''):
+        resources = ResourceTable(write_table(self.tmp_dir.name, table), locale)
+        self.addCleanup(resources.close)
+        return resources
+
+    def test_layouts_and_pools(self):
+        for layout in (0, FLAG_OFFSET16, FLAG_SPARSE):
+            for compact in (False, True):
+                for utf8 in (True, False):
+                    with self.subTest(layout=layout, compact=compact, utf8=utf8):
+                        resources = self.open_table(resource_table(
+                            VALUES, TYPES, KEYS, sample_chunks(layout, compact), utf8))
+                        self.assertEqual(resources.resolve('@string/app_name'), 'My App')
+                        self.assertEqual(resources.resolve('@string/perm_desc'), LONG_VALUE)
+                        self.assertEqual(resources.resolve('@string/alias'), 'My App')
+                        self.assertEqual(resources.resolve('@bool/enabled'), 'true')
+                        self.assertEqual(resources.resolve('@integer/retries'), '-3')
+                        self.assertEqual(resources.resolve('@7f040000'), '-3')
+                        self.assertEqual(resources.resolve('@string/missing'), '@string/missing')
+
+    def test_locale_fallback(self):
+        table = resource_table(VALUES, TYPES, KEYS, sample_chunks())
+        expected = {'': ('My App', 'Only in pt'),
+                    'pt': ('Minha App', 'Only in pt'),
+                    'pt-BR': ('Minha Aplicação', 'Only in pt'),
+                    'pt-PT': ('Minha App', 'Only in pt'),
+                    'fr': ('My App', 'Only in pt')}
+        for locale, (app_name, pt_only) in expected.items():
+            with self.subTest(locale=locale):
+                resources = self.open_table(table, locale)
+                self.assertEqual(resources.resolve('@string/app_name'), app_name)
+                # an entry missing from the default configuration is found in any other
+                self.assertEqual(resources.resolve('@string/pt_only'), pt_only)
+
+    def test_unresolved_references(self):
+        resources = self.open_table(resource_table(VALUES, TYPES, KEYS, sample_chunks()))
+        self.assertEqual(resources.resolve('@android:string/ok'), '@android:string/ok')
+        self.assertEqual(resources.resolve('@color/app_name'), '@color/app_name')
+        self.assertEqual(resources.resolve('@7f0200ff'), '@7f0200ff')
+        self.assertEqual(resources.resolve('plain'), 'plain')
+
+    def test_names_are_indexed_once_per_type(self):
+        count = 2000
+        keys = ['name_%d' % number for number in range(count)]
+        chunk = type_chunk(STRING_TYPE, [(number, TYPE_STRING, 0) for number in range(count)])
+        resources = self.open_table(resource_table(['value'], TYPES, keys, [chunk]))
+
+        with mock.patch.object(resources, 'index_names', wraps=resources.index_names) as index:
+            for number in range(0, count, 7):
+                self.assertEqual(resources.find_id('string', 'name_%d' % number),
+                                 (PACKAGE_ID << 24) | (STRING_TYPE << 16) | number)
+            self.assertIsNone(resources.find_id('string', 'name_%d' % count))
+        self.assertEqual(index.call_count, 1)
+
+    def test_table_reopened_after_new_decode(self):
+        folder = self.tmp_dir.name
+        write_table(folder, resource_table(['Old'], TYPES, KEYS,
+                                           [type_chunk(STRING_TYPE, [(0, TYPE_STRING, 0)])]))
+        self.assertEqual(load_resource_table(folder, '').resolve('@string/app_name'), 'Old')
+
+        os.remove(os.path.join(folder, RESOURCES_ARSC))
+        write_table(folder, resource_table(['New value'], TYPES, KEYS,
+                                           [type_chunk(STRING_TYPE, [(0, TYPE_STRING, 0)])]))
+        self.assertEqual(load_resource_table(folder, '').resolve('@string/app_name'),
+                         'New value')
+
+    def test_not_a_table(self):
+        with self.assertRaises(ValueError):
+            self.open_table(b'\0' * 64)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Job scheduler tests. """
+
+import threading
+import types
+import unittest
+from unittest import mock
+from source.metrics import SCHEDULER_QUEUE_DEPTH
+from source.scheduler import (
+    BULK,
+    INTERACTIVE,
+    PRIORITY_WEIGHTS,
+    Scheduler,
+    batch_order
+)
+
+TIMEOUT = 10
+
+
+class FakeCostModel:
+    """
+    Cost model with fixed estimates per apk file name
+    """
+
+    def __init__(self, estimates=None):
+        self.estimates = estimates or {}
+        self.observed = []
+        self.saved = False
+
+    def estimate(self, key, size):  # pylint: disable=unused-argument
+        return self.estimates.get(key.rsplit(':', 1)[0], 1.0)
+
+    def observe(self, key, size, seconds):
+        self.observed.append(key)
+
+    def save(self):
+        self.saved = True
+
+
+class Clock:
+    """
+    Monotonic clock moved by the test
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class SchedulerTest(unittest.TestCase):
+    """
+    Job order, fairness and worker failures
+    """
+
+    def setUp(self):
+        self.order = []
+        self.clock = Clock()
+        patcher = mock.patch('source.scheduler.time', types.SimpleNamespace(monotonic=self.clock))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def record(self, name):
+        """
+        Job appending its name to the run order
+        """
+        def job(context):  # pylint: disable=unused-argument
+            self.order.append(name)
+            return name
+        return job
+
+    def block(self, scheduler, name='blocker.apk', priority=BULK):
+        """
+        Submit a job that keeps its worker busy until the returned event is set
+        """
+        started = threading.Event()
+        release = threading.Event()
+
+        def job(context):  # pylint: disable=unused-argument
+            started.set()
+            self.assertTrue(release.wait(TIMEOUT))
+        future = scheduler.submit(name, priority, job)
+        self.assertTrue(started.wait(TIMEOUT))
+        return release, future
+
+    def run_batch(self, estimates, jobs):
+        """
+        Run (name, priority) jobs on one worker, queued while it is busy
+        """
+        scheduler = Scheduler(1, model=FakeCostModel(estimates))
+        release, _ = self.block(scheduler)
+        futures = [scheduler.submit(name, priority, self.record(name)) for name, priority in jobs]
+        release.set()
+        scheduler.shutdown()
+        self.assertEqual([future.result() for future in futures], [name for name, _ in jobs])
+        return self.order
+
+    def test_shortest_first(self):
+        order = self.run_batch({'a.apk': 5.0, 'b.apk': 1.0, 'c.apk': 3.0},
+                               [('a.apk', BULK), ('b.apk', BULK), ('c.apk', BULK)])
+        self.assertEqual(order, ['b.apk', 'c.apk', 'a.apk'])
+
+    def test_stride_shares(self):
+        weight = PRIORITY_WEIGHTS[INTERACTIVE]
+        jobs = [('bulk%d.apk' % number, BULK) for number in range(4)] + \
+            [('interactive%d.apk' % number, INTERACTIVE) for number in range(5 * weight)]
+        order = self.run_batch({}, jobs)
+
+        # the interactive class runs its weight of jobs per bulk job, after
+        # catching up with the share the blocking bulk job used
+        positions = [order.index('bulk%d.apk' % number) for number in range(4)]
+        self.assertLessEqual(positions[0], weight + 1)
+        for previous, position in zip(positions, positions[1:]):
+            self.assertEqual(position - previous - 1, weight)
+
+    def test_aging(self):
+        scheduler = Scheduler(1, model=FakeCostModel({'large.apk': 50.0, 'small.apk': 1.0}))
+        release, _ = self.block(scheduler)
+        scheduler.submit('large.apk', BULK, self.record('large.apk'))
+        self.clock.now = 100.0
+        scheduler.submit('small.apk', BULK, self.record('small.apk'))
+        release.set()
+        scheduler.shutdown()
+        self.assertEqual(self.order, ['large.apk', 'small.apk'])
+
+    def first_job(self, scheduler, names):
+        """
+        Job a worker picks first among bulk jobs submitted together
+        """
+        with scheduler.condition:
+            for name in names:
+                scheduler.submit(name, BULK, self.record(name))
+            job = scheduler.next_job()
+        scheduler.run_job(job, None)
+        scheduler.finish(job)
+        return job.future.result()
+
+    def test_largest_bulk_job_with_idle_workers(self):
+        scheduler = Scheduler(3, model=FakeCostModel({'large.apk': 40.0}))
+        first = self.first_job(scheduler, ('small1.apk', 'small2.apk', 'large.apk', 'small3.apk'))
+        scheduler.shutdown()
+        self.assertEqual(first, 'large.apk')
+
+    def test_largest_bulk_job_with_one_idle_worker(self):
+        scheduler = Scheduler(2, model=FakeCostModel({'large.apk': 40.0}))
+        release, _ = self.block(scheduler)
+        first = self.first_job(scheduler, ('small1.apk', 'large.apk', 'small2.apk'))
+        release.set()
+        scheduler.shutdown()
+        self.assertEqual(first, 'small1.apk')
+
+    def test_same_name_runs_one_at_a_time(self):
+        scheduler = Scheduler(2, model=FakeCostModel())
+        release, first = self.block(scheduler, 'old/app.apk')
+        second = scheduler.submit('new/app.apk', INTERACTIVE, self.record('new/app.apk'))
+        other = scheduler.submit('other.apk', BULK, self.record('other.apk'))
+
+        # the idle worker runs another apk, not the second app.apk
+        self.assertEqual(other.result(TIMEOUT), 'other.apk')
+        self.assertFalse(second.running() or second.done())
+        release.set()
+        self.assertEqual(second.result(TIMEOUT), 'new/app.apk')
+        self.assertIsNone(first.result(TIMEOUT))
+        scheduler.shutdown()
+        self.assertEqual(scheduler.waiting, {})
+
+    def test_cancel_waiting_jobs(self):
+        scheduler = Scheduler(1, model=FakeCostModel())
+        release, _ = self.block(scheduler, 'app.apk')
+        queued = scheduler.submit('other.apk', BULK, self.record('other.apk'))
+        waiting = scheduler.submit('app.apk', BULK, self.record('app.apk'))
+        release.set()
+        scheduler.shutdown(cancel_pending=True)
+        self.assertTrue(waiting.cancelled())
+        self.assertTrue(queued.cancelled() or queued.done())
+        self.assertNotIn('app.apk', self.order)
+
+    def test_queue_depth(self):
+        def depth():
+            return {priority: SCHEDULER_QUEUE_DEPTH.series.get(priority, 0)
+                    for priority in PRIORITY_WEIGHTS}
+        before = depth()
+
+        scheduler = Scheduler(1, model=FakeCostModel())
+        release, _ = self.block(scheduler, 'app.apk')
+        scheduler.submit('other.apk', BULK, self.record('other.apk'))
+        scheduler.submit('app.apk', BULK, self.record('app.apk'))
+        scheduler.submit('user.apk', INTERACTIVE, self.record('user.apk'))
+        self.assertEqual(depth(), {BULK: before[BULK] + 2,
+                                   INTERACTIVE: before[INTERACTIVE] + 1})
+        self.assertIn('ama_scheduler_queue_depth{priority="bulk"} %d' % (before[BULK] + 2),
+                      SCHEDULER_QUEUE_DEPTH.render())
+
+        release.set()
+        scheduler.shutdown()
+        self.assertEqual(depth(), before)
+
+        scheduler = Scheduler(1, model=FakeCostModel())
+        release, _ = self.block(scheduler, 'app.apk')
+        scheduler.submit('other.apk', BULK, self.record('other.apk'))
+        scheduler.submit('app.apk', BULK, self.record('app.apk'))
+        release.set()
+        scheduler.shutdown(cancel_pending=True)
+        self.assertEqual(depth(), before)
+
+    def test_context_failure(self):
+        released = []
+
+        def worker_context(slot):
+            if slot == 0:
+                raise OSError('no framework')
+            return 'framework-%d' % slot
+
+        with self.assertLogs(level='ERROR'):
+            scheduler = Scheduler(2, worker_context, released.append, FakeCostModel())
+            futures = [scheduler.submit('app%d.apk' % number, BULK, lambda context: context)
+                       for number in range(8)]
+            results = {future.result(TIMEOUT) for future in futures}
+            scheduler.shutdown()
+        self.assertLessEqual(results, {None, 'framework-1'})
+        self.assertEqual(released, ['framework-1'])
+        self.assertTrue(scheduler.model.saved)
+
+    def test_context_failure_of_every_worker(self):
+        def worker_context(slot):
+            raise OSError('no framework %d' % slot)
+
+        with self.assertLogs(level='ERROR'):
+            scheduler = Scheduler(2, worker_context, model=FakeCostModel())
+            future = scheduler.submit('app.apk', BULK, lambda context: context)
+            self.assertIsNone(future.result(TIMEOUT))
+            scheduler.shutdown()
+
+    def test_batch_order(self):
+        costs = {'a': 5, 'b': 1, 'c': 30, 'd': 3, 'e': 20}
+        self.assertEqual(batch_order(list(costs), costs.get, 1), ['b', 'd', 'a', 'e', 'c'])
+        # 59 / 2 workers: only the item of 30 is a worker's share
+        self.assertEqual(batch_order(list(costs), costs.get, 2), ['c', 'b', 'd', 'a', 'e'])
+        # 59 / 3 workers: the items of 20 and more start first
+        self.assertEqual(batch_order(list(costs), costs.get, 3), ['c', 'e', 'b', 'd', 'a'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Name search index tests. """
+
+import os
+import random
+import re
+import tempfile
+import unittest
+from unittest import mock
+from source import search_index
+from source.search_index import (
+    IndexWriter,
+    Segment,
+    merge_segments,
+    required_literals,
+    search_index as search,
+    segment_paths,
+    trigram_key,
+    write_segment
+)
+
+WORDS = ('push', 'gcm', 'c2dm', 'firebase', 'messaging', 'receiver', 'service', 'sync',
+         'account', 'provider', 'files', 'ação', '日本語', 'café')
+
+
+def random_apps(count, seed):
+    """
+    app -> (section, column, value) names with random dotted values
+    """
+    rng = random.Random(seed)
+    apps = {}
+    for app_id in range(count):
+        entries = []
+        for _ in range(rng.randint(1, 8)):
+            section = rng.choice(('<receiver>', '<service>', '<provider>'))
+            column = rng.choice(('name', 'authorities'))
+            value = '.'.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4)))
+            entries.append((section, column, value))
+        apps['app%03d' % app_id] = entries
+    return apps
+
+
+def brute_force(apps, pattern, section=None):
+    """
+    Rows matching a regular expression, without the index
+    """
+    regex = re.compile(pattern)
+    return sorted({(app, entry_section, column, value)
+                   for app, entries in apps.items()
+                   for entry_section, column, value in entries
+                   if regex.search(value) and section in (None, entry_section)})
+
+
+class SearchIndexTest(unittest.TestCase):
+    """
+    Segments, search and merge
+    """
+
+    PATTERNS = ('push', r'\.push\.', 'gcm|c2dm', 'fire(base)?', r'^account\.', r'sync$',
+                'a.*o', 'ação', '日本', 'rec[eE]iver', '(messaging){2}', 'x?files', 'nothing')
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.index_dir = self.tmp_dir.name
+
+    def flush(self, apps):
+        writer = IndexWriter(self.index_dir)
+        for app, entries in apps.items():
+            writer.add(app, entries)
+        writer.flush()
+
+    def test_required_literals(self):
+        self.assertEqual(required_literals(r'\.push\.'), ['.push.'])
+        self.assertEqual(required_literals('gcm|c2dm'), [])
+        self.assertEqual(required_literals('fire(base)?'), ['fire'])
+        self.assertEqual(required_literals('(com)+x'), ['com'])
+
+    def test_trigram_keys_sort_like_trigrams(self):
+        values = ['abc', 'abd', 'açb', 'zzz', 'ão.', '日本語', 'a\U0001f600b', 'a\U0010ffff\0']
+        self.assertEqual(sorted(values, key=trigram_key), sorted(values))
+
+    def test_search_matches_brute_force(self):
+        apps = random_apps(200, 1)
+        self.flush(apps)
+        for pattern in self.PATTERNS:
+            with self.subTest(pattern=pattern):
+                self.assertEqual(search(pattern, index_dir=self.index_dir),
+                                 brute_force(apps, pattern))
+        self.assertEqual(search('push', '<receiver>', self.index_dir),
+                         brute_force(apps, 'push', '<receiver>'))
+
+    def test_full_scan_without_parser(self):
+        apps = random_apps(50, 2)
+        self.flush(apps)
+        with mock.patch.object(search_index, 'sre_parse', None):
+            self.assertEqual(required_literals('push'), [])
+            self.assertEqual(search('push', index_dir=self.index_dir),
+                             brute_force(apps, 'push'))
+
+    def test_full_scan_when_parser_fails(self):
+        apps = random_apps(50, 3)
+        self.flush(apps)
+        with mock.patch.object(search_index.sre_parse, 'parse', side_effect=AttributeError), \
+                self.assertLogs(level='WARNING'):
+            self.assertEqual(search('push', index_dir=self.index_dir),
+                             brute_force(apps, 'push'))
+
+    def test_newer_segment_supersedes_app(self):
+        old = {'app1': [('<receiver>', 'name', 'com.old.push.Receiver')],
+               'app2': [('<receiver>', 'name', 'com.other.push.Receiver')]}
+        new = {'app1': [('<service>', 'name', 'com.new.push.Service')]}
+        self.flush(old)
+        self.flush(new)
+
+        self.assertEqual(search('push', index_dir=self.index_dir),
+                         [('app1', '<service>', 'name', 'com.new.push.Service'),
+                          ('app2', '<receiver>', 'name', 'com.other.push.Receiver')])
+
+    def test_merge(self):
+        batches = [random_apps(40, seed) for seed in range(4)]
+        expected = {}
+        for batch in batches:
+            # later batches analyse some apps again
+            self.flush(batch)
+            expected.update(batch)
+
+        paths = segment_paths(self.index_dir)
+        merge_segments(paths)
+        self.assertEqual(segment_paths(self.index_dir), paths[-1:])
+
+        segment = Segment(paths[-1])
+        try:
+            self.assertEqual(segment.app_count(), len(expected))
+            self.assertTrue(segment.has_app('app000'))
+            self.assertFalse(segment.has_app('app999'))
+        finally:
+            segment.close()
+        for pattern in self.PATTERNS:
+            with self.subTest(pattern=pattern):
+                self.assertEqual(search(pattern, index_dir=self.index_dir),
+                                 brute_force(expected, pattern))
+
+    def test_corrupted_segment_is_skipped(self):
+        apps = random_apps(20, 5)
+        self.flush(apps)
+        with open(os.path.join(self.index_dir, 'segment-00000099.tri'), 'wb') as segment_file:
+            segment_file.write(b'\0' * 64)
+
+        with self.assertLogs(level='ERROR'):
+            self.assertEqual(search('push', index_dir=self.index_dir),
+                             brute_force(apps, 'push'))
+
+    def test_empty_segment(self):
+        path = os.path.join(self.index_dir, 'segment-00000000.tri')
+        write_segment(path, {'app1': []})
+        self.assertEqual(search('push', index_dir=self.index_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Watch folder tests. """
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+from source import watch
+from source.scheduler import BULK
+from source.watch import (
+    AnalysedApks,
+    submit_dropped_apk
+)
+
+
+class AnalysedApksTest(unittest.TestCase):
+    """
+    Analysed contents kept between watch runs
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.history_path = os.path.join(self.tmp_dir.name, 'watch_history.json')
+        self.apk_path = os.path.join(self.tmp_dir.name, 'app.apk')
+        with open(self.apk_path, 'wb') as apk_file:
+            apk_file.write(b'apk content')
+        self.scheduler = mock.Mock()
+
+    def run_watch(self, analysis_result=True):
+        """
+        Submit the apk as a watch started on the directory would, and run its job
+        """
+        analysed = AnalysedApks(self.history_path)
+        self.scheduler.reset_mock()
+        submit_dropped_apk(self.scheduler, self.apk_path, BULK, analysed, '', mock.Mock())
+        for call in self.scheduler.submit.call_args_list:
+            job = call.args[2]
+            with mock.patch.object(watch, 'decompile_cmd', return_value=True), \
+                    mock.patch.object(watch, 'analyse_app_serial',
+                                      return_value=analysis_result):
+                job('frame')
+        return self.scheduler.submit.call_count
+
+    def test_restart_skips_analysed_content(self):
+        self.assertEqual(self.run_watch(), 1)
+        with mock.patch.object(watch, 'file_sha256') as file_sha256:
+            self.assertEqual(self.run_watch(), 0)
+        # the unchanged file is not read again
+        file_sha256.assert_not_called()
+
+    def test_failed_analysis_is_retried(self):
+        self.assertEqual(self.run_watch(analysis_result=False), 1)
+        self.assertEqual(self.run_watch(), 1)
+
+    def test_changed_file_is_hashed_again(self):
+        self.assertEqual(self.run_watch(), 1)
+        with open(self.apk_path, 'wb') as apk_file:
+            apk_file.write(b'new apk content')
+        self.assertEqual(self.run_watch(), 1)
+
+        # the same content under another name is still known
+        os.rename(self.apk_path, os.path.join(self.tmp_dir.name, 'renamed.apk'))
+        self.apk_path = os.path.join(self.tmp_dir.name, 'renamed.apk')
+        self.assertEqual(self.run_watch(), 0)
+
+    def test_content_scheduled_once(self):
+        analysed = AnalysedApks(self.history_path)
+        submit_dropped_apk(self.scheduler, self.apk_path, BULK, analysed, '', mock.Mock())
+        submit_dropped_apk(self.scheduler, self.apk_path, BULK, analysed, '', mock.Mock())
+        self.assertEqual(self.scheduler.submit.call_count, 1)
+
+    def test_unreadable_history(self):
+        with open(self.history_path, 'w') as history_file:
+            history_file.write('not json')
+        with self.assertLogs(level='ERROR'):
+            analysed = AnalysedApks(self.history_path)
+        self.assertEqual(analysed.hashes, set())
+
+
+if __name__ == '__main__':
+    unittest.main()